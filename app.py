@@ -1,29 +1,165 @@
+import io
 import os
+import tempfile
 import uuid
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from flask_mail import Mail, Message
-from werkzeug.security import generate_password_hash, check_password_hash
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, abort, Response, stream_with_context, has_request_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from database import db, User, Doctor, Appointment, Hospital
-from datetime import datetime
+from database import (db, User, Doctor, Appointment, Hospital, WorkingHours, ScheduleException, configure_sqlite,
+                      ensure_row_versions, ensure_reminder_marker)
+from slots import parse_date, get_slots_for_day, get_slots_for_range, MAX_RANGE_DAYS
+import queries
+import facets
+import search
+import outbox
+import appointment_status
+import booking
+import availability
+import identity
+import stats
+import response_cache
+import assets
+import templating
+import metrics
+import passwords
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-this-in-production'
 app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 hours in seconds
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'doctor_platform.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'doctor_platform.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connection pool, one per process (each gunicorn worker has its own)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 20),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT') or 30),  # seconds to wait for a free connection
+}
+
+# Applied to every new SQLite connection (see database.configure_sqlite)
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',         # readers no longer block the writer (or each other)
+    'synchronous': 'NORMAL',       # safe with WAL; fsync at checkpoints instead of every commit
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000),  # wait for the write lock instead of "database is locked"
+    'cache_size': -64000,          # page cache in KiB (64 MB) per connection
+    'mmap_size': 268435456,        # memory-map up to 256 MB of the database file
+}
+
+# Template events per chunk in streamed responses
+EXPORT_STREAM_BUFFER = 2000
+
+# Show "Cardiology (42)" style counts in the directory filter dropdowns
+app.config['DIRECTORY_FACET_COUNTS'] = True
+
 # Email configuration for Gmail
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT') or 587)
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME') or 'your-email@gmail.com'
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD') or 'your-app-password'
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_USERNAME') or 'your-email@gmail.com'
 
-db.init_app(app)
-mail = Mail(app)
+# Email outbox (see outbox.py). Set EMAIL_WORKER_THREAD to False when running
+# `flask --app "app:create_app()" email-worker` as a separate process instead.
+app.config['EMAIL_WORKER_THREAD'] = True
+app.config['EMAIL_BATCH_SIZE'] = 50
+app.config['EMAIL_MAX_ATTEMPTS'] = 5
+app.config['EMAIL_RETRY_BASE_SECONDS'] = 30  # doubles after every failed attempt
+app.config['EMAIL_POLL_SECONDS'] = 5
+app.config['EMAIL_LEASE_SECONDS'] = 300  # reclaim jobs from a worker that died mid-batch
+
+# Appointment reminders (see reminders.py): sent up to REMINDER_LEAD_HOURS before
+# the appointment by `flask reminder-scheduler`, or by a thread in every web
+# process when REMINDER_SCHEDULER_THREAD is on (safe: reminders are claimed atomically)
+app.config['REMINDER_SCHEDULER_THREAD'] = os.environ.get('REMINDER_SCHEDULER_THREAD', 'false').lower() == 'true'
+app.config['REMINDER_LEAD_HOURS'] = 24
+app.config['REMINDER_POLL_SECONDS'] = 60
+app.config['REMINDER_BATCH_SIZE'] = 1000
+
+# Booking: how long picking a time reserves the slot while the form is filled in
+app.config['SLOT_HOLD_SECONDS'] = 300
+# Days ahead covered by the free-slot bitmaps behind /api/next-available (see availability.py)
+app.config['AVAILABILITY_HORIZON_DAYS'] = 90
+# Closed appointments older than this many days move to appointment_archive
+# (`flask archive-appointments`, see archive.py), in batches of this many rows
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 180)
+app.config['ARCHIVE_BATCH_SIZE'] = 5000
+
+# Admin stats: read totals from the stat_counter table (one query) instead of
+# grouping the tables on every dashboard load (see stats.py)
+app.config['STATS_USE_COUNTERS'] = True
+# Largest date window /admin/api/stats accepts
+STATS_MAX_WINDOW_DAYS = 366
+
+# Response cache for public pages (see response_cache.py): 'memory' (per
+# process), 'filesystem' (shared by the workers on one host) or '' to disable
+app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+app.config['RESPONSE_CACHE_DIR'] = os.environ.get('RESPONSE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'medibook-response-cache')
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = 2000
+app.config['RESPONSE_CACHE_TTL_SECONDS'] = 300  # upper bound, in case a write bypasses the version bump
+app.config['RESPONSE_CACHE_VERSION_CHECK_SECONDS'] = 1  # how stale another worker's writes can look
+
+# Static files: `flask build-assets` fingerprints them (see assets.py). Behind
+# nginx/Apache set USE_X_SENDFILE=1 to let the front server send the files.
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+
+# Templates (see templating.py): compiled bytecode shared on disk by the
+# workers, all templates loaded at startup, card fragments cached per row
+# version, and render/SQL time recorded per route, template and block
+app.config['JINJA_BYTECODE_CACHE_DIR'] = os.environ.get('JINJA_BYTECODE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'medibook-jinja-cache')
+app.config['JINJA_PRECOMPILE'] = True
+app.config['FRAGMENT_CACHE_SIZE'] = 5000
+app.config['RENDER_PROFILING'] = os.environ.get('RENDER_PROFILING', '1') == '1'
+
+# Request metrics (see metrics.py), served at /admin/metrics in Prometheus
+# format. Scrapers send `Authorization: Bearer $METRICS_TOKEN`; gunicorn sets
+# METRICS_DIR so the workers' numbers add up.
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS') or 100)
+# Profile a single request by sending `X-Profile: $PROFILE_TOKEN`; off when unset
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+
+# Async read-only API (async_api.py, served with the app by asgi.py): its own
+# aiosqlite connection pool per process. Each connection is a thread that
+# competes with the event loop for the GIL, so a couple per process answer
+# more evenly than many; scale with processes. A request waits up to the
+# timeout for a connection, then gets 503
+app.config['ASYNC_DB_POOL_SIZE'] = int(os.environ.get('ASYNC_DB_POOL_SIZE') or 2)
+app.config['ASYNC_DB_MAX_OVERFLOW'] = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW') or 0)
+app.config['ASYNC_DB_POOL_TIMEOUT'] = int(os.environ.get('ASYNC_DB_POOL_TIMEOUT') or 10)
+
+# Membership IDs reserved per process at a time (see membership.py)
+app.config['MEMBERSHIP_BLOCK_SIZE'] = 100
+
+# Password hashing (see passwords.py): algorithm and cost of new hashes
+# (older ones are replaced at login), hashing processes per app process
+# (0 = hash on the request thread), how many hashes may be queued or
+# running, and how long a login waits for a place before it gets 503.
+# Waiting holds a request thread, so by default logins do not wait
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:600000'
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS') or 1)
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE') or 2)
+app.config['PASSWORD_HASH_WAIT_SECONDS'] = float(os.environ.get('PASSWORD_HASH_WAIT_SECONDS') or 0)
+PASSWORD_BUSY_RETRY_AFTER = 2
+
+# Bulk doctor/hospital import (see importer.py): rows per transaction,
+# processes hashing passwords in `flask import-directory` (default: one per
+# CPU; uploads in the admin panel use the PASSWORD_HASH_* pool), and
+# the initial password of rows without one (as for doctors added one by one)
+app.config['IMPORT_CHUNK_SIZE'] = 1000
+app.config['IMPORT_HASH_WORKERS'] = int(os.environ.get('IMPORT_HASH_WORKERS') or 0) or None
+app.config['IMPORT_DEFAULT_PASSWORD'] = 'doctor123'
+# Uploads must finish within the request timeout: about 1,000 rows/s, plus
+# ~0.3 s per password given in the file at the default hash cost
+app.config['IMPORT_UPLOAD_MAX_BYTES'] = 1024 * 1024
+app.config['IMPORT_UPLOAD_MAX_PASSWORDS'] = 100
+
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
@@ -40,9 +176,9 @@ def get_current_admin():
         clear_admin_session()
         return None
     
-    # Get user and verify it exists and has admin role
+    # Get user and verify it exists and has admin role (cached, see identity.py)
     try:
-        admin_user = User.query.get(session['admin_user_id'])
+        admin_user = identity.get_user(session['admin_user_id'])
         if admin_user and admin_user.role == 'admin':
             return admin_user
         else:
@@ -77,6 +213,10 @@ def inject_admin_user():
     # CRITICAL SECURITY: Only show admin panel if admin is properly authenticated
     # AND no regular user is logged in (unless the regular user IS the admin)
     
+    # Templates rendered outside a request (e.g. emails in the outbox worker)
+    if not has_request_context():
+        return dict(admin_user=None)
+
     admin_user = get_current_admin()
     
     # If no valid admin session, definitely no admin panel
@@ -96,62 +236,61 @@ def inject_admin_user():
     # - The regular user IS the admin (same person)
     return dict(admin_user=admin_user)
 
-# Print email configuration status on startup
-if app.config.get('MAIL_USERNAME') and app.config.get('MAIL_USERNAME') != 'your-email@gmail.com':
-    print(f"✅ Email configured: {app.config.get('MAIL_USERNAME')}")
-    print(f"✅ SMTP Server: {app.config.get('MAIL_SERVER')}:{app.config.get('MAIL_PORT')}")
-else:
-    print("⚠️  WARNING: Email not configured. Set MAIL_USERNAME and MAIL_PASSWORD environment variables.")
-    print("   Emails will not be sent until configured.")
-
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity.get_user(int(user_id))
 
-def send_appointment_confirmation_email(appointment):
-    """Send confirmation email to patient when appointment is confirmed"""
-    try:
-        patient = appointment.patient
-        doctor = appointment.doctor
-        
-        # Check if email is configured
-        if not app.config.get('MAIL_USERNAME') or app.config.get('MAIL_USERNAME') == 'your-email@gmail.com':
-            print("ERROR: Email not configured. Please set MAIL_USERNAME and MAIL_PASSWORD environment variables.")
-            return False
-        
-        if not app.config.get('MAIL_PASSWORD') or app.config.get('MAIL_PASSWORD') == 'your-app-password':
-            print("ERROR: Email password not configured. Please set MAIL_PASSWORD environment variable.")
-            return False
-        
-        print(f"Attempting to send email to: {patient.email}")
-        print(f"Using SMTP server: {app.config.get('MAIL_SERVER')}")
-        print(f"Using email account: {app.config.get('MAIL_USERNAME')}")
-        
-        # Create email message
-        msg = Message(
-            subject='Appointment Confirmed - MediBook',
-            recipients=[patient.email],
-            html=render_template('emails/appointment_confirmation.html', 
-                               appointment=appointment,
-                               patient=patient,
-                               doctor=doctor)
-        )
-        
-        mail.send(msg)
-        print(f"✅ Email sent successfully to {patient.email}")
-        return True
-    except Exception as e:
-        import traceback
-        print(f"❌ Error sending email: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
-        traceback.print_exc()
+def email_configured():
+    """True when SMTP credentials have been set"""
+    if not outbox.configured(app.config):
+        print("ERROR: Email not configured. Please set MAIL_USERNAME and MAIL_PASSWORD environment variables.")
         return False
+    return True
+
+def build_appointment_confirmation_email(job):
+    """Render the confirmation email for an outbox job (runs in the email worker)"""
+    from flask_mail import Message
+    appointment = job.appointment
+    patient = appointment.patient
+    doctor = appointment.doctor
+    return Message(
+        subject='Appointment Confirmed - MediBook',
+        recipients=[patient.email],
+        html=render_template('emails/appointment_confirmation.html',
+                           appointment=appointment,
+                           patient=patient,
+                           doctor=doctor)
+    )
+
+outbox.register('appointment_confirmation', build_appointment_confirmation_email)
+
+def build_appointment_reminder_email(job):
+    """Render the reminder email for an outbox job; None if the appointment was cancelled since"""
+    appointment = job.appointment
+    if appointment.status != 'confirmed':
+        return None
+    from flask_mail import Message
+    return Message(
+        subject='Appointment Reminder - MediBook',
+        recipients=[appointment.patient.email],
+        html=render_template('emails/appointment_reminder.html',
+                           appointment=appointment,
+                           patient=appointment.patient,
+                           doctor=appointment.doctor)
+    )
+
+outbox.register('appointment_reminder', build_appointment_reminder_email)
 
 @app.route('/')
+@response_cache.cached('doctor', 'hospital')
 def index():
-    doctors = Doctor.query.limit(4).all()
+    doctors = queries.featured_doctors(4).all()
     return render_template('index.html', doctors=doctors)
 
+@app.route('/static/build/<path:filename>')
+def hashed_static(filename):
+    return assets.send_asset(filename)
+
 from functools import wraps
 
 # Admin Decorator - uses separate admin session
@@ -168,33 +307,197 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- JSON SERIALIZERS ---
+def doctor_json(doctor):
+    return {
+        'id': doctor.id,
+        'name': doctor.user.name,
+        'specialization': doctor.specialization,
+        'city': doctor.city,
+        'country': doctor.country,
+        'experience_years': doctor.experience_years,
+        'consultation_fee': doctor.consultation_fee,
+        'hospital': doctor.hospital.name if doctor.hospital else None
+    }
+
+def hospital_json(hospital):
+    return {
+        'id': hospital.id,
+        'name': hospital.name,
+        'city': hospital.city,
+        'country': hospital.country,
+        'specialties': hospital.specialties,
+        'image_url': hospital.image_url,
+        'doctor_count': len(hospital.doctors)
+    }
+
+def doctor_detail_json(doctor):
+    return dict(doctor_json(doctor), hospital_id=doctor.hospital_id, image_url=doctor.image_url,
+                education=doctor.education, bio=doctor.bio)
+
+def hospital_detail_json(hospital):
+    return dict(hospital_json(hospital), description=hospital.description,
+                doctors=[doctor_json(d) for d in hospital.doctors])
+
+def appointment_json(appt):
+    return {
+        'id': appt.id,
+        'date_time': appt.date_time.isoformat(),
+        'patient': appt.patient.name,
+        'doctor': appt.doctor.user.name,
+        'type': appt.type,
+        'status': appt.status,
+        'notes': appt.notes
+    }
+
 # --- API ROUTES ---
 @app.route('/api/slots/<int:doctor_id>')
+# Short TTL: holds expire without a write
+@response_cache.cached('appointment', ttl=30)
 def get_slots(doctor_id):
+    # The patient's own hold shows as available to them
+    patient_id = current_user.id if current_user.is_authenticated else None
+    # Range mode: ?from=YYYY-MM-DD&to=YYYY-MM-DD returns {date: [slots]} in one response
+    from_str = request.args.get('from')
+    to_str = request.args.get('to')
+    if from_str or to_str:
+        try:
+            start_date = parse_date(from_str)
+            end_date = parse_date(to_str or from_str)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Dates must be in YYYY-MM-DD format.'}), 400
+        if end_date < start_date or (end_date - start_date).days >= MAX_RANGE_DAYS:
+            return jsonify({'error': f'Range must cover 1 to {MAX_RANGE_DAYS} days.'}), 400
+        return jsonify(get_slots_for_range(doctor_id, start_date, end_date, patient_id))
+
     date_str = request.args.get('date') # YYYY-MM-DD
     if not date_str:
         return jsonify([])
-        
-    # Mock logic: Mon-Fri 9-5
-    # In real app: check DB for bookings
-    start_date = datetime.strptime(date_str, '%Y-%m-%d')
-    slots = []
-    
-    # Simple hours 9:00 to 17:00
-    for hour in range(9, 17):
-        time_slot = f"{hour:02d}:00"
-        
-        # Check collision - only block slots with confirmed appointments
-        # Pending appointments don't block slots until they're confirmed
-        dt = datetime.strptime(f"{date_str} {time_slot}", '%Y-%m-%d %H:%M')
-        booking = Appointment.query.filter_by(doctor_id=doctor_id, date_time=dt).filter(Appointment.status == 'confirmed').first()
-        
-        slots.append({
-            'time': time_slot,
-            'available': booking is None
-        })
-        
-    return jsonify(slots)
+
+    # Mock logic: 9-5 every day, minus pending/confirmed bookings and other patients' holds
+    try:
+        day = parse_date(date_str)
+    except ValueError:
+        return jsonify({'error': 'Date must be in YYYY-MM-DD format.'}), 400
+    return jsonify(get_slots_for_day(doctor_id, day, patient_id))
+
+@app.route('/api/next-available')
+# Short TTL: the default `after` is the current time
+@response_cache.cached('appointment', 'doctor', ttl=30)
+def next_available():
+    # Soonest free slot per doctor, across the doctors matching the filters
+    now = datetime.now()
+    after_str = request.args.get('after')
+    try:
+        after = datetime.fromisoformat(after_str) if after_str else now
+        if after.tzinfo:
+            raise ValueError('local time expected')
+    except ValueError:
+        return jsonify({'error': 'after must be YYYY-MM-DD or YYYY-MM-DDTHH:MM.'}), 400
+    limit = min(max(1, request.args.get('limit', 10, type=int)), 50)
+    results = availability.next_available(max(after, now), specialty=request.args.get('specialty') or None,
+                                          city=request.args.get('city') or None, limit=limit)
+    return jsonify({'items': availability.describe(results)})
+
+@app.route('/api/schedule', methods=['GET', 'PUT'])
+@login_required
+def doctor_schedule():
+    # A doctor's weekly hours: {"hours": [{"weekday": 0, "start": 9, "end": 17}, ...]};
+    # PUT replaces them all, an empty list restores the default hours
+    doctor = current_user.doctor_profile if current_user.role == 'doctor' else None
+    if doctor is None:
+        return jsonify({'error': 'Only doctors have a schedule.'}), 403
+    if request.method == 'PUT':
+        hours = (request.get_json(silent=True) or {}).get('hours')
+        try:
+            if not isinstance(hours, list):
+                raise ValueError('Expected {"hours": [{"weekday", "start", "end"}, ...]}.')
+            rows = []
+            for item in hours:
+                if not isinstance(item, dict) or item.get('weekday') not in range(7):
+                    raise ValueError('weekday must be 0 (Monday) to 6.')
+                availability.check_hours(item.get('start'), item.get('end'))
+                rows.append({'doctor_id': doctor.id, 'weekday': item['weekday'],
+                             'start_hour': item['start'], 'end_hour': item['end']})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Bulk statements skip the mapper hooks (one rebuild per row): rebuild once
+        WorkingHours.query.filter_by(doctor_id=doctor.id).delete()
+        if rows:
+            db.session.execute(insert(WorkingHours), rows)
+        availability.rebuild(db.session.connection(), [doctor.id])
+        response_cache.bump(['appointment'])
+        db.session.commit()
+    today = datetime.now().date()
+    exceptions = ScheduleException.query.filter(ScheduleException.doctor_id == doctor.id,
+                                                ScheduleException.date >= today).order_by(ScheduleException.date)
+    return jsonify({
+        'hours': [{'weekday': h.weekday, 'start': h.start_hour, 'end': h.end_hour} for h in
+                  WorkingHours.query.filter_by(doctor_id=doctor.id).order_by(WorkingHours.weekday, WorkingHours.start_hour)],
+        'exceptions': [{'id': e.id, 'date': e.date.isoformat(), 'kind': e.kind, 'start': e.start_hour,
+                        'end': e.end_hour} for e in exceptions],
+    })
+
+@app.route('/api/schedule/exceptions', methods=['POST'])
+@login_required
+def add_schedule_exception():
+    # {"date": "YYYY-MM-DD", "kind": "off" | "extra", "start": 13, "end": 17}; "off" without hours = the whole day
+    doctor = current_user.doctor_profile if current_user.role == 'doctor' else None
+    if doctor is None:
+        return jsonify({'error': 'Only doctors have a schedule.'}), 403
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind', 'off')
+    try:
+        day = parse_date(data.get('date') or '').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'date must be YYYY-MM-DD.'}), 400
+    if kind not in availability.EXCEPTION_KINDS:
+        return jsonify({'error': "kind must be 'off' or 'extra'."}), 400
+    try:
+        if data.get('start') is not None or kind == 'extra':
+            availability.check_hours(data.get('start'), data.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    exception = ScheduleException(doctor_id=doctor.id, date=day, kind=kind,
+                                  start_hour=data.get('start'), end_hour=data.get('end'))
+    db.session.add(exception)
+    db.session.commit()
+    return jsonify({'id': exception.id}), 201
+
+@app.route('/api/schedule/exceptions/<int:exception_id>', methods=['DELETE'])
+@login_required
+def delete_schedule_exception(exception_id):
+    doctor = current_user.doctor_profile if current_user.role == 'doctor' else None
+    exception = db.session.get(ScheduleException, exception_id)
+    if doctor is None or exception is None or exception.doctor_id != doctor.id:
+        return jsonify({'error': 'Not found.'}), 404
+    db.session.delete(exception)
+    db.session.commit()
+    return '', 204
+
+@app.route('/api/slots/<int:doctor_id>/hold', methods=['POST'])
+@login_required
+def hold_slot(doctor_id):
+    # Reserve the picked time while the patient fills in the booking form
+    if current_user.role != 'patient':
+        return jsonify({'error': 'Only patients can book appointments.'}), 403
+    Doctor.query.get_or_404(doctor_id)
+    data = request.get_json(silent=True) or request.form
+    try:
+        when = datetime.strptime(f"{data.get('date')} {data.get('time')}", '%Y-%m-%d %H:%M')
+    except ValueError:
+        return jsonify({'error': 'Expected date YYYY-MM-DD and time HH:MM.'}), 400
+    try:
+        expires_at = booking.hold_slot(doctor_id, when, current_user.id)
+    except booking.SlotUnavailable as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'held': True, 'expires_at': expires_at.isoformat() + 'Z'})
+
+@app.route('/api/search')
+def search_directory():
+    # Ranked prefix search over doctors and hospitals, for typeahead
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(search.search(request.args.get('q', ''), limit=max(1, limit)))
 
 # --- ADMIN ROUTES ---
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -209,11 +512,14 @@ def admin_login():
         password = request.form.get('password')
         user = User.query.filter_by(email=email).first()
         
-        if user and check_password_hash(user.password, password):
+        valid, stale = passwords.verify(user.password, password) if user else (False, False)
+        if valid:
             if user.role != 'admin':
                 flash('Access denied. Admin privileges required.', 'error')
                 return redirect(url_for('admin_login'))
                 
+            if stale:
+                passwords.upgrade(user, password)
             # Clear any existing admin session first (security)
             clear_admin_session()
             # Set admin session independently (doesn't affect regular user session)
@@ -229,39 +535,111 @@ def admin_login():
 @admin_required
 def admin_dashboard():
     # Stats
-    total_users = User.query.count()
-    total_doctors = Doctor.query.count()
-    total_appts = Appointment.query.count()
-    pending_appts = Appointment.query.filter_by(status='pending').count()
+    totals = admin_totals()
     
     # Admin can see all recent appointments
-    recent_appts = Appointment.query.order_by(Appointment.created_at.desc()).limit(5).all()
+    recent_appts = queries.recent_appointments(5).all()
     
     return render_template('admin/dashboard.html', 
-                          total_users=total_users, 
-                          total_doctors=total_doctors,
-                          total_appts=total_appts,
-                          pending_appts=pending_appts,
+                          total_users=totals['user']['total'], 
+                          total_doctors=totals['doctor']['total'],
+                          total_appts=totals['appointment']['total'],
+                          pending_appts=totals['appointment']['by_status'].get('pending', 0),
                           recent_appts=recent_appts)
 
+def admin_totals():
+    if app.config['STATS_USE_COUNTERS']:
+        return stats.read_counters()
+    return stats.grouped_counts()
+
+@app.route('/admin/api/stats')
+@admin_required
+def admin_api_stats():
+    # Totals plus per-day / per-doctor / per-specialization appointment counts
+    # for ?from=YYYY-MM-DD&to=YYYY-MM-DD (default: 30 days either side of today)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    try:
+        start = parse_date(request.args['from']) if request.args.get('from') else today - timedelta(days=30)
+        end = parse_date(request.args['to']) if request.args.get('to') else today + timedelta(days=30)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format.'}), 400
+    end += timedelta(days=1)  # 'to' is inclusive
+    if end <= start or (end - start).days > STATS_MAX_WINDOW_DAYS:
+        return jsonify({'error': f'Range must cover 1 to {STATS_MAX_WINDOW_DAYS} days.'}), 400
+    top = min(max(request.args.get('top', 10, type=int), 1), 100)
+    return jsonify({
+        'totals': admin_totals(),
+        'appointments': stats.appointment_window(start, end, top),
+    })
+
+@app.route('/admin/api/render-profile', methods=['GET', 'DELETE'])
+@admin_required
+def admin_api_render_profile():
+    # Per route: average total, SQL, template and remaining Python time since
+    # start, plus per-template and per-block render times in this worker.
+    # DELETE starts a new template/block sample.
+    if request.method == 'DELETE':
+        templating.reset_profile()
+        return jsonify({'reset': True})
+    return jsonify(dict(templating.profile_snapshot(), routes=metrics.route_summary()))
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    # Prometheus scrape target: an admin session or the METRICS_TOKEN bearer token
+    if not metrics.token_matches(request, app.config['METRICS_TOKEN']):
+        admin_user = get_current_admin()
+        if not admin_user or admin_user.role != 'admin':
+            abort(403)
+    return Response(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/admin/appointments')
 @admin_required
 def admin_appointments():
-    appointments = Appointment.query.order_by(Appointment.date_time.desc()).all()
-    return render_template('admin/appointments.html', appointments=appointments)
+    try:
+        appointments, next_cursor = queries.appointments_page(request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+    return render_template('admin/appointments.html', appointments=appointments, next_cursor=next_cursor)
+
+@app.route('/admin/api/appointments')
+@admin_required
+def admin_appointments_json():
+    try:
+        appointments, next_cursor = queries.appointments_page(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor.'}), 400
+    return jsonify({'items': [appointment_json(a) for a in appointments], 'next_cursor': next_cursor})
+
+@app.route('/admin/appointments/export')
+@admin_required
+def admin_appointments_export():
+    # Rows are fetched in keyset batches while the response is being sent, so
+    # the first bytes go out immediately and memory stays flat. Buffering
+    # groups the template's many small yields into reasonably sized chunks.
+    template = app.jinja_env.get_template('admin/appointments_export.html')
+    context = {'rows': queries.iter_appointment_export()}
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(EXPORT_STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype='text/html')
 
 @app.route('/admin/appointment/<int:id>/<action>')
 @admin_required
 def admin_appt_action(id, action):
     appt = Appointment.query.get_or_404(id)
     if action == 'confirm':
-        appt.status = 'confirmed'
-        db.session.commit()
-        
-        # Send confirmation email to patient
-        email_sent = send_appointment_confirmation_email(appt)
-        if email_sent:
-            flash('Appointment confirmed successfully! Confirmation email sent to patient.', 'success')
+        # Refuses to confirm when another appointment is active for the same
+        # doctor and time; otherwise queues the confirmation email to the
+        # patient in the same transaction for the outbox worker to send
+        email_queued = email_configured()
+        result = appointment_status.bulk_update_status([appt.id], 'confirm', queue_emails=email_queued)[appt.id]
+        if result == 'conflict':
+            flash('Cannot confirm: another appointment is already booked for this doctor at this time.', 'error')
+        elif result == 'unchanged':
+            flash('Appointment is already confirmed.', 'success')
+        elif email_queued:
+            outbox.notify()
+            flash('Appointment confirmed successfully! Confirmation email is on its way to the patient.', 'success')
         else:
             flash('Appointment confirmed, but email could not be sent. Please check email configuration.', 'warning')
     elif action == 'cancel':
@@ -269,12 +647,62 @@ def admin_appt_action(id, action):
         db.session.commit()
         flash('Appointment cancelled.', 'success')
     else:
-        # Reset to pending if needed
+        # Reset to pending if needed (the slot may have been booked since)
         appt.status = 'pending'
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Cannot reopen: another appointment is already booked for this doctor at this time.', 'error')
         
     return redirect(request.referrer or url_for('admin_appointments'))
 
+@app.route('/admin/appointments/bulk', methods=['POST'])
+@admin_required
+def admin_appointments_bulk():
+    # Form posts from the appointments table, or JSON {"ids": [...], "action": "confirm"}
+    data = request.get_json(silent=True) if request.is_json else None
+    if data is not None:
+        ids, action = data.get('ids') or [], data.get('action')
+    else:
+        ids, action = request.form.getlist('ids'), request.form.get('action')
+
+    if action not in appointment_status.BULK_ACTIONS:
+        return bulk_error('Unknown action.')
+    try:
+        ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return bulk_error('Appointment ids must be integers.')
+    if not ids:
+        return bulk_error('No appointments selected.')
+
+    queue_emails = action == 'confirm' and email_configured()
+    try:
+        results = appointment_status.bulk_update_status(ids, action, queue_emails=queue_emails)
+    except ValueError as e:
+        return bulk_error(str(e))
+    if queue_emails:
+        outbox.notify()
+
+    summary = {}
+    for result in results.values():
+        summary[result] = summary.get(result, 0) + 1
+    if data is not None:
+        return jsonify({'results': {str(k): v for k, v in results.items()},
+                        'summary': summary, 'emails_queued': queue_emails})
+
+    flash('Updated appointments: ' + ', '.join(f"{n} {result.replace('_', ' ')}" for result, n in sorted(summary.items())),
+          'warning' if summary.get('conflict') else 'success')
+    if action == 'confirm' and not queue_emails:
+        flash('Confirmation emails could not be queued. Please check email configuration.', 'warning')
+    return redirect(request.referrer or url_for('admin_appointments'))
+
+def bulk_error(message):
+    if request.is_json:
+        return jsonify({'error': message}), 400
+    flash(message, 'error')
+    return redirect(request.referrer or url_for('admin_appointments'))
+
 @app.route('/admin/doctors', methods=['GET', 'POST'])
 @admin_required
 def admin_doctors():
@@ -291,19 +719,58 @@ def admin_doctors():
         if User.query.filter_by(email=email).first():
             flash('Email exists', 'error')
         else:
-            u = User(name=name, email=email, role='doctor', password=generate_password_hash('doctor123', method='pbkdf2:sha256'))
+            u = User(name=name, email=email, role='doctor', password=passwords.hash_password('doctor123'))
             db.session.add(u)
             db.session.commit()
             
             d = Doctor(user_id=u.id, specialization=specialization, city=city, country=country, consultation_fee=fee)
             db.session.add(d)
             db.session.commit()
+            facets.invalidate('doctor')
+            identity.invalidate(u.id)
             flash('Doctor added', 'success')
         return redirect(url_for('admin_doctors'))
         
-    doctors = Doctor.query.all()
+    doctors = queries.admin_doctor_list().all()
     return render_template('admin/doctors.html', doctors=doctors)
 
+@app.route('/admin/import', methods=['POST'])
+@admin_required
+def admin_import():
+    # Upload a CSV / JSON Lines file of doctors and hospitals (see importer.py).
+    # Big files belong to `flask import-directory`, which is not bound by the
+    # request timeout.
+    import importer
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    max_bytes = app.config['IMPORT_UPLOAD_MAX_BYTES']
+    try:
+        # Checked before the form is parsed
+        if request.content_length is None or request.content_length > max_bytes:
+            raise importer.ImportFileError(f'Uploads are limited to {max_bytes // 1024} KB: '
+                                           f'import bigger files with `flask import-directory`.')
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            raise importer.ImportFileError('Choose a file to import.')
+        fmt = importer.format_for(upload.filename)
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        # Hash in the app's password pool (may answer 503), not a pool per request
+        report = importer.import_file(stream, fmt, dict(app.config, IMPORT_HASH_WORKERS=0,
+                                                        IMPORT_MAX_PASSWORDS=app.config['IMPORT_UPLOAD_MAX_PASSWORDS']))
+    except (importer.ImportFileError, UnicodeDecodeError) as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('admin_doctors'))
+
+    if wants_json:
+        return jsonify(report.as_dict())
+    flash(f'Import finished: {report.summary()}', 'warning' if report.failed else 'success')
+    for line, message in report.errors[:10]:
+        flash(f'Line {line}: {message}', 'error')
+    if report.failed > 10:
+        flash(f'... and {report.failed - 10} more rows with errors.', 'error')
+    return redirect(url_for('admin_doctors'))
+
 @app.route('/admin/hospitals', methods=['GET', 'POST'])
 @admin_required
 def admin_hospitals():
@@ -316,6 +783,7 @@ def admin_hospitals():
         h = Hospital(name=name, city=city, country=country, specialties=specialties, image_url="https://via.placeholder.com/400")
         db.session.add(h)
         db.session.commit()
+        facets.invalidate('hospital')
         flash('Hospital added', 'success')
         return redirect(url_for('admin_hospitals'))
         
@@ -323,45 +791,86 @@ def admin_hospitals():
     return render_template('admin/hospitals.html', hospitals=hospitals)
 
 @app.route('/doctors')
+@response_cache.cached('doctor', 'hospital')
 def list_doctors():
     specialty = request.args.get('specialty')
     city = request.args.get('city')
     country = request.args.get('country')
     
-    query = Doctor.query
-    if specialty:
-        query = query.filter(Doctor.specialization.ilike(f'%{specialty}%'))
-    if city:
-        query = query.filter(Doctor.city.ilike(f'%{city}%'))
-    if country:
-        query = query.filter(Doctor.country.ilike(f'%{country}%'))
-        
-    doctors = query.all()
-    
-    # Get unique values for filters
-    specialties = sorted(set([d.specialization for d in Doctor.query.all()]))
-    cities = sorted(set([d.city for d in Doctor.query.filter(Doctor.city != None).all()]))
-    countries = sorted(set([d.country for d in Doctor.query.filter(Doctor.country != None).all()]))
+    # Filter values come from the dropdowns, so exact matches can use the indexes
+    try:
+        doctors, next_cursor = queries.doctors_page(specialty, city, country, request.args.get('cursor'))
+    except ValueError:
+        abort(400)
     
-    return render_template('doctors.html', doctors=doctors, specialties=specialties, cities=cities, countries=countries)
+    # Filter dropdown values (cached, rebuilt after doctor profile writes)
+    return render_template('doctors.html', doctors=doctors, next_cursor=next_cursor,
+                           show_counts=app.config['DIRECTORY_FACET_COUNTS'], **facets.get_facets('doctor'))
 
 @app.route('/hospitals')
+@response_cache.cached('doctor', 'hospital')
 def list_hospitals():
     city = request.args.get('city')
     country = request.args.get('country')
     
-    query = Hospital.query
-    if city:
-        query = query.filter(Hospital.city.ilike(f'%{city}%'))
-    if country:
-        query = query.filter(Hospital.country.ilike(f'%{country}%'))
-        
-    hospitals = query.all()
-    
-    cities = sorted(set([h.city for h in Hospital.query.all()]))
-    countries = sorted(set([h.country for h in Hospital.query.all()]))
+    try:
+        hospitals, next_cursor = queries.hospitals_page(city, country, request.args.get('cursor'))
+    except ValueError:
+        abort(400)
     
-    return render_template('hospitals.html', hospitals=hospitals, cities=cities, countries=countries)
+    return render_template('hospitals.html', hospitals=hospitals, next_cursor=next_cursor,
+                           show_counts=app.config['DIRECTORY_FACET_COUNTS'], **facets.get_facets('hospital'))
+
+@app.route('/api/doctors')
+@response_cache.cached('doctor', 'hospital')
+def list_doctors_json():
+    try:
+        doctors, next_cursor = queries.doctors_page(request.args.get('specialty'), request.args.get('city'),
+                                                    request.args.get('country'), request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor.'}), 400
+    return jsonify({'items': [doctor_json(d) for d in doctors], 'next_cursor': next_cursor})
+
+@app.route('/api/hospitals')
+@response_cache.cached('doctor', 'hospital')
+def list_hospitals_json():
+    try:
+        hospitals, next_cursor = queries.hospitals_page(request.args.get('city'), request.args.get('country'),
+                                                        request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor.'}), 400
+    return jsonify({'items': [hospital_json(h) for h in hospitals], 'next_cursor': next_cursor})
+
+@app.route('/api/doctors/<int:doctor_id>')
+@response_cache.cached('doctor', 'hospital')
+def get_doctor_json(doctor_id):
+    doctor = queries.doctor_detail(doctor_id).first()
+    if not doctor:
+        return jsonify({'error': 'Doctor not found.'}), 404
+    return jsonify(doctor_detail_json(doctor))
+
+@app.route('/api/hospitals/<int:hospital_id>')
+@response_cache.cached('doctor', 'hospital')
+def get_hospital_json(hospital_id):
+    hospital = queries.hospital_detail(hospital_id).first()
+    if not hospital:
+        return jsonify({'error': 'Hospital not found.'}), 404
+    return jsonify(hospital_detail_json(hospital))
+
+# Forms that hash a password, and the page to show again when hashing is busy
+PASSWORD_FORMS = {'login': 'login.html', 'admin_login': 'admin/login.html', 'register': 'register.html'}
+
+@app.errorhandler(passwords.Overloaded)
+def password_hashing_busy(e):
+    # Every hashing place is taken (a burst of logins): refuse quickly rather
+    # than hold a request thread, and tell the client when to come back
+    headers = {'Retry-After': str(PASSWORD_BUSY_RETRY_AFTER)}
+    template = PASSWORD_FORMS.get(request.endpoint)
+    if not template:
+        return Response('Service busy, please retry.', 503, headers, mimetype='text/plain')
+    db.session.rollback()
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'error')
+    return render_template(template), 503, headers
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -370,7 +879,10 @@ def login():
         password = request.form.get('password')
         user = User.query.filter_by(email=email).first()
         
-        if user and check_password_hash(user.password, password):
+        valid, stale = passwords.verify(user.password, password) if user else (False, False)
+        if valid:
+            if stale:
+                passwords.upgrade(user, password)
             # Clear any existing admin session when regular user logs in
             # This ensures patients/doctors don't see admin panel
             clear_admin_session()
@@ -402,24 +914,21 @@ def register():
             flash('Email already exists.', 'error')
             return redirect(url_for('register'))
             
-        # Generate unique membership ID
-        # Format: MB-YYYY-RANDOM (e.g., MB-2024-A1B2C3)
-        import random
-        import string
-        year = datetime.now().year
-        suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        membership_id = f"MB-{year}-{suffix}"
+        # Unique membership ID, e.g. MB-2024-A1B2C3 (see membership.py)
+        import membership
+        membership_id = membership.allocate()
         
         new_user = User(
             name=name,
             email=email,
-            password=generate_password_hash(password, method='pbkdf2:sha256'),
+            password=passwords.hash_password(password),
             role=role,
             phone_number=phone,
             membership_id=membership_id
         )
         db.session.add(new_user)
         db.session.commit()
+        identity.invalidate(new_user.id)
         
         # If doctor, create doctor profile with professional details
         if role == 'doctor':
@@ -441,6 +950,7 @@ def register():
             )
             db.session.add(new_doctor)
             db.session.commit()
+            facets.invalidate('doctor')
 
         # Clear any existing admin session when new user registers and logs in
         clear_admin_session()
@@ -481,6 +991,9 @@ def profile():
             doctor.hospital_id = int(hospital_id) if hospital_id else None
                 
         db.session.commit()
+        identity.invalidate(current_user.id)
+        if current_user.role == 'doctor':
+            facets.invalidate('doctor')
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('profile'))
     
@@ -504,17 +1017,25 @@ def dashboard():
             return redirect(url_for('admin_login'))
     
     # Regular users (patients and doctors) can ONLY access their own appointments
+    show_history = request.args.get('history') == 'all'
     if current_user.role == 'doctor':
         # Doctors can only see appointments scheduled with them
         if not current_user.doctor_profile:
             flash('Doctor profile not found.', 'error')
             return redirect(url_for('profile'))
-        appointments = Appointment.query.filter_by(doctor_id=current_user.doctor_profile.id).all()
-        return render_template('dashboard_doctor.html', appointments=appointments)
+        # ?history=all adds the archived appointments (see archive.py)
+        if show_history:
+            appointments = queries.doctor_history(current_user.doctor_profile.id)
+        else:
+            appointments = queries.doctor_appointments(current_user.doctor_profile.id).all()
+        return render_template('dashboard_doctor.html', appointments=appointments, show_history=show_history)
     elif current_user.role == 'patient':
         # Patients can only see their own appointments
-        appointments = Appointment.query.filter_by(patient_id=current_user.id).all()
-        return render_template('dashboard_patient.html', appointments=appointments)
+        if show_history:
+            appointments = queries.patient_history(current_user.id)
+        else:
+            appointments = queries.patient_appointments(current_user.id).all()
+        return render_template('dashboard_patient.html', appointments=appointments, show_history=show_history)
     else:
         # Any other role should not access this
         flash('Access denied.', 'error')
@@ -552,29 +1073,179 @@ def book_appointment(doctor_id):
         
         # Combine date and time
         dt_string = f"{date_str} {time_str}"
-        appointment_time = datetime.strptime(dt_string, '%Y-%m-%d %H:%M')
+        try:
+            appointment_time = datetime.strptime(dt_string, '%Y-%m-%d %H:%M')
+        except ValueError:
+            flash('Please pick a date and time for your appointment.', 'error')
+            return render_template('booking.html', doctor=doctor)
         
         # Security: Ensure appointment is created with current_user as patient
         # Users can only book appointments for themselves
-        new_appointment = Appointment(
-            patient_id=current_user.id,  # Always use current_user.id, never from form data
-            doctor_id=doctor.id,
-            date_time=appointment_time,
-            type=consultation_type,
-            notes=notes,
-            status='pending',  # Appointments start as pending until admin confirms
-            meeting_link=f"https://meet.jit.si/consultation-{current_user.id}-{doctor.id}" if consultation_type == 'online' else None
-        )
-        db.session.add(new_appointment)
-        db.session.commit()
+        # Appointments start as pending until admin confirms; the unique
+        # index on active slots makes this atomic under concurrent bookings
+        try:
+            booking.book_slot(
+                doctor.id, appointment_time,
+                current_user.id,  # Always use current_user.id, never from form data
+                type=consultation_type,
+                notes=notes,
+                meeting_link=f"https://meet.jit.si/consultation-{current_user.id}-{doctor.id}" if consultation_type == 'online' else None
+            )
+        except booking.SlotUnavailable as e:
+            flash(str(e), 'error')
+            return render_template('booking.html', doctor=doctor), 409
         flash('Appointment requested successfully! It will be confirmed by admin shortly.', 'success')
         return redirect(url_for('dashboard'))
         
     return render_template('booking.html', doctor=doctor)
 
-# Initialize DB
-with app.app_context():
-    db.create_all()
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database, or add what an older one is missing (run on every deploy)"""
+    init_db(app)
+    print("Database ready.")
+    if email_configured():
+        print(f"Email: {app.config['MAIL_USERNAME']} via {app.config['MAIL_SERVER']}:{app.config['MAIL_PORT']}")
+
+@app.cli.command('email-worker')
+def email_worker_command():
+    """Run the email outbox worker in the foreground"""
+    print("📧 Email worker started. Press Ctrl+C to stop.")
+    outbox.run_worker(app)
+
+@app.cli.command('reminder-scheduler')
+def reminder_scheduler_command():
+    """Queue appointment reminders as they fall due, in the foreground"""
+    import reminders
+    print("⏰ Reminder scheduler started. Press Ctrl+C to stop.")
+    reminders.run_scheduler(app)
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Rebuild the doctor/hospital full-text search index"""
+    with db.engine.begin() as connection:
+        search.rebuild_index(connection)
+    print("Search index rebuilt.")
+
+@app.cli.command('rebuild-availability')
+def rebuild_availability_command():
+    """Rebuild the free-slot bitmaps from today on (run daily to move the horizon forward)"""
+    with db.engine.begin() as connection:
+        availability.rebuild(connection)
+    print("Availability bitmaps rebuilt.")
+
+@app.cli.command('archive-appointments')
+def archive_appointments_command():
+    """Close past appointments and move old ones to the archive (run daily)"""
+    import archive
+    counts = archive.run()
+    print(f"{counts['completed']} appointments completed, {counts['cancelled']} expired unconfirmed, "
+          f"{counts['archived']} archived.")
+
+@app.cli.command('clear-response-cache')
+def clear_response_cache_command():
+    """Empty the filesystem response cache (e.g. after editing the database by hand)"""
+    backend = response_cache.get_backend()
+    if backend:
+        backend.clear()
+    print("Response cache cleared.")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/build"""
+    manifest = assets.build(app.static_folder)
+    app.extensions['assets'] = manifest
+    print(f"Built {len(manifest)} assets into static/{assets.BUILD_DIR}.")
+    if assets.brotli is None:
+        print("ℹ️  Install brotli to also build .br files.")
+
+@app.cli.command('import-directory')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', type=int, help='Rows per transaction (default IMPORT_CHUNK_SIZE)')
+@click.option('--show-errors', default=20, show_default=True, help='Row errors to print')
+def import_directory_command(path, chunk_size, show_errors):
+    """Import doctors and hospitals from a CSV, JSON Lines or JSON file"""
+    import importer
+    config = dict(app.config)
+    if chunk_size:
+        config['IMPORT_CHUNK_SIZE'] = chunk_size
+    try:
+        fmt = importer.format_for(path)
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            report = importer.import_file(f, fmt, config, progress=lambda r: print(f"  {r.summary()}"))
+    except (importer.ImportFileError, UnicodeDecodeError) as e:
+        raise click.ClickException(str(e))
+    print(f"{'⚠️ ' if report.failed else '✅'} Import finished: {report.summary()}")
+    for line, message in report.errors[:show_errors]:
+        print(f"   line {line}: {message}")
+    if report.failed > show_errors:
+        print(f"   ... and {report.failed - show_errors} more")
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recount the admin dashboard counters (after bulk imports or manual SQL)"""
+    with db.engine.begin() as connection:
+        stats.rebuild_counters(connection)
+    print("Stats counters rebuilt.")
+
+def create_app(config=None):
+    """Application factory: apply config overrides and set up the extensions.
+
+    Routes are registered on the module-level app, so this configures and
+    returns that same app. Only the first call initialises it; later calls
+    return it unchanged, and raise RuntimeError if they pass config that
+    differs from what is set. Used by wsgi.py, scripts and the benchmarks.
+
+    Nothing here opens the database, so every worker starts serving right
+    after the import: creating and upgrading the schema is `flask init-db`
+    (init_db), run once per deploy. Flask-Mail is set up when the email
+    worker first sends (see outbox.py).
+    """
+    if 'sqlalchemy' in app.extensions:
+        ignored = sorted(key for key, value in (config or {}).items() if app.config.get(key) != value)
+        if ignored:
+            raise RuntimeError(f"create_app() was already called; it cannot apply {', '.join(ignored)} now. "
+                               f"Pass the config on the first call (before importing wsgi).")
+        return app
+    if config:
+        app.config.update(config)
+
+    db.init_app(app)
+    assets.init_app(app)
+    templating.init_app(app)
+    metrics.init_app(app, db.Model)
+    passwords.init_app(app)
+    with app.app_context():
+        configure_sqlite(db.engine, app.config['SQLITE_PRAGMAS'])
+    # Background threads start with the first request: a gunicorn master that
+    # preloads the app must not run them (threads do not survive the fork).
+    # The email worker starts even if nothing is queued, so the jobs left
+    # pending, in backoff or with an expired lease by a restarted process
+    # are retried.
+    if app.config['EMAIL_WORKER_THREAD']:
+        @app.before_request
+        def start_email_worker():
+            outbox.ensure_worker(app)
+    if app.config['REMINDER_SCHEDULER_THREAD']:
+        @app.before_request
+        def start_reminder_scheduler():
+            import reminders
+            reminders.ensure_scheduler(app)
+    return app
+
+def init_db(app):
+    """Create missing tables and bring databases made by older versions up to date"""
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            ensure_row_versions(connection)
+            ensure_reminder_marker(connection)
+            search.ensure_index(connection)
+            stats.ensure_counters(connection)
+            availability.ensure_bitmaps(connection)
 
 if __name__ == '__main__':
+    # Development server; use wsgi.py (gunicorn / waitress) in production
+    app = create_app()
+    init_db(app)
     app.run(debug=True, port=5000)
@@ -0,0 +1,114 @@
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from database import db, Appointment, ACTIVE_STATUSES
+import availability
+import outbox
+import stats
+import response_cache
+
+# Bulk status changes for the admin panel. A batch is validated with a
+# couple of set-based queries and applied with one UPDATE ... WHERE id IN
+# (...) per target status, all in one transaction.
+
+BULK_ACTIONS = {'confirm': 'confirmed', 'cancel': 'cancelled'}
+# Keeps every IN (...) list below SQLite's bound-parameter limit (32766)
+MAX_BULK_ITEMS = 5000
+
+def _active_slots(slots, exclude_ids):
+    """Subset of (doctor_id, date_time) pairs held by a pending or confirmed
+    appointment other than exclude_ids"""
+    if not slots:
+        return set()
+    rows = db.session.execute(
+        select(Appointment.doctor_id, Appointment.date_time).where(
+            Appointment.status.in_(ACTIVE_STATUSES),
+            Appointment.id.notin_(exclude_ids),
+            tuple_(Appointment.doctor_id, Appointment.date_time).in_(list(slots))
+        )
+    )
+    return {(row.doctor_id, row.date_time) for row in rows}
+
+def bulk_update_status(ids, action, queue_emails=True):
+    """Confirm or cancel many appointments at once.
+
+    Returns {appointment_id: result} where result is the new status
+    ('confirmed' / 'cancelled'), 'unchanged' (already in that status),
+    'conflict' (another appointment is pending or confirmed for the same
+    doctor and time) or 'not_found'. When queue_emails is set, confirmation
+    emails for the confirmed appointments are added to the outbox in the same
+    transaction; the caller should call outbox.notify() afterwards.
+    """
+    new_status = BULK_ACTIONS[action]
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_BULK_ITEMS:
+        raise ValueError(f'At most {MAX_BULK_ITEMS} appointments per request')
+    try:
+        results = _apply_status(ids, new_status, queue_emails)
+    except IntegrityError:
+        # A booking for one of these slots committed between the conflict
+        # check and the UPDATE (the unique index caught it): check again
+        db.session.rollback()
+        results = _apply_status(ids, new_status, queue_emails)
+    db.session.commit()
+    return results
+
+def _apply_status(ids, new_status, queue_emails):
+    results = dict.fromkeys(ids, 'not_found')
+
+    rows = db.session.execute(
+        select(Appointment.id, Appointment.doctor_id, Appointment.date_time, Appointment.status)
+        .where(Appointment.id.in_(ids))
+    ).all()
+
+    to_update = []
+    if new_status == 'confirmed':
+        candidates = []
+        for row in rows:
+            if row.status == 'confirmed':
+                results[row.id] = 'unchanged'
+            else:
+                candidates.append(row)
+        # One winner per slot: slots held by another active appointment, or
+        # claimed earlier in this batch, are conflicts. Pending candidates
+        # already own their slot, so they go first; then the oldest id wins.
+        taken = _active_slots({(row.doctor_id, row.date_time) for row in candidates},
+                              [row.id for row in candidates])
+        for row in sorted(candidates, key=lambda r: (r.status != 'pending', r.id)):
+            slot = (row.doctor_id, row.date_time)
+            if slot in taken:
+                results[row.id] = 'conflict'
+            else:
+                taken.add(slot)
+                to_update.append(row.id)
+    else:
+        for row in rows:
+            if row.status == new_status:
+                results[row.id] = 'unchanged'
+            else:
+                to_update.append(row.id)
+
+    if to_update:
+        db.session.execute(
+            update(Appointment)
+            .where(Appointment.id.in_(to_update))
+            .values(status=new_status),
+            execution_options={'synchronize_session': False}
+        )
+        # Bulk UPDATEs skip the ORM hooks that keep the dashboard counters
+        updated = set(to_update)
+        stats.record_status_changes(db.session.connection(),
+                                    [row.status for row in rows if row.id in updated], new_status)
+        # ... and the free-slot bitmaps
+        slots = [(row.doctor_id, row.date_time) for row in rows
+                 if row.id in updated and (row.status in ACTIVE_STATUSES) != (new_status in ACTIVE_STATUSES)]
+        if new_status in ACTIVE_STATUSES:
+            availability.apply(db.session.connection(), taken=slots)
+        else:
+            availability.apply(db.session.connection(), released=slots)
+        response_cache.bump(['appointment'])
+    for appointment_id in to_update:
+        results[appointment_id] = new_status
+
+    if new_status == 'confirmed' and queue_emails and to_update:
+        outbox.enqueue_many('appointment_confirmation', to_update)
+    return results
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select, update
+from database import db, Appointment, AppointmentArchive
+import availability
+import stats
+import response_cache
+
+# Hot/cold split of the appointment table.
+#
+# Nothing used to close an appointment once its time had passed, and every
+# row stayed in `appointment`, which slots, dashboards and the admin views
+# read. The maintenance job (`flask archive-appointments`, daily from cron):
+#
+# 1. closes past appointments: confirmed -> completed, and pending ones that
+#    were never confirmed -> cancelled
+# 2. moves completed and cancelled appointments older than
+#    ARCHIVE_AFTER_DAYS into appointment_archive (same columns and ids)
+#
+# Both run in batches of ARCHIVE_BATCH_SIZE rows, one short transaction
+# each, so bookings keep getting the write lock in between. Bulk statements
+# skip the ORM hooks, so step 1 updates the status counters, the free-slot
+# bitmaps and the response cache itself. Step 2 leaves the counters alone:
+# the dashboard totals count archived appointments too (see stats.py).
+#
+# The patient and doctor dashboards read the archive only when asked
+# (?history=all, see queries.patient_history).
+
+# An appointment is over an hour after it starts (slots are hourly)
+SLOT_LENGTH = timedelta(hours=1)
+PAST_TRANSITIONS = {'confirmed': 'completed', 'pending': 'cancelled'}
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+_COLUMNS = ('id', 'patient_id', 'doctor_id', 'date_time', 'status', 'type', 'meeting_link', 'notes', 'created_at')
+
+def close_past(now=None, batch_size=None):
+    """Close the appointments whose time has passed; returns {new status: count}"""
+    now = now or datetime.now()
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    counts = {}
+    for old, new in PAST_TRANSITIONS.items():
+        counts[new] = 0
+        while True:
+            rows = db.session.execute(
+                select(Appointment.id, Appointment.doctor_id, Appointment.date_time)
+                .where(Appointment.status == old, Appointment.date_time < now - SLOT_LENGTH)
+                .order_by(Appointment.date_time).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            db.session.execute(
+                update(Appointment).where(Appointment.id.in_([row.id for row in rows])).values(status=new),
+                execution_options={'synchronize_session': False}
+            )
+            connection = db.session.connection()
+            stats.record_status_changes(connection, [old] * len(rows), new)
+            # Only today's slots are still in the bitmaps
+            availability.apply(connection, released=[(row.doctor_id, row.date_time) for row in rows
+                                                     if row.date_time >= today])
+            response_cache.bump(['appointment'])
+            db.session.commit()
+            counts[new] += len(rows)
+    return counts
+
+def archive_old(now=None, after_days=None, batch_size=None):
+    """Move closed appointments older than after_days to the archive; returns how many"""
+    now = now or datetime.now()
+    after_days = current_app.config['ARCHIVE_AFTER_DAYS'] if after_days is None else after_days
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    cutoff = now - timedelta(days=after_days)
+    # SQLite hands out max(id) + 1 for new rows: keep the newest row, or a
+    # new appointment could reuse an archived id
+    newest = db.session.execute(select(func.max(Appointment.id))).scalar()
+    moved = 0
+    while newest is not None:
+        ids = db.session.execute(
+            select(Appointment.id)
+            .where(Appointment.status.in_(ARCHIVED_STATUSES), Appointment.date_time < cutoff,
+                   Appointment.id < newest)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        columns = [getattr(Appointment, name) for name in _COLUMNS]
+        db.session.execute(insert(AppointmentArchive).from_select(
+            [*_COLUMNS, 'archived_at'],
+            select(*columns, literal(datetime.utcnow())).where(Appointment.id.in_(ids))
+        ))
+        db.session.execute(delete(Appointment).where(Appointment.id.in_(ids)),
+                           execution_options={'synchronize_session': False})
+        response_cache.bump(['appointment'])
+        db.session.commit()
+        moved += len(ids)
+    return moved
+
+def run(now=None):
+    """The maintenance job: close past appointments, then archive old ones"""
+    counts = close_past(now)
+    counts['archived'] = archive_old(now)
+    return counts
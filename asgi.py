@@ -0,0 +1,13 @@
+"""ASGI entry point: the async read-only API (async_api.py) in front of the Flask app.
+
+    uvicorn asgi:app --workers 4                # Linux / macOS / Windows
+
+Slot, directory and search reads are served on asyncio; every other request
+goes to Flask on WSGI_THREADS threads per process. wsgi.py stays the entry
+point for a pure WSGI deployment.
+"""
+import os
+from app import create_app
+from async_api import mount
+
+app = mount(create_app(), threads=int(os.environ.get('WSGI_THREADS') or 8))
@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from flask import current_app, request, send_file, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional: without it only .gz variants are built
+    brotli = None
+
+# Fingerprinted static assets.
+#
+# `flask build-assets` copies every file under static/ to static/build/ with
+# a content hash in its name (css/style.css -> css/style.3f9a0c1be2.css),
+# writes precompressed .gz/.br variants of the text assets next to it and
+# records the mapping in static/build/manifest.json. Once a manifest exists
+# url_for('static', ...) returns the hashed URL, served by send_asset() with
+# a one-year immutable Cache-Control. Each build keeps the previous build's
+# files so pages rendered (or cached) before a deploy still find them.
+#
+# send_asset() picks the best precompressed variant the client accepts and
+# answers single byte-range requests (video seeking) by handing the server
+# an open file positioned at the range start, so gunicorn and waitress can
+# use sendfile() for it.
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+EXCLUDE = {'css/style_backup.css'}  # kept for reference, not linked from any template
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CHUNK_SIZE = 64 * 1024
+
+# Preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+def _fingerprint(relative_path, data):
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+def build(static_folder):
+    """Fingerprint and precompress every static asset; returns the manifest"""
+    out_dir = os.path.join(static_folder, BUILD_DIR)
+    manifest = {}
+    for directory, subdirs, files in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder):
+            subdirs[:] = [d for d in subdirs if d != BUILD_DIR]
+        for name in sorted(files):
+            source = os.path.join(directory, name)
+            relative = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            if relative in EXCLUDE:
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            hashed = _fingerprint(relative, data)
+            target = os.path.join(out_dir, hashed)
+            manifest[relative] = hashed
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if os.path.splitext(name)[1] in COMPRESSIBLE:
+                variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    variants['.br'] = brotli.compress(data, quality=11)
+                for suffix, compressed in variants.items():
+                    if len(compressed) < len(data):
+                        with open(target + suffix, 'wb') as f:
+                            f.write(compressed)
+
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, BUILD_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def init_app(app):
+    """Load the manifest and make url_for('static', ...) return fingerprinted URLs"""
+    app.extensions['assets'] = load_manifest(app.static_folder)
+    default_url_for = app.url_for
+
+    def url_for(endpoint, **values):
+        # The dev server serves the sources so CSS/JS edits show up on reload
+        if endpoint == 'static' and not app.debug:
+            hashed = app.extensions['assets'].get(values.get('filename'))
+            if hashed:
+                endpoint, values = 'hashed_static', dict(values, filename=hashed)
+        return default_url_for(endpoint, **values)
+
+    app.url_for = url_for
+    app.jinja_env.globals['url_for'] = url_for
+
+def _read_range(f, length):
+    """Fallback body for servers without wsgi.file_wrapper"""
+    try:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def _send_range(path, mimetype, etag, size):
+    content_range = request.range.make_content_range(size)
+    if content_range is None:
+        response = current_app.response_class(status=416)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+    start, stop = content_range.start, content_range.stop
+    f = open(path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    body = file_wrapper(f, CHUNK_SIZE) if file_wrapper else _read_range(f, stop - start)
+    response = current_app.response_class(body, status=206, mimetype=mimetype, direct_passthrough=True)
+    # The server stops after Content-Length bytes (gunicorn sendfile()s exactly this many)
+    response.content_length = stop - start
+    response.content_range = content_range
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    return response
+
+def send_asset(filename):
+    """Serve a fingerprinted file from static/build with immutable caching"""
+    path = safe_join(os.path.join(current_app.static_folder, BUILD_DIR), filename)
+    if path is None or not os.path.isfile(path) or filename == MANIFEST:
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    stat = os.stat(path)
+    etag = f'{int(stat.st_mtime)}-{stat.st_size}'
+
+    if_range = request.if_range
+    if (request.range is not None and len(request.range.ranges) == 1
+            and not current_app.config['USE_X_SENDFILE']
+            and (if_range.etag == etag or (if_range.etag is None and if_range.date is None))):
+        response = _send_range(path, mimetype, etag, stat.st_size)
+    else:
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings.quality(encoding) and os.path.isfile(path + suffix):
+                # Each encoding gets its own (strong) ETag
+                response = send_file(path + suffix, mimetype=mimetype, conditional=True,
+                                     etag=f'{etag}-{encoding}', max_age=IMMUTABLE_MAX_AGE)
+                response.content_encoding = encoding
+                break
+        else:
+            response = send_file(path, mimetype=mimetype, conditional=True, etag=etag,
+                                 max_age=IMMUTABLE_MAX_AGE)
+            response.accept_ranges = 'bytes'
+        response.vary.add('Accept-Encoding')
+
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
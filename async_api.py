@@ -0,0 +1,223 @@
+import re
+from datetime import timedelta
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import parse_qsl
+from itsdangerous import BadData
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import joinedload, selectinload
+from database import Doctor, Hospital, configure_sqlite
+from slots import parse_date, booked_times_query, build_range_slots, MAX_RANGE_DAYS
+from availability import load_schedules
+import queries
+import search
+
+# Read-only JSON API on asyncio, for the requests the booking page and the
+# typeahead send most: slots, the doctor/hospital directory and search.
+#
+# Under gunicorn every request holds a worker thread while it waits on
+# SQLite, so a burst of slot lookups queues behind a handful of threads.
+# Here a waiting request is a suspended coroutine: one process keeps
+# thousands of clients connected and only the queries contend, for a
+# bounded aiosqlite connection pool (ASYNC_DB_* in app.py).
+#
+# The routes, parameters and responses are the same as the Flask views
+# (same statements from slots.py, search.py and queries.py, same
+# serializers, same JSON encoding), so clients can't tell which stack
+# answered. mount() puts this app in front of the Flask app for asgi.py:
+# GET/HEAD requests to these routes are answered here, everything else is
+# passed to Flask on a thread pool. The logged-in patient (whose own slot
+# holds show as free) comes from Flask's signed session cookie. Connections
+# are opened with `PRAGMA query_only`, so nothing here can write.
+
+PAGE_SIZE = queries.PAGE_SIZE
+BUSY_RETRY_AFTER = 1
+
+def _json_error(status, message):
+    return status, {'error': message}
+
+class AsyncApi:
+    """ASGI app serving the read-only routes; other requests go to fallback"""
+
+    def __init__(self, flask_app, fallback=None):
+        from app import doctor_json, hospital_json, doctor_detail_json, hospital_detail_json
+        config = flask_app.config
+        url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+        if url.get_backend_name() != 'sqlite':
+            raise ValueError('The async API reads SQLite through aiosqlite')
+        self.engine = create_async_engine(
+            url.set(drivername='sqlite+aiosqlite'),
+            pool_size=config['ASYNC_DB_POOL_SIZE'],
+            max_overflow=config['ASYNC_DB_MAX_OVERFLOW'],
+            pool_timeout=config['ASYNC_DB_POOL_TIMEOUT'],
+        )
+        configure_sqlite(self.engine.sync_engine, dict(config['SQLITE_PRAGMAS'], query_only=1))
+        self.fallback = fallback
+        self.json = flask_app.json
+        self.sessions = flask_app.session_interface.get_signing_serializer(flask_app)
+        self.session_cookie = config['SESSION_COOKIE_NAME']
+        self.session_max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        self.doctor_json, self.hospital_json = doctor_json, hospital_json
+        self.doctor_detail_json, self.hospital_detail_json = doctor_detail_json, hospital_detail_json
+        self.routes = [
+            (re.compile(r'/api/slots/(\d+)'), self.get_slots),
+            (re.compile(r'/api/doctors'), self.list_doctors_json),
+            (re.compile(r'/api/doctors/(\d+)'), self.get_doctor_json),
+            (re.compile(r'/api/hospitals'), self.list_hospitals_json),
+            (re.compile(r'/api/hospitals/(\d+)'), self.get_hospital_json),
+            (re.compile(r'/api/search'), self.search_directory),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            for pattern, view in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+                    try:
+                        status, payload = await view(scope, args, *map(int, match.groups()))
+                        headers = []
+                    except PoolTimeout:
+                        # Every pooled connection stayed busy for ASYNC_DB_POOL_TIMEOUT
+                        status, payload = _json_error(503, 'Busy, please try again.')
+                        headers = [(b'retry-after', str(BUSY_RETRY_AFTER).encode())]
+                    await self._send_json(send, status, payload, headers, scope['method'] == 'HEAD')
+                    return
+        if self.fallback is not None:
+            await self.fallback(scope, receive, send)
+        else:
+            await self._send_json(send, 404, {'error': 'Not found.'})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _send_json(self, send, status, payload, headers=(), head=False):
+        # Encoded like jsonify, so both stacks return the same bytes
+        body = (self.json.dumps(payload, separators=(',', ':')) + '\n').encode()
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers]})
+        await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+    def _user_id(self, scope):
+        """The logged-in user's id from Flask's session cookie, or None"""
+        if self.sessions is None:
+            return None
+        for name, value in scope['headers']:
+            if name != b'cookie':
+                continue
+            try:
+                morsel = SimpleCookie(value.decode('latin-1')).get(self.session_cookie)
+                if morsel is None:
+                    continue
+                user_id = self.sessions.loads(morsel.value, max_age=self.session_max_age).get('_user_id')
+                return int(user_id) if user_id is not None else None
+            except (CookieError, BadData, TypeError, ValueError):
+                return None
+        return None
+
+    # --- Routes (see the Flask views of the same name in app.py) ---
+    async def get_slots(self, scope, args, doctor_id):
+        patient_id = self._user_id(scope)
+        from_str = args.get('from')
+        to_str = args.get('to')
+        if from_str or to_str:
+            try:
+                start_date = parse_date(from_str)
+                end_date = parse_date(to_str or from_str)
+            except (TypeError, ValueError):
+                return _json_error(400, 'Dates must be in YYYY-MM-DD format.')
+            if end_date < start_date or (end_date - start_date).days >= MAX_RANGE_DAYS:
+                return _json_error(400, f'Range must cover 1 to {MAX_RANGE_DAYS} days.')
+            return 200, await self._slots(doctor_id, start_date, end_date, patient_id)
+
+        date_str = args.get('date')
+        if not date_str:
+            return 200, []
+        try:
+            day = parse_date(date_str)
+        except ValueError:
+            return _json_error(400, 'Date must be in YYYY-MM-DD format.')
+        return 200, (await self._slots(doctor_id, day, day, patient_id))[day.strftime('%Y-%m-%d')]
+
+    async def _slots(self, doctor_id, start_date, end_date, patient_id):
+        end = end_date + timedelta(days=1)
+        async with self.engine.connect() as connection:
+            result = await connection.execute(*booked_times_query(doctor_id, start_date, end, patient_id))
+            booked = set(result.scalars())
+            schedules = await connection.run_sync(load_schedules, [doctor_id], start_date.date(), end.date())
+        return build_range_slots(start_date, end_date, booked, schedules[doctor_id])
+
+    async def list_doctors_json(self, scope, args):
+        stmt = select(Doctor).options(joinedload(Doctor.user), joinedload(Doctor.hospital))
+        for column, name in ((Doctor.specialization, 'specialty'), (Doctor.city, 'city'), (Doctor.country, 'country')):
+            if args.get(name):
+                stmt = stmt.where(column == args[name])
+        return await self._page(stmt, Doctor.id, args.get('cursor'), self.doctor_json)
+
+    async def list_hospitals_json(self, scope, args):
+        stmt = select(Hospital).options(selectinload(Hospital.doctors))
+        for column, name in ((Hospital.city, 'city'), (Hospital.country, 'country')):
+            if args.get(name):
+                stmt = stmt.where(column == args[name])
+        return await self._page(stmt, Hospital.id, args.get('cursor'), self.hospital_json)
+
+    async def _page(self, stmt, key, cursor, serialize):
+        """One keyset page, as queries._page"""
+        if cursor:
+            try:
+                stmt = stmt.where(key > queries.decode_id_cursor(cursor))
+            except ValueError:
+                return _json_error(400, 'Invalid cursor.')
+        async with AsyncSession(self.engine) as session:
+            rows = (await session.scalars(stmt.order_by(key).limit(PAGE_SIZE + 1))).unique().all()
+            next_cursor = None
+            if len(rows) > PAGE_SIZE:
+                rows = rows[:PAGE_SIZE]
+                next_cursor = queries.encode_cursor(rows[-1].id)
+            return 200, {'items': [serialize(row) for row in rows], 'next_cursor': next_cursor}
+
+    async def get_doctor_json(self, scope, args, doctor_id):
+        stmt = select(Doctor).options(joinedload(Doctor.user), joinedload(Doctor.hospital)).where(Doctor.id == doctor_id)
+        async with AsyncSession(self.engine) as session:
+            doctor = (await session.scalars(stmt)).first()
+            if not doctor:
+                return _json_error(404, 'Doctor not found.')
+            return 200, self.doctor_detail_json(doctor)
+
+    async def get_hospital_json(self, scope, args, hospital_id):
+        stmt = (select(Hospital).options(selectinload(Hospital.doctors).joinedload(Doctor.user))
+                .where(Hospital.id == hospital_id))
+        async with AsyncSession(self.engine) as session:
+            hospital = (await session.scalars(stmt)).first()
+            if not hospital:
+                return _json_error(404, 'Hospital not found.')
+            return 200, self.hospital_detail_json(hospital)
+
+    async def search_directory(self, scope, args):
+        try:
+            limit = int(args.get('limit', 10))
+        except ValueError:
+            limit = 10
+        statement = search.search_query(args.get('q', ''), limit=max(1, limit))
+        if statement is None:
+            return 200, []
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(*statement)).all()
+        return 200, search.search_results(rows)
+
+def mount(flask_app, threads=8):
+    """The ASGI app for asgi.py: the async routes, everything else by flask_app on `threads` threads"""
+    from a2wsgi import WSGIMiddleware
+    return AsyncApi(flask_app, WSGIMiddleware(flask_app, workers=threads))
@@ -0,0 +1,265 @@
+import heapq
+from datetime import date, datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import bindparam, event, inspect, select, update
+from sqlalchemy.dialects.sqlite import insert
+from database import (db, User, Doctor, Appointment, WorkingHours, ScheduleException, DoctorAvailability,
+                      ACTIVE_STATUSES)
+
+# Doctor schedules and free-slot bitmaps.
+#
+# A doctor's schedule is their weekly working hours plus dated exceptions
+# (hours off, extra hours). Doctors without working hours keep the original
+# 9:00-17:00 grid every day. Slots are hourly; a day is a 24-bit mask where
+# bit h stands for h:00.
+#
+# For the next AVAILABILITY_HORIZON_DAYS days every doctor also has a bitmap
+# of free slots (doctor_availability: 24 bits per day, about 270 bytes for 90
+# days): working hours minus pending/confirmed appointments. The mapper hooks
+# below clear and set single bits as appointments are booked, cancelled,
+# reopened or moved, and rebuild a doctor's bitmap when their schedule
+# changes, inside the same transaction. next_available() then answers "who
+# is free soonest" with one query for the candidate bitmaps and a shift and
+# a lowest-set-bit per doctor, instead of a slot query per doctor per day.
+#
+# Bulk Core writes bypass the hooks and must call apply() (see
+# appointment_status.py) or rebuild(). Slot holds are not in the bitmaps:
+# they last minutes, and the booking form checks them. Bitmaps start on the
+# day they were built; `flask rebuild-availability` (daily, e.g. from cron)
+# moves them forward. Until then a bitmap is read from today on, so its
+# horizon shrinks by a day per day.
+
+SLOTS_PER_DAY = 24
+DAY_BYTES = SLOTS_PER_DAY // 8
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+DEFAULT_HOURS = (9, 17)
+EXCEPTION_KINDS = ('off', 'extra')
+REBUILD_BATCH = 500  # doctors per query while rebuilding
+
+def hours_mask(start_hour, end_hour):
+    """Day mask of the slots from start_hour to end_hour (exclusive)"""
+    return ((1 << end_hour) - 1) & ~((1 << start_hour) - 1)
+
+DEFAULT_MASK = hours_mask(*DEFAULT_HOURS)
+
+class Schedule:
+    """A doctor's working hours and exceptions as day masks"""
+
+    def __init__(self):
+        self.week = None  # 7 masks, Monday first; None = DEFAULT_MASK every day
+        self.off = {}     # date -> mask
+        self.extra = {}   # date -> mask
+
+    def weekly(self, day):
+        return self.week[day.weekday()] if self.week else DEFAULT_MASK
+
+    def mask(self, day):
+        return (self.weekly(day) | self.extra.get(day, 0)) & ~self.off.get(day, 0)
+
+    def works_at(self, when):
+        return when.minute == 0 and when.second == 0 and when.microsecond == 0 \
+            and bool(self.mask(when.date()) >> when.hour & 1)
+
+# Built once and bound per call: the slot API loads one doctor's schedule per request
+_HOURS_QUERY = (
+    select(WorkingHours.doctor_id, WorkingHours.weekday, WorkingHours.start_hour, WorkingHours.end_hour)
+    .where(WorkingHours.doctor_id.in_(bindparam('doctor_ids', expanding=True)))
+)
+_EXCEPTIONS_QUERY = (
+    select(ScheduleException.doctor_id, ScheduleException.date, ScheduleException.kind,
+           ScheduleException.start_hour, ScheduleException.end_hour)
+    .where(ScheduleException.doctor_id.in_(bindparam('doctor_ids', expanding=True)),
+           ScheduleException.date >= bindparam('start'), ScheduleException.date < bindparam('end'))
+)
+
+def load_schedules(connection, doctor_ids, start, end):
+    """{doctor_id: Schedule} with the exceptions dated in [start, end)"""
+    doctor_ids = list(doctor_ids)
+    schedules = {doctor_id: Schedule() for doctor_id in doctor_ids}
+    if not doctor_ids:
+        return schedules
+    for doctor_id, weekday, start_hour, end_hour in connection.execute(_HOURS_QUERY, {'doctor_ids': doctor_ids}):
+        schedule = schedules[doctor_id]
+        if schedule.week is None:
+            schedule.week = [0] * 7
+        schedule.week[weekday] |= hours_mask(start_hour, end_hour)
+    for doctor_id, day, kind, start_hour, end_hour in connection.execute(
+            _EXCEPTIONS_QUERY, {'doctor_ids': doctor_ids, 'start': start, 'end': end}):
+        masks = schedules[doctor_id].off if kind == 'off' else schedules[doctor_id].extra
+        mask = DAY_MASK if start_hour is None else hours_mask(start_hour, end_hour)
+        masks[day] = masks.get(day, 0) | mask
+    return schedules
+
+def check_hours(start_hour, end_hour):
+    """ValueError unless 0 <= start_hour < end_hour <= 24"""
+    if not (isinstance(start_hour, int) and isinstance(end_hour, int) and 0 <= start_hour < end_hour <= SLOTS_PER_DAY):
+        raise ValueError(f'Hours must satisfy 0 <= start < end <= {SLOTS_PER_DAY}.')
+
+def _slot_index(start_date, when):
+    return (when.date() - start_date).days * SLOTS_PER_DAY + when.hour
+
+def _encode(bits, days):
+    return bits.to_bytes(days * DAY_BYTES, 'little')
+
+# --- Writing ---
+
+def rebuild(connection, doctor_ids=None, today=None):
+    """Recompute the bitmaps of the given doctors (every doctor when None) from today on"""
+    today = today or date.today()
+    days = current_app.config['AVAILABILITY_HORIZON_DAYS']
+    end = today + timedelta(days=days)
+    if doctor_ids is None:
+        doctor_ids = connection.execute(select(Doctor.id).order_by(Doctor.id)).scalars().all()
+    doctor_ids = list(doctor_ids)
+    patterns = {}  # weekly schedule -> bits over the horizon; most doctors share a few
+    for i in range(0, len(doctor_ids), REBUILD_BATCH):
+        batch = doctor_ids[i:i + REBUILD_BATCH]
+        bits = {}
+        for doctor_id, schedule in load_schedules(connection, batch, today, end).items():
+            key = tuple(schedule.week) if schedule.week else None
+            if key not in patterns:
+                patterns[key] = sum(schedule.weekly(today + timedelta(days=offset)) << offset * SLOTS_PER_DAY
+                                    for offset in range(days))
+            value = patterns[key]
+            for day in schedule.off.keys() | schedule.extra.keys():
+                shift = (day - today).days * SLOTS_PER_DAY
+                value = value & ~(DAY_MASK << shift) | schedule.mask(day) << shift
+            bits[doctor_id] = value
+        for doctor_id, when in connection.execute(
+                select(Appointment.doctor_id, Appointment.date_time).where(
+                    Appointment.doctor_id.in_(batch),
+                    Appointment.status.in_(ACTIVE_STATUSES),
+                    Appointment.date_time >= datetime.combine(today, time()),
+                    Appointment.date_time < datetime.combine(end, time()))):
+            bits[doctor_id] &= ~(1 << _slot_index(today, when))
+        if bits:
+            stmt = insert(DoctorAvailability).values([
+                {'doctor_id': doctor_id, 'start_date': today, 'free': _encode(value, days)}
+                for doctor_id, value in bits.items()])
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=[DoctorAvailability.doctor_id],
+                set_={'start_date': stmt.excluded.start_date, 'free': stmt.excluded.free}))
+
+def ensure_bitmaps(connection):
+    """Build the bitmaps on databases that don't have them yet"""
+    if connection.execute(select(DoctorAvailability.doctor_id).limit(1)).first() is None:
+        rebuild(connection)
+
+def apply(connection, taken=(), released=()):
+    """Clear the bits of taken slots and set those of released ones, in the caller's transaction.
+
+    Slots are (doctor_id, datetime). A released slot only becomes free again
+    if it is still within the doctor's working hours.
+    """
+    taken, released = list(taken), list(released)
+    doctor_ids = {doctor_id for doctor_id, _ in taken + released}
+    if not doctor_ids:
+        return
+    rows = {row.doctor_id: row for row in connection.execute(
+        select(DoctorAvailability.doctor_id, DoctorAvailability.start_date, DoctorAvailability.free)
+        .where(DoctorAvailability.doctor_id.in_(doctor_ids)))}
+    bits = {doctor_id: int.from_bytes(row.free, 'little') for doctor_id, row in rows.items()}
+    if released:
+        days = [when.date() for _, when in released]
+        schedules = load_schedules(connection, {doctor_id for doctor_id, _ in released if doctor_id in rows},
+                                   min(days), max(days) + timedelta(days=1))
+    for doctor_id, when in released:
+        row = rows.get(doctor_id)
+        index = _slot_index(row.start_date, when) if row else -1
+        if 0 <= index < len(row.free) * 8 and schedules[doctor_id].works_at(when):
+            bits[doctor_id] |= 1 << index
+    for doctor_id, when in taken:
+        row = rows.get(doctor_id)
+        index = _slot_index(row.start_date, when) if row else -1
+        if 0 <= index < len(row.free) * 8:
+            bits[doctor_id] &= ~(1 << index)
+    for doctor_id, row in rows.items():
+        free = bits[doctor_id].to_bytes(len(row.free), 'little')
+        if free != row.free:
+            connection.execute(update(DoctorAvailability).where(DoctorAvailability.doctor_id == doctor_id)
+                               .values(free=free))
+
+# --- Reading ---
+
+def works_at(doctor_id, when):
+    """True if the doctor's schedule offers the slot at `when`"""
+    day = when.date()
+    schedule = load_schedules(db.session.connection(), [doctor_id], day, day + timedelta(days=1))[doctor_id]
+    return schedule.works_at(when)
+
+def next_available(after, specialty=None, city=None, limit=10):
+    """[(datetime, doctor_id)] of the doctors free soonest at or after `after`, soonest first"""
+    query = select(DoctorAvailability.doctor_id, DoctorAvailability.start_date, DoctorAvailability.free) \
+        .join(Doctor, Doctor.id == DoctorAvailability.doctor_id)
+    if specialty:
+        query = query.where(Doctor.specialization == specialty)
+    if city:
+        query = query.where(Doctor.city == city)
+
+    found, start_dates = [], {}
+    for doctor_id, start_date, free in db.session.execute(query):
+        # Bit of the first slot at or after `after` in this bitmap
+        origin = start_dates.get(start_date)
+        if origin is None:
+            origin = start_dates[start_date] = max(0, _slot_index(start_date, after) + (
+                1 if (after.minute, after.second, after.microsecond) != (0, 0, 0) else 0))
+        bits = int.from_bytes(free, 'little') >> origin
+        if bits:
+            index = origin + (bits & -bits).bit_length() - 1
+            found.append((index + start_date.toordinal() * SLOTS_PER_DAY, doctor_id))
+    return [(datetime.fromordinal(index // SLOTS_PER_DAY) + timedelta(hours=index % SLOTS_PER_DAY), doctor_id)
+            for index, doctor_id in heapq.nsmallest(limit, found)]
+
+def describe(results):
+    """JSON rows for next_available() results, with the doctors' details (one query)"""
+    doctors = {row.id: row for row in db.session.execute(
+        select(Doctor.id, User.name, Doctor.specialization, Doctor.city, Doctor.country, Doctor.consultation_fee)
+        .join(User, User.id == Doctor.user_id)
+        .where(Doctor.id.in_([doctor_id for _, doctor_id in results])))}
+    return [{'doctor_id': doctor_id, 'name': doctors[doctor_id].name,
+             'specialization': doctors[doctor_id].specialization, 'city': doctors[doctor_id].city,
+             'country': doctors[doctor_id].country, 'fee': doctors[doctor_id].consultation_fee,
+             'date': when.strftime('%Y-%m-%d'), 'time': when.strftime('%H:%M')}
+            for when, doctor_id in results if doctor_id in doctors]
+
+# --- Hooks ---
+
+def _slot(doctor_id, when, status):
+    return (doctor_id, when) if status in ACTIVE_STATUSES and doctor_id and when else None
+
+def _appointment_inserted(mapper, connection, target):
+    slot = _slot(target.doctor_id, target.date_time, target.status)
+    if slot:
+        apply(connection, taken=[slot])
+
+def _appointment_updated(mapper, connection, target):
+    state = inspect(target)
+
+    def before(column):
+        history = state.attrs[column].history
+        return history.deleted[0] if history.deleted else getattr(target, column)
+
+    old = _slot(before('doctor_id'), before('date_time'), before('status'))
+    new = _slot(target.doctor_id, target.date_time, target.status)
+    if old != new:
+        apply(connection, taken=[new] if new else [], released=[old] if old else [])
+
+def _appointment_deleted(mapper, connection, target):
+    slot = _slot(target.doctor_id, target.date_time, target.status)
+    if slot:
+        apply(connection, released=[slot])
+
+def _schedule_changed(mapper, connection, target):
+    rebuild(connection, [target.doctor_id])
+
+def _doctor_inserted(mapper, connection, target):
+    rebuild(connection, [target.id])
+
+event.listen(Appointment, 'after_insert', _appointment_inserted)
+event.listen(Appointment, 'after_update', _appointment_updated)
+event.listen(Appointment, 'after_delete', _appointment_deleted)
+for _model in (WorkingHours, ScheduleException):
+    event.listen(_model, 'after_insert', _schedule_changed)
+    event.listen(_model, 'after_update', _schedule_changed)
+    event.listen(_model, 'after_delete', _schedule_changed)
+event.listen(Doctor, 'after_insert', _doctor_inserted)
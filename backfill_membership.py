@@ -1,25 +1,19 @@
-from app import app, db, User
-import random
-import string
-from datetime import datetime
+import time
+from app import create_app, init_db, db
+import membership
 
-def generate_id():
-    year = datetime.now().year
-    suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    return f"MB-{year}-{suffix}"
+# Give every user without a membership ID one (see membership.py), in
+# batched UPDATEs in one transaction, then make the IDs unique with an index.
+
+app = create_app()
+# reserve() needs the id_sequence table, which only `flask init-db` creates
+init_db(app)
 
 with app.app_context():
-    users = User.query.filter(User.membership_id == None).all()
-    print(f"Found {len(users)} users without Membership ID.")
-    
-    for user in users:
-        new_id = generate_id()
-        # Ensure uniqueness (simple check)
-        while User.query.filter_by(membership_id=new_id).first():
-            new_id = generate_id()
-            
-        user.membership_id = new_id
-        print(f"Assigned {new_id} to {user.name}")
-        
-    db.session.commit()
+    started = time.perf_counter()
+    with db.engine.begin() as connection:
+        result = membership.backfill(connection)
+    if result['duplicates']:
+        print(f"{result['duplicates']} users shared a Membership ID with an older account and got a new one.")
+    print(f"Assigned {result['assigned']} Membership IDs in {time.perf_counter() - started:.1f} s.")
     print("Backfill complete!")
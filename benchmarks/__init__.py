@@ -0,0 +1,6 @@
+"""Performance benchmarks for the MediBook platform.
+
+Run from the repository root, e.g. ``python -m benchmarks.slots_benchmark``.
+Every benchmark works on its own temporary SQLite database and never touches
+doctor_platform.db.
+"""
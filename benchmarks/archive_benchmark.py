@@ -0,0 +1,189 @@
+"""Benchmark: hot-table size and request latency before and after archiving, at 5M appointments.
+
+Seeds --appointments appointments spread over --years years of history and
+the next 60 days, measures the `appointment` table (rows, bytes of table and
+indexes from dbstat) and the routes that read it - week of slots, patient
+and doctor dashboards, /admin, /admin/appointments and an uncached
+/admin/api/stats window - then runs the maintenance job (archive.run) and
+measures again, adding the ?history=all dashboards.
+
+Checks afterwards: every appointment is in exactly one of the two tables,
+no past pending/confirmed appointment is left, only closed appointments older
+than ARCHIVE_AFTER_DAYS were moved, the history views show the same
+appointments as the dashboards did before, the counters and the free-slot
+bitmaps match a rebuild, a new appointment gets an unused id and a second
+run does nothing. Exits non-zero if a check fails.
+
+    python -m benchmarks.archive_benchmark [--appointments 5000000] [--years 5]
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, login, percentile, time_calls
+
+
+def table_size(connection, table):
+    """(rows, bytes of the table and its indexes)"""
+    names = [table] + [row[0] for row in connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table,))]
+    size = sum(connection.exec_driver_sql(
+        'SELECT SUM(pgsize) FROM dbstat WHERE name = ? AND aggregate = 1', (name,)).scalar() or 0
+        for name in names)
+    rows = connection.exec_driver_sql(f'SELECT COUNT(*) FROM "{table}"').scalar()
+    return rows, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=5000000)
+    parser.add_argument('--years', type=int, default=5, help='history before today')
+    parser.add_argument('--doctors', type=int, default=10000)
+    parser.add_argument('--patients', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    use_temp_database('archive.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None, 'METRICS_ENABLED': False})
+    init_db(app)
+    from sqlalchemy import func, select
+    from database import db, User, Appointment, AppointmentArchive, DoctorAvailability, ACTIVE_STATUSES
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, DOCTOR_EMAIL, LOGIN_PASSWORD
+    import archive
+    import availability
+    import queries
+    import stats
+
+    history_days = args.years * 365
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    print(f"seeding {args.appointments} appointments over {args.years} years and the next 60 days...")
+    started = time.perf_counter()
+    with app.app_context():
+        seed(doctors=args.doctors, patients=args.patients, hospitals=500, appointments=args.appointments,
+             start=today - timedelta(days=history_days), days=history_days + 60)
+        patient_email = seed_accounts()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        patient_id = User.query.filter_by(email=patient_email).one().id
+        doctor_id = 1
+        patient_ids = {a.id for a in queries.patient_appointments(patient_id)}
+        doctor_ids = {a.id for a in queries.doctor_appointments(doctor_id)}
+        newest = db.session.execute(select(func.max(Appointment.id))).scalar()
+    print(f"seeded in {time.perf_counter() - started:.0f} s")
+
+    patient = login(app.test_client(), '/login', patient_email, LOGIN_PASSWORD)
+    doctor = login(app.test_client(), '/login', DOCTOR_EMAIL, LOGIN_PASSWORD)
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    week = f"from={today:%Y-%m-%d}&to={today + timedelta(days=6):%Y-%m-%d}"
+    next_doctor = iter(range(10**9))
+
+    def stats_uncached():
+        stats._window_cache.clear()
+        return admin.get('/admin/api/stats')
+
+    routes = [
+        ('/api/slots/<id> (week)', lambda: patient.get(f"/api/slots/{next(next_doctor) % args.doctors + 1}?{week}")),
+        ('/dashboard (patient)', lambda: patient.get('/dashboard')),
+        ('/dashboard (doctor)', lambda: doctor.get('/dashboard')),
+        ('/admin', lambda: admin.get('/admin')),
+        ('/admin/appointments', lambda: admin.get('/admin/appointments')),
+        ('/admin/api/stats (uncached)', stats_uncached),
+    ]
+    history_routes = [
+        ('/dashboard?history=all (patient)', lambda: patient.get('/dashboard?history=all')),
+        ('/dashboard?history=all (doctor)', lambda: doctor.get('/dashboard?history=all')),
+    ]
+
+    def measure(routes):
+        results = {}
+        for name, call in routes:
+            response = call()
+            assert response.status_code == 200, (name, response.status_code)
+            samples = time_calls(call, args.repeat)
+            results[name] = (percentile(samples, 50), percentile(samples, 95))
+        return results
+
+    with app.app_context():
+        before_size = table_size(db.session.connection(), 'appointment')
+        db.session.rollback()
+    before = measure(routes)
+
+    print("archiving (archive.run)...")
+    with app.app_context():
+        started = time.perf_counter()
+        counts = archive.run()
+        elapsed = time.perf_counter() - started
+        connection = db.session.connection()
+        after_size = table_size(connection, 'appointment')
+        archive_size = table_size(connection, 'appointment_archive')
+        db.session.rollback()
+    print(f"{counts['completed']} completed, {counts['cancelled']} cancelled, {counts['archived']} archived "
+          f"in {elapsed:.0f} s")
+    after = measure(routes + history_routes)
+
+    print(f"\n{'table':<32} {'rows':>10} {'MiB':>8}")
+    for name, (rows, size) in (('appointment (before)', before_size), ('appointment (after)', after_size),
+                               ('appointment_archive (after)', archive_size)):
+        print(f"{name:<32} {rows:>10} {size / 2**20:>8.0f}")
+    print(f"\n{'route':<34} {'before p50':>10} {'p95':>8} {'after p50':>10} {'p95':>8}")
+    for name, _ in routes + history_routes:
+        p50, p95 = before.get(name, (None, None))
+        was = f"{p50:>10.1f} {p95:>8.1f}" if p50 is not None else f"{'-':>10} {'-':>8}"
+        print(f"{name:<34} {was} {after[name][0]:>10.1f} {after[name][1]:>8.1f}")
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    print()
+    with app.app_context():
+        cutoff = datetime.now() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+        hot = db.session.execute(select(func.count(), func.sum(Appointment.id))).one()
+        cold = db.session.execute(select(func.count(), func.sum(AppointmentArchive.id))).one()
+        shared = db.session.execute(select(func.count()).select_from(Appointment)
+                                    .join(AppointmentArchive, AppointmentArchive.id == Appointment.id)).scalar()
+        id_sum = args.appointments * (args.appointments + 1) // 2
+        check(hot[0] + cold[0] == args.appointments and hot[1] + cold[1] == id_sum and not shared, f'every appointment is in exactly one table ({hot[0]} hot, {cold[0]} archived)')
+        stale = db.session.execute(select(func.count()).where(
+            Appointment.status.in_(ACTIVE_STATUSES), Appointment.date_time < datetime.now() - archive.SLOT_LENGTH)).scalar()
+        check(stale == 0, 'no past pending or confirmed appointment is left')
+        wrong = db.session.execute(select(func.count()).where(
+            (AppointmentArchive.date_time >= cutoff) | AppointmentArchive.status.not_in(archive.ARCHIVED_STATUSES))).scalar()
+        left = db.session.execute(select(func.count()).where(
+            Appointment.status.in_(archive.ARCHIVED_STATUSES), Appointment.date_time < cutoff,
+            Appointment.id != newest)).scalar()
+        check(wrong == 0 and left == 0, 'exactly the closed appointments older than ARCHIVE_AFTER_DAYS were archived')
+        check({a.id for a in queries.patient_history(patient_id)} == patient_ids
+              and {a.id for a in queries.doctor_history(doctor_id)} == doctor_ids,
+              f'the history views show what the dashboards did before ({len(patient_ids)} and {len(doctor_ids)})')
+
+        again = archive.run()
+        check(again == {'completed': 0, 'cancelled': 0, 'archived': 0}, f'a second run does nothing ({again})')
+
+        bitmaps = {row.doctor_id: (row.start_date, row.free) for row in DoctorAvailability.query}
+        availability.rebuild(db.session.connection())
+        db.session.commit()
+        check(bitmaps == {row.doctor_id: (row.start_date, row.free) for row in DoctorAvailability.query},
+              'the free-slot bitmaps match a rebuild')
+
+        appointment = Appointment(patient_id=patient_id, doctor_id=doctor_id, status='cancelled',
+                                  date_time=today + timedelta(days=3650, hours=9))
+        db.session.add(appointment)
+        db.session.commit()
+        check(db.session.get(AppointmentArchive, appointment.id) is None,
+              f'a new appointment gets an unused id ({appointment.id})')
+        counters = stats.read_counters()
+        check(counters == stats.grouped_counts() and counters['appointment']['total'] == args.appointments + 1,
+              f"the counters match a live GROUP BY ({counters['appointment']['total']} appointments)")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
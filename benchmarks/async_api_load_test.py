@@ -0,0 +1,252 @@
+"""Load test: slot lookups at 1k concurrent clients, Flask on gunicorn vs. the async API.
+
+  checks   in process: the async API answers every read route (slots by day
+           and by range, directory lists and details, search, bad input)
+           with the same status and bytes as the Flask view; a patient's own
+           hold shows as free when their Flask session cookie is sent; other
+           requests reach the fallback app; its connections cannot write
+  load     --clients keep-alive connections (one asyncio client process)
+           each GET /api/slots/<doctor>?date=<day> in a loop for --seconds,
+           against --workers processes of:
+             flask   gunicorn (gunicorn.conf.py, gthread), the existing route
+             async   uvicorn asgi:app, the route in async_api.py
+           The response cache is off in both, so every request reads SQLite.
+           "in flight" is throughput x mean latency: the requests the
+           server had open at once on average. "resent" counts requests
+           sent again on a new connection because the server closed or
+           reset the old one, or gave no answer within 30 s. A gthread
+           worker that holds worker_connections (1000) sockets stops
+           reading them until a request finishes, so at 1k clients a
+           worker that accepted most of them can stall outright.
+
+Exits non-zero if a check fails or the async server drops requests.
+
+    python -m benchmarks.async_api_load_test [--clients 1000] [--seconds 20] [--workers 2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import timedelta
+
+from benchmarks.common import use_temp_database, login, percentile
+from benchmarks.http_load_test import ROOT, free_port, wait_for_server
+
+
+def start_server(setup, db_path, port, workers):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, PYTHONPATH=ROOT, WEB_CONCURRENCY=str(workers),
+               RESPONSE_CACHE_BACKEND='', METRICS_ENABLED='0')
+    if setup == 'flask':
+        env.update(BIND=f'127.0.0.1:{port}', GUNICORN_ACCESS_LOG='/dev/null')
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(workers), '--no-access-log', '--log-level', 'warning']
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_server(port)
+    return server
+
+
+async def _request(reader, writer, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: keep-alive\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _drive(port, paths, clients, seconds, timeout):
+    """Returns (latencies in ms, statuses, requests resent, clients that connected, elapsed seconds)"""
+    latencies, statuses, resent, connected = [], Counter(), Counter(), set()
+    stop = time.monotonic() + seconds
+
+    async def client(index):
+        rng = random.Random(index)
+        reader = writer = None
+        while time.monotonic() < stop:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+                    connected.add(index)
+                start = time.perf_counter()
+                status = await asyncio.wait_for(_request(reader, writer, rng.choice(paths)), timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError, IndexError) as e:
+                # The server closed the keep-alive connection (e.g. a recycled
+                # worker), refused it or was too slow: reconnect and resend,
+                # as a browser would
+                resent[type(e).__name__] += 1
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] += 1
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    return latencies, statuses, resent, len(connected), time.perf_counter() - started
+
+
+def drive(port, paths, clients, seconds, timeout=30):
+    return asyncio.run(_drive(port, paths, clients, seconds, timeout))
+
+
+def run_checks(app, start, patient_email, password, check):
+    """Same answers as the Flask views, in process"""
+    from database import db, Doctor
+    from async_api import AsyncApi
+    seen = []
+
+    async def fallback(scope, receive, send):
+        seen.append((scope['method'], scope['path']))
+        await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    api = AsyncApi(app, fallback)
+
+    async def call(method, url, cookie=None):
+        path, _, query = url.partition('?')
+        response = {}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            else:
+                response['body'] = message['body']
+        headers = [(b'cookie', cookie.encode())] if cookie else []
+        await api({'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+                   'headers': headers}, None, send)
+        return response['status'], response['body']
+
+    with app.app_context():
+        doctor = db.session.get(Doctor, 1)
+        city, specialty = doctor.city, doctor.specialization
+        hospital_id = doctor.hospital_id
+    day = (start + timedelta(days=1)).strftime('%Y-%m-%d')
+    last = (start + timedelta(days=7)).strftime('%Y-%m-%d')
+    client = app.test_client()
+    cursor = client.get('/api/doctors').json['next_cursor']
+    urls = [f'/api/slots/1?date={day}', f'/api/slots/2?from={day}&to={last}', f'/api/slots/3?from={day}',
+            '/api/slots/1', '/api/slots/1?date=tomorrow', f'/api/slots/1?from={last}&to={day}',
+            '/api/doctors', f'/api/doctors?city={city}&specialty={specialty}', f'/api/doctors?cursor={cursor}',
+            '/api/doctors?cursor=%%%', '/api/hospitals', '/api/hospitals?country=Germany', '/api/doctors/1',
+            '/api/doctors/999999', f'/api/hospitals/{hospital_id}', '/api/hospitals/999999',
+            '/api/search?q=card', '/api/search?q=ber+card&limit=3', '/api/search?q=', '/api/search?q=x&limit=bad']
+    for url in urls:
+        response = client.get(url)
+        status, body = asyncio.run(call('GET', url))
+        check(status == response.status_code and body == response.data, f'{url}: same answer as Flask ({status})')
+    status, body = asyncio.run(call('HEAD', '/api/doctors'))
+    check(status == 200 and body == b'', 'HEAD answers without a body')
+
+    # A patient's own hold is free to them, taken for everyone else
+    patient = login(app.test_client(), '/login', patient_email, password)
+    free = next(slot['time'] for slot in client.get(f'/api/slots/5?date={day}').json if slot['available'])
+    response = patient.post('/api/slots/5/hold', json={'date': day, 'time': free})
+    check(response.status_code == 200, f'patient holds doctor 5 at {day} {free}')
+    cookie = f"session={patient.get_cookie('session').value}"
+
+    def offered(cookie=None):
+        status, body = asyncio.run(call('GET', f'/api/slots/5?date={day}', cookie))
+        return next(slot['available'] for slot in app.json.loads(body) if slot['time'] == free)
+    check(offered(cookie), 'the hold shows as free with the session cookie')
+    check(not offered(), 'the hold shows as taken without it')
+    check(not offered('session=forged.cookie.value'), 'a forged session cookie is ignored')
+
+    asyncio.run(call('POST', '/api/slots/5/hold'))
+    asyncio.run(call('GET', '/doctors'))
+    check(seen == [('POST', '/api/slots/5/hold'), ('GET', '/doctors')], 'other requests reach the Flask app')
+
+    async def try_write():
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError
+        try:
+            async with api.engine.begin() as connection:
+                await connection.execute(text('DELETE FROM doctor'))
+        except OperationalError:
+            return False
+        finally:
+            await api.engine.dispose()
+        return True
+    check(not asyncio.run(try_write()), 'its connections are read-only')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=2, help='server processes in both setups')
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--appointments', type=int, default=200000)
+    args = parser.parse_args()
+
+    db_path = use_temp_database('async_api.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None, 'METRICS_ENABLED': False})
+    init_db(app)
+    from database import db
+    from benchmarks.seed import seed, seed_accounts, LOGIN_PASSWORD
+    import search
+
+    with app.app_context():
+        start = seed(doctors=args.doctors, patients=2000, hospitals=50, appointments=args.appointments)
+        with db.engine.begin() as connection:
+            search.rebuild_index(connection)
+        patient_email = seed_accounts()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    run_checks(app, start, patient_email, LOGIN_PASSWORD, check)
+    with app.app_context():
+        db.engine.dispose()
+
+    days = [(start + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(14)]
+    paths = [f'/api/slots/{doctor_id}?date={day}' for doctor_id in range(1, args.doctors + 1) for day in days]
+    print(f"\n{args.clients} clients, {args.workers} server processes, {args.seconds:.0f} s per setup, "
+          f"GET /api/slots/<doctor>?date=<day>")
+    print(f"{'setup':<7} {'connected':>9} {'requests':>9} {'req/s':>7} {'in flight':>9} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'resent':>7}  statuses")
+    for setup in ('flask', 'async'):
+        port = free_port()
+        server = start_server(setup, db_path, port, args.workers)
+        try:
+            drive(port, paths, min(args.clients, 50), args.warmup)
+            latencies, statuses, resent, connected, elapsed = drive(port, paths, args.clients, args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        rate = len(latencies) / elapsed
+        in_flight = rate * (sum(latencies) / len(latencies) / 1000) if latencies else 0
+        print(f"{setup:<7} {connected:>9} {len(latencies):>9} {rate:>7.0f} {in_flight:>9.0f} "
+              f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f} "
+              f"{max(latencies, default=0):>8.1f} {sum(resent.values()):>7}  {dict(statuses)} {dict(resent)}")
+        if setup == 'async':
+            check(connected == args.clients and set(statuses) == {200} and not resent,
+                  'the async API kept every client connected and answered every request with 200')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
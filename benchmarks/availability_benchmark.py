@@ -0,0 +1,196 @@
+"""Benchmark: earliest available doctor, free-slot bitmaps vs. slot lookups.
+
+Seeds --doctors doctors with appointments over the next --days days, gives
+some of them their own working hours and days off, then answers "who is
+free soonest" for specialty/city filters two ways:
+
+  slots    the slot API per doctor and per day (get_slots_for_day) until a
+           doctor has a free slot, as a client of /api/slots would
+  bitmap   availability.next_available: one query for the candidates'
+           bitmaps and a bit scan per doctor
+
+Checks that both give the same answers, and that booking, cancelling and
+confirming through the app, and schedule changes through /api/schedule,
+leave every touched bitmap equal to a rebuild from scratch. Exits non-zero
+if a check fails.
+
+    python -m benchmarks.availability_benchmark [--doctors 10000] [--appointments 300000]
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, login, count_queries, percentile, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--doctors', type=int, default=10000)
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--appointments', type=int, default=300000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--slot-filters', type=int, default=5, help='filters to answer the slow way')
+    args = parser.parse_args()
+
+    use_temp_database('availability.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None, 'METRICS_ENABLED': False,
+                      'AVAILABILITY_HORIZON_DAYS': args.days})
+    init_db(app)
+    from sqlalchemy import insert, select
+    from database import db, User, Doctor, WorkingHours, ScheduleException, DoctorAvailability
+    from slots import get_slots_for_day
+    from benchmarks.seed import seed, seed_accounts, SPECIALTIES, CITIES, ADMIN_EMAIL, DOCTOR_EMAIL, LOGIN_PASSWORD
+    import availability
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    with app.app_context():
+        seed(doctors=args.doctors, patients=args.patients, appointments=args.appointments, start=today,
+             days=args.days)
+        patient_email = seed_accounts()
+        # Every third doctor works weekdays 8-12 and 13-18; every tenth is off for the next three days
+        db.session.execute(insert(WorkingHours), [
+            {'doctor_id': doctor_id, 'weekday': weekday, 'start_hour': start, 'end_hour': end}
+            for doctor_id in range(1, args.doctors + 1, 3)
+            for weekday in range(5)
+            for start, end in ((8, 12), (13, 18))])
+        db.session.execute(insert(ScheduleException), [
+            {'doctor_id': doctor_id, 'date': (today + timedelta(days=offset)).date(), 'kind': 'off'}
+            for doctor_id in range(1, args.doctors + 1, 10)
+            for offset in range(3)])
+        start = time.perf_counter()
+        availability.rebuild(db.session.connection())
+        db.session.commit()
+        rebuild_seconds = time.perf_counter() - start
+        stored = sum(len(free) for free in db.session.execute(select(DoctorAvailability.free)).scalars())
+        doctor_id = User.query.filter_by(email=DOCTOR_EMAIL).first().doctor_profile.id
+        engine = db.engine
+    print(f"{args.doctors} doctors, {args.appointments} appointments over {args.days} days; bitmaps: "
+          f"{stored / args.doctors:.0f} bytes per doctor, {stored / 1e6:.1f} MB in all, full rebuild "
+          f"{rebuild_seconds:.1f} s")
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    def by_slots(after, specialty, city, limit=10):
+        """The answer from the slot API: each candidate's days in turn until a free slot"""
+        query = Doctor.query.with_entities(Doctor.id)
+        if specialty:
+            query = query.filter(Doctor.specialization == specialty)
+        if city:
+            query = query.filter(Doctor.city == city)
+        found = []
+        for candidate, in query:
+            for offset in range(args.days):
+                day = today + timedelta(days=offset)
+                free = [slot for slot in get_slots_for_day(candidate, day)
+                        if slot['available'] and day.replace(hour=int(slot['time'][:2])) >= after]
+                if free:
+                    found.append((day.replace(hour=int(free[0]['time'][:2])), candidate))
+                    break
+        return sorted(found)[:limit]
+
+    # Answers and timings
+    after = datetime.now()
+    filters = [(specialty, city) for specialty in SPECIALTIES for city, _ in CITIES]
+    print(f"\n{'filter':<34} {'mode':>7} {'doctors':>8} {'queries':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    with app.app_context():
+        for specialty, city in filters[:args.slot_filters]:
+            candidates = Doctor.query.filter_by(specialization=specialty, city=city).count()
+            with count_queries(engine) as counter:
+                start = time.perf_counter()
+                slow = by_slots(after, specialty, city)
+                slow_ms = (time.perf_counter() - start) * 1000
+            fast = availability.next_available(after, specialty, city)
+            check(fast == slow, f'{specialty} in {city}: same answer as the slot API ({len(fast)} doctors)')
+            print(f"{specialty + ' in ' + city:<34} {'slots':>7} {candidates:>8} {counter.count:>8} "
+                  f"{slow_ms:>9.1f} {'':>9}")
+
+        for label, specialty, city in (('specialty and city', 'Cardiology', 'Berlin'),
+                                       ('specialty only', 'Cardiology', None), ('every doctor', None, None)):
+            with count_queries(engine) as counter:
+                availability.next_available(after, specialty, city)
+            samples = time_calls(lambda: availability.next_available(after, specialty, city), args.repeat)
+            candidates = Doctor.query.filter_by(**{k: v for k, v in (('specialization', specialty), ('city', city))
+                                                   if v}).count()
+            print(f"{label:<34} {'bitmap':>7} {candidates:>8} {counter.count:>8} "
+                  f"{percentile(samples, 50):>9.2f} {percentile(samples, 95):>9.2f}")
+        samples = []
+        for specialty, city in filters:
+            samples += time_calls(lambda: availability.next_available(after, specialty, city), 3)
+        print(f"{'all ' + str(len(filters)) + ' specialty/city filters':<34} {'bitmap':>7} {'':>8} {1:>8} "
+              f"{percentile(samples, 50):>9.2f} {percentile(samples, 95):>9.2f}")
+
+    client = app.test_client()
+    response = client.get('/api/next-available?specialty=Cardiology&city=Berlin&limit=3')
+    check(response.status_code == 200 and len(response.json['items']) == 3, 'GET /api/next-available answers')
+    check(client.get('/api/next-available?after=soon').status_code == 400, 'a bad `after` is refused')
+
+    # Writes through the app keep the bitmaps exact
+    def bitmaps(doctor_ids):
+        with app.app_context():
+            return dict(db.session.execute(select(DoctorAvailability.doctor_id, DoctorAvailability.free)
+                                           .where(DoctorAvailability.doctor_id.in_(doctor_ids))).all())
+
+    def matches_rebuild(doctor_ids, message):
+        kept = bitmaps(doctor_ids)
+        with app.app_context():
+            availability.rebuild(db.session.connection(), doctor_ids)
+            db.session.commit()
+        check(kept == bitmaps(doctor_ids), message)
+
+    def soonest(doctor):
+        with app.app_context():
+            specialty, city = db.session.execute(select(Doctor.specialization, Doctor.city)
+                                                 .where(Doctor.id == doctor)).one()
+            return next(when for when, found in availability.next_available(datetime.now(), specialty, city, 10000)
+                        if found == doctor)
+
+    patient = login(app.test_client(), '/login', patient_email, LOGIN_PASSWORD)
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    target = 2  # weekdays-only doctors are 1, 4, 7...; 2 keeps the default hours
+    when = soonest(target)
+    response = patient.post(f'/book/{target}', data={'date': when.strftime('%Y-%m-%d'),
+                                                     'time': when.strftime('%H:%M'), 'type': 'online'})
+    check(response.status_code == 302, f'booked doctor {target} at {when:%Y-%m-%d %H:%M}')
+    check(soonest(target) > when, 'the booked slot is no longer offered')
+    matches_rebuild([target], 'after booking, the bitmap equals a rebuild')
+    with app.app_context():
+        from database import Appointment
+        appointment_id = Appointment.query.filter_by(doctor_id=target, date_time=when, status='pending').one().id
+    admin.get(f'/admin/appointment/{appointment_id}/cancel')
+    check(soonest(target) == when, 'cancelling offers the slot again')
+    matches_rebuild([target], 'after cancelling, the bitmap equals a rebuild')
+    admin.get(f'/admin/appointment/{appointment_id}/confirm')
+    check(soonest(target) > when, 'confirming the cancelled appointment takes the slot again (bulk path)')
+    matches_rebuild([target], 'after confirming, the bitmap equals a rebuild')
+
+    doctor = login(app.test_client(), '/login', DOCTOR_EMAIL, LOGIN_PASSWORD)
+    response = doctor.put('/api/schedule', json={'hours': [{'weekday': w, 'start': 10, 'end': 14} for w in range(7)]})
+    check(response.status_code == 200 and len(response.json['hours']) == 7, 'a doctor sets their weekly hours')
+    check(10 <= soonest(doctor_id).hour < 14, f'the new hours are offered ({soonest(doctor_id):%H:%M})')
+    first_day = soonest(doctor_id).strftime('%Y-%m-%d')
+    response = doctor.post('/api/schedule/exceptions', json={'date': first_day, 'kind': 'off'})
+    check(response.status_code == 201 and soonest(doctor_id).strftime('%Y-%m-%d') > first_day,
+          'a day off removes that day')
+    matches_rebuild([doctor_id], 'after schedule changes, the bitmap equals a rebuild')
+    with app.app_context():
+        day = datetime.strptime(first_day, '%Y-%m-%d')
+        check(not any(slot['available'] for slot in get_slots_for_day(doctor_id, day)),
+              'the slot API agrees about the day off')
+    doctor.delete(f"/api/schedule/exceptions/{response.json['id']}")
+    check(soonest(doctor_id).strftime('%Y-%m-%d') == first_day, 'removing the day off restores it')
+    check(patient.put('/api/schedule', json={'hours': []}).status_code == 403, 'patients have no schedule')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Check: concurrent bookings for one slot produce exactly one appointment.
+
+Fires --threads simultaneous booking requests (one patient per thread, all
+released by a barrier) for the same doctor and time, then the same for slot
+holds on a second time, and verifies that exactly one request wins each race
+and the rest get 409. Then checks that a patient refused a held slot keeps
+their own hold, and that the admin confirm route refuses a conflicting
+appointment. Reports wall time and throughput per race.
+
+    python -m benchmarks.booking_race_check [--threads 500]
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, login
+
+
+def race(app, patient_ids, method, url, payload):
+    """Send one request per patient at the same moment; returns (status counts, seconds)"""
+    clients = []
+    for patient_id in patient_ids:
+        client = app.test_client()
+        # Log in through the session directly: hashing 500 passwords would dominate
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(patient_id)
+            sess['_fresh'] = True
+        clients.append(client)
+
+    barrier = threading.Barrier(len(clients) + 1)
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def worker(client):
+        barrier.wait()
+        try:
+            status = getattr(client, method)(url, **payload).status_code
+        except Exception as e:
+            status = type(e).__name__
+        with lock:
+            statuses[status] += 1
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=500)
+    args = parser.parse_args()
+
+    use_temp_database('booking_race.db')
+    from app import create_app, init_db
+    app = create_app()
+    init_db(app)
+    from database import db, User, Appointment, SlotHold, ACTIVE_STATUSES
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+    import booking
+
+    app.config['EMAIL_WORKER_THREAD'] = False
+    with app.app_context():
+        seed(doctors=10, patients=args.threads, appointments=0)
+        seed_accounts()
+        patient_ids = [user.id for user in User.query.filter_by(role='patient').order_by(User.id)]
+    # Tomorrow is always bookable and the seed left every slot free
+    day = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    doctor_id = 1
+
+    failures = []
+    print(f"{'race':<8} {'threads':>8} {'seconds':>8} {'req/s':>8}  statuses")
+
+    statuses, elapsed = race(app, patient_ids, 'post', f'/book/{doctor_id}',
+                             {'data': {'date': day, 'time': '10:00', 'type': 'online'}})
+    print(f"{'booking':<8} {len(patient_ids):>8} {elapsed:>8.2f} {len(patient_ids) / elapsed:>8.0f}  {dict(statuses)}")
+    with app.app_context():
+        when = datetime.strptime(f'{day} 10:00', '%Y-%m-%d %H:%M')
+        active = Appointment.query.filter(Appointment.doctor_id == doctor_id, Appointment.date_time == when,
+                                          Appointment.status.in_(ACTIVE_STATUSES)).count()
+    # A successful booking redirects to the dashboard
+    if statuses[302] != 1 or active != 1:
+        failures.append(f'booking race: expected exactly one winner, got {statuses[302]} redirects and {active} active rows')
+    if statuses[409] != len(patient_ids) - 1:
+        failures.append(f'booking race: expected {len(patient_ids) - 1} conflicts (409)')
+
+    statuses, elapsed = race(app, patient_ids, 'post', f'/api/slots/{doctor_id}/hold',
+                             {'json': {'date': day, 'time': '11:00'}})
+    print(f"{'hold':<8} {len(patient_ids):>8} {elapsed:>8.2f} {len(patient_ids) / elapsed:>8.0f}  {dict(statuses)}")
+    with app.app_context():
+        holds = SlotHold.query.filter_by(doctor_id=doctor_id).count()
+    if statuses[200] != 1 or holds != 1:
+        failures.append(f'hold race: expected exactly one winner, got {statuses[200]} and {holds} holds')
+    if statuses[409] != len(patient_ids) - 1:
+        failures.append(f'hold race: expected {len(patient_ids) - 1} conflicts (409)')
+
+    # Trying a slot someone else holds must not cost a patient their own hold
+    with app.app_context():
+        winner = SlotHold.query.filter_by(doctor_id=doctor_id).one()
+        patient_id = next(p for p in patient_ids if p != winner.patient_id)
+        booking.hold_slot(doctor_id, when.replace(hour=12), patient_id)
+        try:
+            booking.hold_slot(doctor_id, winner.date_time, patient_id)
+        except booking.SlotUnavailable:
+            pass
+        kept = SlotHold.query.filter_by(patient_id=patient_id).count()
+    print(f"holding a taken slot -> {kept} hold(s) kept")
+    if kept != 1:
+        failures.append('a refused hold dropped the hold the patient already had')
+
+    # A cancelled request for the booked slot must not be confirmable
+    with app.app_context():
+        stale = Appointment(patient_id=patient_ids[0], doctor_id=doctor_id, date_time=when,
+                            status='cancelled', type='online')
+        db.session.add(stale)
+        db.session.commit()
+        stale_id = stale.id
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    admin.get(f'/admin/appointment/{stale_id}/confirm')
+    with app.app_context():
+        stale_status = db.session.get(Appointment, stale_id).status
+    print(f"admin confirm of a conflicting appointment -> {stale_status}")
+    if stale_status != 'cancelled':
+        failures.append('admin confirm double-booked a slot')
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
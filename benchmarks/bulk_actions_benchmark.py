@@ -0,0 +1,61 @@
+"""Benchmark: bulk confirm vs. one admin request per appointment.
+
+Confirms --items pending appointments through the per-appointment
+/admin/appointment/<id>/confirm route, then another --items in a single
+POST to /admin/appointments/bulk, and reports wall time, throughput and SQL
+statements for each. Email jobs are queued but not sent (no worker runs).
+
+    python -m benchmarks.bulk_actions_benchmark [--items 1000]
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import use_temp_database, count_queries, login
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000)
+    args = parser.parse_args()
+
+    # Configured but never contacted: jobs stay in the outbox
+    os.environ.update({'MAIL_USERNAME': 'bench@medibook.test', 'MAIL_PASSWORD': 'bench'})
+    use_temp_database('bulk.db')
+    from app import create_app, init_db
+    app = create_app()
+    init_db(app)
+    from database import db, Appointment
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+
+    app.config['EMAIL_WORKER_THREAD'] = False
+    with app.app_context():
+        seed(doctors=500, patients=2000, appointments=args.items * 10, days=365)
+        seed_accounts()
+        pending = [a.id for a in Appointment.query.filter_by(status='pending').order_by(Appointment.id)
+                   .limit(args.items * 2)]
+        engine = db.engine
+    single_ids, bulk_ids = pending[:args.items], pending[args.items:]
+
+    client = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    print(f"{'mode':<12} {'items':>6} {'requests':>9} {'statements':>11} {'seconds':>8} {'items/s':>9}")
+
+    with count_queries(engine) as counter:
+        start = time.perf_counter()
+        for appointment_id in single_ids:
+            client.get(f'/admin/appointment/{appointment_id}/confirm')
+        elapsed = time.perf_counter() - start
+    print(f"{'per-item':<12} {len(single_ids):>6} {len(single_ids):>9} {counter.count:>11} "
+          f"{elapsed:>8.2f} {len(single_ids) / elapsed:>9.0f}")
+
+    with count_queries(engine) as counter:
+        start = time.perf_counter()
+        response = client.post('/admin/appointments/bulk', json={'ids': bulk_ids, 'action': 'confirm'})
+        elapsed = time.perf_counter() - start
+    print(f"{'bulk':<12} {len(bulk_ids):>6} {1:>9} {counter.count:>11} "
+          f"{elapsed:>8.2f} {len(bulk_ids) / elapsed:>9.0f}")
+    print(f"bulk results: {response.get_json()['summary']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Shared helpers for the benchmark scripts."""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+def use_temp_database(name='bench.db'):
+    """Point the app at a fresh SQLite file. Must run before ``import app``."""
+    path = os.path.join(tempfile.mkdtemp(prefix='medibook-bench-'), name)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    return path
+
+
+class QueryCounter:
+    """Counts SQL statements issued on an engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+        self.parameters = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return False
+
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter(engine)
+    with counter:
+        yield counter
+
+
+def login(client, url, email, password):
+    """Log a test client in through a login form and return it."""
+    client.post(url, data={'email': email, 'password': password})
+    return client
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def time_calls(fn, repeat):
+    """Call fn repeat times and return the latencies in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
@@ -0,0 +1,76 @@
+"""Check: appointment confirmations go through the email outbox.
+
+Runs the app against the local SMTP stand-in (benchmarks/smtp_sink.py) set
+up as a slow server that rejects the first message. Confirms a batch of
+pending appointments through the admin route and verifies that:
+
+- each confirm request returns without waiting for SMTP,
+- every confirmation email is eventually delivered, the rejected one by retry,
+- the worker reuses SMTP connections instead of opening one per email.
+
+    python -m benchmarks.email_outbox_check [--confirm 40] [--smtp-delay 0.2]
+"""
+import argparse
+import os
+import sys
+
+from benchmarks.common import use_temp_database, login, percentile, time_calls
+from benchmarks.smtp_sink import SMTPSink
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--confirm', type=int, default=40)
+    parser.add_argument('--smtp-delay', type=float, default=0.2, help='seconds the sink takes per message')
+    args = parser.parse_args()
+
+    sink = SMTPSink(fail_first=1, delay=args.smtp_delay).start()
+    os.environ.update({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(sink.port), 'MAIL_USE_TLS': 'false',
+                       'MAIL_USERNAME': 'bench@medibook.test', 'MAIL_PASSWORD': 'bench'})
+    use_temp_database('outbox.db')
+    import outbox
+    from app import create_app, init_db
+    app = create_app()
+    init_db(app)
+    from database import Appointment, EmailJob
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+
+    app.config.update(EMAIL_RETRY_BASE_SECONDS=0.5, EMAIL_POLL_SECONDS=0.1)
+    with app.app_context():
+        seed(doctors=20, patients=50, appointments=args.confirm * 5)
+        seed_accounts()
+        pending = [a.id for a in Appointment.query.filter_by(status='pending').limit(args.confirm)]
+
+    client = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    urls = iter(f'/admin/appointment/{i}/confirm' for i in pending)
+    samples = time_calls(lambda: client.get(next(urls)), len(pending))
+    print(f"confirm requests: {len(pending)}, p50 {percentile(samples, 50):.1f} ms, "
+          f"p95 {percentile(samples, 95):.1f} ms (SMTP takes {args.smtp_delay * 1000:.0f} ms per message)")
+
+    with app.app_context():
+        idle = outbox.wait_until_idle(timeout=len(pending) * args.smtp_delay + 30)
+        sent = EmailJob.query.filter_by(status='sent').count()
+        retried = EmailJob.query.filter(EmailJob.status == 'sent', EmailJob.attempts > 0).count()
+        dead = EmailJob.query.filter_by(status='dead').count()
+    sink.stop()
+    print(f"delivered {len(sink.messages)} emails over {sink.connections} SMTP connection(s); "
+          f"jobs sent {sent}, retried {retried}, dead {dead}")
+
+    failures = []
+    if not idle:
+        failures.append('queue did not drain')
+    if sent != len(pending) or len(sink.messages) != len(pending):
+        failures.append(f'expected {len(pending)} delivered emails')
+    if retried < 1:
+        failures.append('the rejected message was not retried')
+    if sink.connections >= len(pending):
+        failures.append('SMTP connections were not reused')
+    if percentile(samples, 95) >= args.smtp_delay * 1000:
+        failures.append('confirm requests waited on SMTP')
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Load test: requests/sec over real HTTP, dev server vs. production setup.
+
+Seeds a temporary database, then for each server setup starts the server
+in a subprocess, warms it up and drives it for --seconds with --clients
+keep-alive HTTP clients (http.client, one thread each). The mix is mostly
+page and API reads, plus slot holds by logged-in patients (--write-ratio)
+so writers contend with readers.
+
+  before  Flask dev server (threaded), default SQLite settings
+  after   gunicorn (gunicorn.conf.py) with the SQLITE_PRAGMAS from app.py
+
+    python -m benchmarks.http_load_test [--seconds 15] [--clients 16]
+"""
+import argparse
+import http.client
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from benchmarks.common import use_temp_database, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def start_server(setup, db_path, port):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, PYTHONPATH=ROOT)
+    if setup == 'before':
+        command = [sys.executable, '-m', 'benchmarks.http_load_test', '--serve-dev', str(port)]
+    else:
+        env.update(BIND=f'127.0.0.1:{port}', GUNICORN_ACCESS_LOG='/dev/null')
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    server = subprocess.Popen(command, cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_server(port)
+    return server
+
+
+def serve_dev(port):
+    """The pre-production setup: dev server, no SQLite tuning"""
+    from app import create_app
+    app = create_app({'SQLITE_PRAGMAS': {}, 'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None})
+    app.run(host='127.0.0.1', port=port, threaded=True)
+
+
+class Client:
+    """One keep-alive connection, logged in as a patient"""
+
+    def __init__(self, port, email, password):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = ''
+        self.request('POST', '/login', urlencode({'email': email, 'password': password}),
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def request(self, method, url, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.connection.request(method, url, body, headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            return 'error'
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status
+
+
+def run_load(port, accounts, urls, holds, seconds, write_ratio):
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def worker(index, email, password):
+        rng = random.Random(index)
+        client = Client(port, email, password)
+        local_latencies, local_statuses = [], Counter()
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            if rng.random() < write_ratio:
+                doctor_id, day, hour = rng.choice(holds)
+                status = client.request('POST', f'/api/slots/{doctor_id}/hold',
+                                        f'{{"date": "{day}", "time": "{hour:02d}:00"}}',
+                                        {'Content-Type': 'application/json'})
+            else:
+                status = client.request('GET', rng.choice(urls))
+            local_latencies.append((time.perf_counter() - start) * 1000)
+            local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=worker, args=(i, email, password))
+               for i, (email, password) in enumerate(accounts)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--warmup', type=float, default=5, help='untimed seconds first (worker start-up, caches)')
+    parser.add_argument('--serve-dev', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_dev:
+        return serve_dev(args.serve_dev)
+
+    base_path = use_temp_database('http_before.db')
+    from app import create_app, init_db
+    # Seed without WAL: journal_mode is stored in the file, and "before" must not inherit it
+    app = create_app({'SQLITE_PRAGMAS': {}, 'EMAIL_WORKER_THREAD': False})
+    init_db(app)
+    from werkzeug.security import generate_password_hash
+    from database import db, User, Doctor
+    from benchmarks.seed import seed, LOGIN_PASSWORD
+    import search
+
+    with app.app_context():
+        start = seed(doctors=1000, patients=args.clients * 10, hospitals=50, appointments=200000)
+        with db.engine.begin() as connection:
+            search.rebuild_index(connection)
+        patients = User.query.filter_by(role='patient').order_by(User.id).limit(args.clients).all()
+        hashed = generate_password_hash(LOGIN_PASSWORD, method='pbkdf2:sha256')
+        for patient in patients:
+            patient.password = hashed
+        accounts = [(patient.email, LOGIN_PASSWORD) for patient in patients]
+        db.session.commit()
+        doctor = db.session.get(Doctor, 1)
+        city, country = doctor.city, doctor.country
+        db.engine.dispose()
+
+    tomorrow = start + timedelta(days=1)
+    day = tomorrow.strftime('%Y-%m-%d')
+    urls = ['/', '/doctors', f'/doctors?city={city}&country={country}', '/hospitals',
+            '/api/doctors', '/api/hospitals', '/api/search?q=card',
+            f'/api/slots/1?date={day}', f'/api/slots/2?from={day}&to={day}']
+    holds = [(doctor_id, (tomorrow + timedelta(days=d)).strftime('%Y-%m-%d'), hour)
+             for doctor_id in range(1, 51) for d in range(7) for hour in range(9, 17)]
+
+    after_path = base_path.replace('http_before.db', 'http_after.db')
+    shutil.copy(base_path, after_path)
+
+    print(f"{args.clients} clients, {args.seconds:.0f} s per setup, {args.write_ratio:.0%} writes")
+    print(f"{'setup':<8} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for setup, db_path in (('before', base_path), ('after', after_path)):
+        port = free_port()
+        server = start_server(setup, db_path, port)
+        try:
+            run_load(port, accounts, urls, holds, args.warmup, args.write_ratio)
+            latencies, statuses, elapsed = run_load(port, accounts, urls, holds, args.seconds, args.write_ratio)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{setup:<8} {len(latencies):>9} {len(latencies) / elapsed:>8.0f} {percentile(latencies, 50):>8.1f} "
+              f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f}  {dict(sorted(statuses.items(), key=str))}")
+
+
+if __name__ == '__main__':
+    main()
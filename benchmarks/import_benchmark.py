@@ -0,0 +1,189 @@
+"""Benchmark: bulk import of doctors and hospitals vs. the one-by-one admin form.
+
+Writes a CSV of --hospitals hospitals and --doctors doctors (with a few
+broken rows, duplicate emails and unknown hospitals mixed in, and a few
+rows carrying their own password), then:
+
+  form      adds --form-sample doctors through POST /admin/doctors and
+            extrapolates the time to the full file
+  import    runs `flask import-directory` on the file in a subprocess and
+            reports rows/s and the peak memory of that process
+  upload    posts a file of --upload-rows doctors to /admin/import, with
+            one more row carrying a password than IMPORT_UPLOAD_MAX_PASSWORDS,
+            at the default password hash cost
+
+Checks that every good row was imported, every bad row was reported with
+its line, and that search, the dashboard counters and logins (the file's
+own password and the default one) see the imported doctors; that an upload
+finishes within the gunicorn timeout and reports the password rows over the
+cap, and that an upload over IMPORT_UPLOAD_MAX_BYTES is refused. Exits
+non-zero if a check fails.
+
+    python -m benchmarks.import_benchmark [--doctors 100000]
+"""
+import argparse
+import csv
+import io
+import os
+import re
+import subprocess
+import sys
+import time
+
+from benchmarks.common import use_temp_database, login
+from benchmarks.http_load_test import ROOT
+from benchmarks.seed import SPECIALTIES, CITIES
+
+OWN_PASSWORD = 'imported-secret'
+
+
+def write_file(path, hospitals, doctors, with_password):
+    """The import file; returns {kind of bad row: count}"""
+    bad = {'missing email': 0, 'bad fee': 0, 'duplicate email': 0, 'unknown hospital': 0}
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['type', 'name', 'email', 'password', 'specialization', 'fee', 'experience_years',
+                         'city', 'country', 'hospital', 'specialties'])
+        for i in range(1, hospitals + 1):
+            city, country = CITIES[i % len(CITIES)]
+            writer.writerow(['hospital', f'Imported Hospital {i}', '', '', '', '', '', city, country, '',
+                             ', '.join(SPECIALTIES[i % 10:i % 10 + 3])])
+        for i in range(1, doctors + 1):
+            city, country = CITIES[i % len(CITIES)]
+            email, fee, hospital = f'imported{i}@import.test', str(50 + i % 400), f'Imported Hospital {1 + i % hospitals}'
+            if i % 10007 == 0:
+                email, bad['missing email'] = '', bad['missing email'] + 1
+            elif i % 10009 == 0:
+                fee, bad['bad fee'] = 'free', bad['bad fee'] + 1
+            elif i % 10037 == 0:
+                email, bad['duplicate email'] = 'imported1@import.test', bad['duplicate email'] + 1
+            elif i % 10039 == 0:
+                hospital, bad['unknown hospital'] = 'No Such Hospital', bad['unknown hospital'] + 1
+            writer.writerow(['doctor', f'Imported Doctor {i}', email, OWN_PASSWORD if i <= with_password else '',
+                             SPECIALTIES[i % len(SPECIALTIES)], fee, str(i % 40), city, country, hospital, ''])
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--doctors', type=int, default=100000)
+    parser.add_argument('--hospitals', type=int, default=500)
+    parser.add_argument('--with-password', type=int, default=20, help='rows that carry their own password')
+    parser.add_argument('--form-sample', type=int, default=10)
+    parser.add_argument('--upload-rows', type=int, default=5000)
+    args = parser.parse_args()
+
+    db_path = use_temp_database('import.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'METRICS_ENABLED': False})
+    init_db(app)
+    from database import db, User, Doctor, Hospital
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+    import search
+    import stats
+
+    with app.app_context():
+        seed(doctors=200, patients=500, appointments=2000)
+        seed_accounts()
+        db.engine.dispose()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    # Baseline: the admin form, one doctor per request
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    start = time.perf_counter()
+    for i in range(args.form_sample):
+        admin.post('/admin/doctors', data={'name': f'Form Doctor {i}', 'email': f'form{i}@import.test',
+                                           'specialization': 'General', 'city': 'Berlin', 'country': 'Germany',
+                                           'fee': '100'})
+    per_doctor = (time.perf_counter() - start) / args.form_sample
+    print(f"admin form: {per_doctor * 1000:.0f} ms per doctor -> {per_doctor * args.doctors / 60:.0f} min "
+          f"for {args.doctors} doctors")
+
+    path = os.path.join(os.path.dirname(db_path), 'directory.csv')
+    bad = write_file(path, args.hospitals, args.doctors, args.with_password)
+    print(f"import file: {os.path.getsize(path) / 1e6:.1f} MB, {args.hospitals} hospitals, {args.doctors} doctors, "
+          f"bad rows {bad}")
+
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, PYTHONPATH=ROOT, METRICS_ENABLED='0')
+    command = [sys.executable, '-c',
+               'import resource, sys\n'
+               'from flask.cli import main\n'
+               'sys.argv = ["flask", "--app", "app:create_app()", "import-directory", sys.argv[1]]\n'
+               'try:\n    main()\n'
+               'finally:\n'
+               '    print(f"maxrss_kb={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}")\n', path]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    output = result.stdout + result.stderr
+    finished = [line for line in output.splitlines() if 'Import finished' in line]
+    print('\n'.join(finished) or output[-2000:])
+    maxrss = re.search(r'maxrss_kb=(\d+)', output)
+    rows = args.hospitals + args.doctors
+    print(f"import: {elapsed:.1f} s including start-up, {rows / elapsed:,.0f} rows/s, "
+          f"peak RSS {int(maxrss.group(1)) / 1024 if maxrss else float('nan'):.0f} MB, "
+          f"{per_doctor * args.doctors / elapsed:.0f}x faster than the form")
+    check(result.returncode == 0, 'flask import-directory exits cleanly')
+
+    expected_bad = sum(bad.values())
+    with app.app_context():
+        imported = User.query.filter(User.email.like('imported%@import.test')).count()
+        check(imported == args.doctors - expected_bad,
+              f'{imported} doctors imported, {args.doctors - expected_bad} expected')
+        check(Hospital.query.filter(Hospital.name.like('Imported Hospital %')).count() == args.hospitals,
+              'every hospital imported')
+        linked = Doctor.query.join(Hospital).filter(Hospital.name == 'Imported Hospital 1').count()
+        check(linked > 0, f'doctors are linked to their hospital ({linked} at Imported Hospital 1)')
+        check(any(r['type'] == 'doctor' and r['name'] == 'Imported Doctor 12345' for r in search.search('12345')),
+              'imported doctors are searchable')
+        check(stats.read_counters() == stats.grouped_counts(), 'dashboard counters match the tables')
+        db.engine.dispose()
+    check(f'{expected_bad} failed' in (finished[0] if finished else ''), f'the report counts {expected_bad} bad rows')
+    for kind, needle in (('missing email', 'email is required'), ('bad fee', 'fee must be a number'),
+                         ('duplicate email', 'already registered'), ('unknown hospital', 'unknown hospital')):
+        check(not bad[kind] or needle in output, f'{kind} rows are reported')
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'imported1@import.test', 'password': OWN_PASSWORD})
+    check(client.get('/dashboard').status_code == 200, "a doctor can log in with the file's password")
+    client = app.test_client()
+    client.post('/login', data={'email': f'imported{args.doctors - 1}@import.test',
+                                'password': app.config['IMPORT_DEFAULT_PASSWORD']})
+    check(client.get('/dashboard').status_code == 200, 'a doctor without one can log in with the default password')
+
+    # The admin panel's upload, within one request
+    cap = app.config['IMPORT_UPLOAD_MAX_PASSWORDS']
+    upload = io.StringIO()
+    writer = csv.writer(upload)
+    writer.writerow(['name', 'email', 'password', 'specialization'])
+    for i in range(args.upload_rows):
+        writer.writerow([f'Uploaded Doctor {i}', f'uploaded{i}@import.test', OWN_PASSWORD if i <= cap else '',
+                         SPECIALTIES[i % len(SPECIALTIES)]])
+    headers = {'Accept': 'application/json'}
+    start = time.perf_counter()
+    response = admin.post('/admin/import', headers=headers,
+                          data={'file': (io.BytesIO(upload.getvalue().encode()), 'upload.csv')})
+    elapsed = time.perf_counter() - start
+    report = response.get_json() or {}
+    print(f"upload: {args.upload_rows} doctors, {cap + 1} with a password, in {elapsed:.1f} s: {report.get('errors')}")
+    check(response.status_code == 200 and elapsed < 60, 'the upload finishes within the 60 s gunicorn timeout')
+    check(report.get('doctors') == args.upload_rows - 1 and report.get('failed') == 1
+          and 'flask import-directory' in report['errors'][0]['message'],
+          f'password rows over IMPORT_UPLOAD_MAX_PASSWORDS ({cap}) are reported, the others imported')
+    oversized = b'x' * (app.config['IMPORT_UPLOAD_MAX_BYTES'] + 1)
+    response = admin.post('/admin/import', headers=headers, data={'file': (io.BytesIO(oversized), 'big.csv')})
+    check(response.status_code == 400 and 'import-directory' in response.get_json()['error'],
+          'an upload over IMPORT_UPLOAD_MAX_BYTES is refused')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
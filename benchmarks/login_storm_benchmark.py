@@ -0,0 +1,217 @@
+"""Benchmark: a login storm against page latency, hashing inline vs. in the pool.
+
+  checks   in process: a full hashing queue answers 503 with Retry-After on
+           the login and register forms; after switching PASSWORD_HASH_METHOD
+           to scrypt, a login replaces the user's pbkdf2 hash, the user can
+           still log in, and the doctor pages' cache version is not bumped
+  cost     time to hash one password per method
+  storm    gunicorn (2 workers) with --logins clients posting valid logins in
+           a loop while --pages clients read pages. Page latency is measured
+           without the storm first, then during it:
+             inline  PASSWORD_HASH_WORKERS=0 and an unbounded queue, i.e.
+                     hashing on the request threads as before
+             pool    the configured pool and queue
+           The hashing processes run at a lower priority, so while the page
+           clients keep every core busy, logins only get what is left over:
+           the pool trades login throughput for page latency.
+
+Exits non-zero if a check fails.
+
+    python -m benchmarks.login_storm_benchmark [--logins 200] [--pages 4] [--seconds 15]
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+from benchmarks.common import use_temp_database, login, percentile
+from benchmarks.http_load_test import ROOT, free_port, wait_for_server
+
+PAGES = ['/', '/doctors', '/hospitals', '/api/doctors']
+COST_METHODS = ['pbkdf2:sha256:600000', 'pbkdf2:sha256:260000', 'scrypt:32768:8:1', 'scrypt:16384:8:1']
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def drive(port, seconds, pages, accounts, password):
+    """Page readers (and login posters, one per account) for `seconds`.
+
+    Returns (page latencies in ms, login statuses).
+    """
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def reader(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        local, i = [], index
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                connection.request('GET', PAGES[i % len(PAGES)])
+                connection.getresponse().read()
+            except (http.client.HTTPException, OSError):
+                connection.close()  # a recycled worker closed it
+                continue
+            local.append((time.perf_counter() - start) * 1000)
+            i += 1
+        connection.close()
+        with lock:
+            latencies.extend(local)
+
+    def poster(email):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        local = Counter()
+        body = urlencode({'email': email, 'password': password})
+        while time.monotonic() < stop:
+            try:
+                connection.request('POST', '/login', body, FORM)
+                response = connection.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()  # a recycled worker closed it
+                continue
+            local[response.status] += 1
+            if response.status == 503:
+                # Do as asked, or the storm is only a storm of 503s
+                time.sleep(float(response.getheader('Retry-After') or 1))
+        connection.close()
+        with lock:
+            statuses.update(local)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(pages)]
+    threads += [threading.Thread(target=poster, args=(email,)) for email in accounts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=200, help='concurrent login clients')
+    parser.add_argument('--pages', type=int, default=4, help='concurrent page clients')
+    parser.add_argument('--seconds', type=float, default=15)
+    args = parser.parse_args()
+
+    db_path = use_temp_database('login_storm.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'METRICS_ENABLED': False})
+    init_db(app)
+    from werkzeug.security import generate_password_hash
+    from database import db, User, DataVersion
+    from benchmarks.seed import seed, seed_accounts, DOCTOR_EMAIL, LOGIN_PASSWORD
+    import passwords
+
+    with app.app_context():
+        seed(doctors=200, patients=max(500, args.logins), appointments=5000)
+        seed_accounts()
+        # One shared hash: hashing --logins passwords one by one would take minutes
+        hashed = User.query.filter_by(email=DOCTOR_EMAIL).first().password
+        storm_accounts = [email for email, in db.session.query(User.email).filter_by(role='patient')
+                          .order_by(User.id).limit(args.logins)]
+        User.query.filter(User.email.in_(storm_accounts)).update({'password': hashed})
+        db.session.commit()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    # A full queue: hold every place, then try the forms
+    taken = 0
+    while passwords._slots.acquire(blocking=False):
+        taken += 1
+    try:
+        client = app.test_client()
+        response = client.post('/login', data={'email': DOCTOR_EMAIL, 'password': LOGIN_PASSWORD})
+        check(response.status_code == 503 and response.headers.get('Retry-After')
+              and b'try again in a moment' in response.data,
+              f'a full queue ({taken} places) answers the login form with 503, Retry-After and the form')
+        response = client.post('/register', data={'name': 'Storm', 'email': 'storm@example.com',
+                                                  'password': 'secret', 'role': 'patient'})
+        check(response.status_code == 503, 'registering also gets 503 rather than waiting')
+        with app.app_context():
+            check(not User.query.filter_by(email='storm@example.com').first(), 'and no account is half-created')
+    finally:
+        for _ in range(taken):
+            passwords._slots.release()
+
+    # Rehash on login after changing the method
+    def doctor_state():
+        with app.app_context():
+            user = User.query.filter_by(email=DOCTOR_EMAIL).first()
+            version = db.session.get(DataVersion, 'doctor')
+            return user.password, user.row_version, version.version if version else 0
+
+    before_hash, before_row, before_version = doctor_state()
+    configured = passwords._config['method']
+    passwords._config['method'] = passwords.full_method('scrypt')
+    try:
+        client = login(app.test_client(), '/login', DOCTOR_EMAIL, LOGIN_PASSWORD)
+        check(client.get('/dashboard').status_code == 200, 'a pbkdf2 user logs in after the switch to scrypt')
+        after_hash, after_row, after_version = doctor_state()
+        check(before_hash.startswith('pbkdf2:sha256:') and after_hash.startswith('scrypt:32768:8:1$'),
+              f"the login stored a new hash ({before_hash.split('$')[0]} -> {after_hash.split('$')[0]})")
+        check((after_row, after_version) == (before_row, before_version),
+              'the rehash bumps neither the row version nor the doctor pages cache version')
+        client = login(app.test_client(), '/login', DOCTOR_EMAIL, LOGIN_PASSWORD)
+        check(client.get('/dashboard').status_code == 200, 'the user logs in with the new hash')
+        check(doctor_state()[0] == after_hash, 'a current hash is left alone')
+    finally:
+        passwords._config['method'] = configured
+
+    print(f"\n{'method':<24} {'ms per hash':>12}")
+    for method in COST_METHODS:
+        start = time.perf_counter()
+        for _ in range(3):
+            generate_password_hash(LOGIN_PASSWORD, method)
+        print(f"{method:<24} {(time.perf_counter() - start) / 3 * 1000:>12.0f}")
+
+    print(f"\n{args.logins} login clients, {args.pages} page clients, gunicorn with 2 workers")
+    print(f"{'setup':<18} {'logins/s':>9} {'503/s':>7} {'page req/s':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    modes = [('inline', {'PASSWORD_HASH_WORKERS': '0', 'PASSWORD_HASH_QUEUE': '100000'}),
+             ('pool', {})]
+    results = {}
+    for mode, settings in modes:
+        port = free_port()
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, PYTHONPATH=ROOT, BIND=f'127.0.0.1:{port}',
+                   WEB_CONCURRENCY='2', GUNICORN_ACCESS_LOG='/dev/null', METRICS_ENABLED='0', **settings)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                  cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server(port)
+            drive(port, 2, args.pages, storm_accounts[:2], LOGIN_PASSWORD)  # warm up, start the hash pools
+            for phase, accounts in (('quiet', []), ('storm', storm_accounts)):
+                latencies, statuses = drive(port, args.seconds, args.pages, accounts, LOGIN_PASSWORD)
+                row = {'logins': statuses[302] / args.seconds, 'busy': statuses[503] / args.seconds,
+                       'failed': sum(count for status, count in statuses.items() if status not in (302, 503)),
+                       'pages': len(latencies) / args.seconds, 'p50': percentile(latencies, 50),
+                       'p95': percentile(latencies, 95), 'p99': percentile(latencies, 99)}
+                results[(mode, phase)] = row
+                print(f"{mode + ', ' + phase:<18} {row['logins']:>9.1f} {row['busy']:>7.1f} {row['pages']:>11.1f} "
+                      f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    for mode, _ in modes:
+        storm = results[(mode, 'storm')]
+        check(storm['logins'] > 0 and not storm['failed'],
+              f"{mode}: logins succeed during the storm ({storm['failed']} failed otherwise)")
+    inline, pool = results[('inline', 'storm')], results[('pool', 'storm')]
+    print(f"page p99 during the storm: {inline['p99']:.0f} ms inline -> {pool['p99']:.0f} ms with the pool")
+    check(pool['p99'] < inline['p99'], 'the pool keeps page tail latency below hashing on request threads')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
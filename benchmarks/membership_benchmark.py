@@ -0,0 +1,186 @@
+"""Benchmark: membership ID backfill and allocation.
+
+Builds a database the way migrate_db.py left older installs (membership_id
+as plain TEXT, no unique index) with --users users. Most of them have no ID,
+some have IDs from the old random generator, and a few share one. Then:
+
+  old       the previous backfill (random ID, one lookup per candidate, ORM
+            update) on --old-sample users, extrapolated to every user
+  backfill  membership.backfill(): batched UPDATEs in one transaction, then
+            the unique index
+  workers   --workers processes allocate --per-worker IDs each at the same
+            time from their own reserved blocks
+
+Checks that every user ends up with a well-formed, unique ID, that old IDs
+are kept (the oldest account keeps a shared one), that the index exists,
+that concurrent workers never hand out the same ID and that a block skips
+IDs already taken. Exits non-zero if a check fails.
+
+    python -m benchmarks.membership_benchmark [--users 1000000] [--workers 4]
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import string
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.common import use_temp_database
+from benchmarks.http_load_test import ROOT
+
+ID_FORMAT = re.compile(r'^MB-\d{4}-[0-9A-Z]{6}$')
+# user as created before membership_id had a unique index (see migrate_db.py)
+LEGACY_USER_TABLE = """
+    CREATE TABLE user (
+        id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, email VARCHAR(120) NOT NULL UNIQUE,
+        password VARCHAR(200) NOT NULL, role VARCHAR(20) NOT NULL, phone_number TEXT, membership_id TEXT,
+        row_version INTEGER NOT NULL DEFAULT 1
+    )
+"""
+WORKER = """
+import sys
+from app import create_app
+import membership
+app = create_app({'EMAIL_WORKER_THREAD': False, 'METRICS_ENABLED': False})
+with app.app_context():
+    ids = [membership.allocate() for _ in range(int(sys.argv[1]))]
+print('\\n'.join(ids))
+"""
+
+
+def old_id(rng, year):
+    return f"MB-{year}-{''.join(rng.choices(string.ascii_uppercase + string.digits, k=6))}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--with-id', type=float, default=0.05, help='share of users with an old random ID')
+    parser.add_argument('--shared', type=int, default=100, help='old IDs given to a second user as well')
+    parser.add_argument('--old-sample', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--per-worker', type=int, default=2000)
+    args = parser.parse_args()
+
+    db_path = use_temp_database('membership.db')
+    year = datetime.now().year
+    rng = random.Random(21)
+    connection = sqlite3.connect(db_path)
+    connection.execute(LEGACY_USER_TABLE)
+    old_ids = {}
+    handed_out = set()
+    batch = []
+    for i in range(1, args.users + 1):
+        membership_id = None
+        if rng.random() < args.with_id:
+            membership_id = old_id(rng, year)
+            while membership_id in handed_out:  # the old generator collided too; share IDs on purpose below
+                membership_id = old_id(rng, year)
+            handed_out.add(membership_id)
+            old_ids[i] = membership_id
+        batch.append((f'Patient {i}', f'patient{i}@bench.test', 'pbkdf2:sha256:benchmark', 'patient', membership_id))
+        if len(batch) == 50000 or i == args.users:
+            connection.executemany("INSERT INTO user (name, email, password, role, membership_id) "
+                                   "VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    # Some old IDs were handed out twice
+    shared = rng.sample(sorted(old_ids), min(args.shared, len(old_ids)))
+    newer = [i for i in range(args.users, 0, -1) if i not in old_ids][:len(shared)]
+    connection.executemany("UPDATE user SET membership_id = ? WHERE id = ?",
+                           [(old_ids[owner], twin) for owner, twin in zip(shared, newer)])
+    connection.commit()
+    connection.close()
+    print(f"{args.users} users, {len(old_ids)} with an old random ID, {len(shared)} of those shared")
+
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'METRICS_ENABLED': False})
+    init_db(app)
+    from sqlalchemy import func, select
+    from database import db, User
+    import membership
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    with app.app_context():
+        # The previous script, on a sample, rolled back
+        users = User.query.filter(User.membership_id == None).limit(args.old_sample).all()  # noqa: E711
+        start = time.perf_counter()
+        for user in users:
+            new_id = old_id(random, year)
+            while User.query.filter_by(membership_id=new_id).first():
+                new_id = old_id(random, year)
+            user.membership_id = new_id
+        db.session.flush()
+        old_seconds = (time.perf_counter() - start) / len(users) * (args.users - len(old_ids))
+        db.session.rollback()
+        print(f"old backfill: {len(users)} users in {old_seconds * len(users) / (args.users - len(old_ids)):.1f} s "
+              f"-> {old_seconds / 60:.1f} min for {args.users - len(old_ids)}")
+
+        start = time.perf_counter()
+        with db.engine.begin() as connection:
+            result = membership.backfill(connection)
+        seconds = time.perf_counter() - start
+        print(f"backfill: {result['assigned']} IDs in {seconds:.1f} s ({result['assigned'] / seconds:,.0f}/s), "
+              f"{result['duplicates']} duplicates reassigned, {old_seconds / seconds:.0f}x faster")
+
+        ids = dict(db.session.execute(select(User.id, User.membership_id)).all())
+        check(None not in ids.values(), 'every user has an ID')
+        check(len(set(ids.values())) == len(ids), 'IDs are unique')
+        check(all(ID_FORMAT.match(value) for value in ids.values()), 'IDs keep the MB-YYYY-XXXXXX format')
+        check(all(ids[i] == value for i, value in old_ids.items()), 'old IDs are kept, by the oldest account when shared')
+        check(result['duplicates'] == len(shared), f"{result['duplicates']} shared IDs reassigned, {len(shared)} expected")
+        with db.engine.connect() as connection:
+            check(membership.has_unique_index(connection), 'membership_id has a unique index')
+        taken = set(ids.values())
+
+        # The next numbers of the counter: one is already someone's old ID
+        with db.engine.begin() as connection:
+            start_number, _ = membership.reserve(connection, year, 0)
+        blocker = membership.encode(year, start_number + 1)
+        db.session.add(User(name='Old member', email='old-member@bench.test', password='x', role='patient',
+                            membership_id=blocker))
+        db.session.commit()
+        taken.add(blocker)
+        allocated = [membership.allocate() for _ in range(3)]
+        check(blocker not in allocated and len(set(allocated) | taken) == len(taken) + 3,
+              f'a block skips an ID that is already taken ({blocker})')
+
+    # Concurrent workers
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    processes = [subprocess.Popen([sys.executable, '-c', WORKER, str(args.per_worker)], cwd=ROOT, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                 for _ in range(args.workers)]
+    issued = []
+    for process in processes:
+        out, _ = process.communicate()
+        issued += [line for line in out.splitlines() if ID_FORMAT.match(line)]
+    seconds = time.perf_counter() - start
+    print(f"workers: {len(issued)} IDs from {args.workers} processes in {seconds:.1f} s including start-up")
+    check(len(issued) == args.workers * args.per_worker, 'every worker allocated its IDs')
+    check(len(set(issued)) == len(issued) and not set(issued) & taken,
+          'no ID was issued twice or collides with an existing one')
+
+    client = app.test_client()
+    client.post('/register', data={'name': 'New', 'email': 'new-member@bench.test', 'password': 'secret',
+                                   'role': 'patient'})
+    with app.app_context():
+        new_id = db.session.execute(select(User.membership_id).where(User.email == 'new-member@bench.test')).scalar()
+        count = db.session.execute(select(func.count()).where(User.membership_id == new_id)).scalar()
+    check(bool(new_id and ID_FORMAT.match(new_id)) and count == 1, f'registering assigns a fresh ID ({new_id})')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Benchmark: request metrics, slow-query log and the on-demand profiler.
+
+  format     /admin/metrics parses as Prometheus text, histograms are
+             cumulative and it is closed to anonymous users
+  counts     request and SQL statement counts match what was sent and what
+             the engine executed; with SLOW_QUERY_MS=0 every statement is
+             logged with its endpoint
+  profiler   X-Profile in sample and cprofile mode returns a profile, a
+             wrong token returns the page
+  gunicorn   with 2 workers the scraped totals add up across processes, and
+             throughput with METRICS_ENABLED off vs. on shows the overhead
+
+Exits non-zero if a check fails.
+
+    python -m benchmarks.metrics_benchmark [--requests 200] [--seconds 10]
+"""
+import argparse
+import http.client
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+
+from benchmarks.common import use_temp_database, login, count_queries, percentile
+from benchmarks.http_load_test import ROOT, free_port, wait_for_server
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+URLS = ['/', '/doctors', '/hospitals', '/api/doctors', '/api/hospitals']
+
+
+def parse_prometheus(text):
+    """(errors, {(name, frozenset(labels)): value}) for an exposition"""
+    errors, samples, typed = [], {}, set()
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            typed.add(line.split()[2])
+            continue
+        if not line or line.startswith('#'):
+            continue
+        match = SAMPLE.match(line)
+        if not match:
+            errors.append(f'unparseable: {line}')
+            continue
+        name = match.group(1)
+        if re.sub(r'_(bucket|sum|count)$', '', name) not in typed and name not in typed:
+            errors.append(f'no # TYPE before {name}')
+        labels = frozenset(re.findall(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"', match.group(2) or ''))
+        samples[(name, labels)] = float(match.group(3))
+    return errors, samples
+
+
+def histogram_errors(samples, family):
+    """Buckets must not decrease with `le`, and +Inf must equal _count"""
+    errors, series = [], {}
+    for (name, labels), value in samples.items():
+        if name == f'{family}_bucket':
+            rest = frozenset(pair for pair in labels if pair[0] != 'le')
+            le = dict(labels)['le']
+            series.setdefault(rest, []).append((float('inf') if le == '+Inf' else float(le), value))
+    for rest, buckets in series.items():
+        counts = [value for _, value in sorted(buckets)]
+        if counts != sorted(counts):
+            errors.append(f'{family} {dict(rest)} buckets decrease')
+        if counts[-1] != samples.get((f'{family}_count', rest)):
+            errors.append(f'{family} {dict(rest)} +Inf != _count')
+    return errors
+
+
+def total(samples, name, **labels):
+    wanted = set(labels.items())
+    return sum(value for (metric, pairs), value in samples.items() if metric == name and wanted <= pairs)
+
+
+def scrape(port, token):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    connection.request('GET', '/admin/metrics', headers={'Authorization': f'Bearer {token}'})
+    text = connection.getresponse().read().decode()
+    connection.close()
+    return parse_prometheus(text)[1]
+
+
+def hammer(port, seconds, connections=4):
+    """GETs over keep-alive connections for `seconds`; returns (requests/s, latencies, requests per URL)"""
+    latencies, sent, lock = [], Counter(), threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def worker(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local, urls, i = [], Counter(), index
+        while time.monotonic() < stop:
+            url = URLS[i % len(URLS)]
+            start = time.perf_counter()
+            try:
+                connection.request('GET', url)
+                connection.getresponse().read()
+            except (http.client.HTTPException, OSError):
+                # A recycled worker (max_requests) closed the keep-alive connection
+                connection.close()
+                continue
+            local.append((time.perf_counter() - start) * 1000)
+            urls[url] += 1
+            i += 1
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            sent.update(urls)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / seconds, latencies, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    db_path = use_temp_database('metrics.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None, 'METRICS_ENABLED': True,
+                      'METRICS_DIR': None, 'METRICS_TOKEN': 'scrape-token', 'PROFILE_TOKEN': 'profile-token'})
+    init_db(app)
+    from database import db
+    import metrics
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+
+    with app.app_context():
+        seed(doctors=500, patients=1000, appointments=10000)
+        seed_accounts()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    client = app.test_client()
+    check(client.get('/admin/metrics').status_code == 403, '/admin/metrics is closed to anonymous users')
+    check(client.get('/admin/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403,
+          'a wrong bearer token is refused')
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    check(admin.get('/admin/metrics').status_code == 200, 'an admin session can read /admin/metrics')
+
+    # Counts: requests and statements against what was sent and executed
+    scrape_headers = {'Authorization': 'Bearer scrape-token'}
+    before = parse_prometheus(client.get('/admin/metrics', headers=scrape_headers).get_data(as_text=True))[1]
+    log = io.StringIO()
+    metrics._config['slow_query_ms'] = 0  # log every statement
+    with app.app_context():
+        engine = db.engine
+    with redirect_stdout(log), count_queries(engine) as counter:
+        for _ in range(args.requests):
+            client.get('/doctors')
+    metrics._config['slow_query_ms'] = app.config['SLOW_QUERY_MS']
+    response = client.get('/admin/metrics', headers=scrape_headers)
+    check(response.content_type.startswith('text/plain; version=0.0.4'), 'served as Prometheus text 0.0.4')
+    errors, after = parse_prometheus(response.get_data(as_text=True))
+    for family in ('medibook_http_request_duration_seconds', 'medibook_http_response_size_bytes'):
+        errors += histogram_errors(after, family)
+    check(not errors, 'every line parses, has a # TYPE and histograms are cumulative' +
+          ''.join(f'\n     {error}' for error in errors[:5]))
+
+    def delta(name, **labels):
+        return total(after, name, **labels) - total(before, name, **labels)
+
+    requests = delta('medibook_http_requests_total', endpoint='list_doctors', method='GET', status='200')
+    check(requests == args.requests, f'list_doctors requests: {requests:.0f} counted, {args.requests} sent')
+    statements = delta('medibook_sql_statements_total', endpoint='list_doctors')
+    check(statements == counter.count, f'SQL statements: {statements:.0f} counted, {counter.count} executed')
+    slow = [line for line in log.getvalue().splitlines() if line.startswith('🐢') and 'list_doctors' in line]
+    check(len(slow) == counter.count, f'SLOW_QUERY_MS=0 logs every statement with its route ({len(slow)} lines)')
+    check(delta('medibook_template_render_seconds_total', endpoint='list_doctors') > 0, 'render time is recorded')
+    check(delta('medibook_http_response_size_bytes_count', endpoint='list_doctors') == args.requests,
+          'response sizes are recorded')
+    timing = client.get('/doctors').headers.get('Server-Timing', '')
+    check(all(part in timing for part in ('sql;dur=', 'render;dur=', 'total;dur=')), f'Server-Timing: {timing}')
+
+    # Profiler
+    with redirect_stdout(io.StringIO()):
+        page = client.get('/hospitals', headers={'X-Profile': 'wrong'})
+        sampled = client.get('/hospitals', headers={'X-Profile': 'profile-token'})
+        profiled = client.get('/hospitals', headers={'X-Profile': 'profile-token', 'X-Profile-Mode': 'cprofile'})
+    check(page.content_type.startswith('text/html'), 'a wrong X-Profile token gets the page')
+    check(sampled.headers.get('X-Profiled-Status') == '200 OK' and b'samples' in sampled.data
+          and b'list_hospitals' in sampled.data, 'sample mode returns stacks through the view')
+    check(b'function calls' in profiled.data, 'cprofile mode returns cProfile stats')
+    print('\n'.join(sampled.get_data(as_text=True).splitlines()[:12]))
+
+    # Gunicorn: aggregation across workers, then overhead
+    print(f"\n{'gunicorn, 2 workers':<24} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    results = {}
+    for enabled in ('0', '1'):
+        port = free_port()
+        metrics_dir = tempfile.mkdtemp(prefix='medibook-metrics-bench-')
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, PYTHONPATH=ROOT, BIND=f'127.0.0.1:{port}',
+                   WEB_CONCURRENCY='2', GUNICORN_ACCESS_LOG='/dev/null', METRICS_ENABLED=enabled,
+                   METRICS_DIR=metrics_dir, METRICS_TOKEN='scrape-token')
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                  cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server(port)
+            sent = hammer(port, 1)[2]  # warm both workers
+            rate, latencies, load = hammer(port, args.seconds)
+            sent.update(load)
+            results[enabled] = rate
+            print(f"{'metrics ' + ('on' if enabled == '1' else 'off'):<24} {rate:>8.0f} "
+                  f"{percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f}")
+            if enabled == '1':
+                # Workers flush once a second: scrape until they have caught up
+                deadline, counted = time.monotonic() + 20, 0
+                while counted != sent['/'] and time.monotonic() < deadline:
+                    time.sleep(1.1)
+                    counted = total(scrape(port, 'scrape-token'), 'medibook_http_requests_total', endpoint='index')
+                files = [name for name in os.listdir(metrics_dir) if name.endswith('.json')]
+                check(len(files) >= 2, f'{len(files)} worker processes wrote their series to METRICS_DIR')
+                check(counted == sent['/'], f"scraped index requests across workers: {counted:.0f}, "
+                                            f"{sent['/']} sent")
+        finally:
+            server.terminate()
+            server.wait()
+    overhead = (1 - results['1'] / results['0']) * 100 if results.get('0') else 0
+    print(f'metrics overhead: {overhead:.1f}% throughput')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
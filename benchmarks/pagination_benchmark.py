@@ -0,0 +1,80 @@
+"""Benchmark: keyset pages and the streamed appointment export.
+
+Measures /admin/appointments latency on the first page and deep into the
+table (keyset cursor vs. the OFFSET query it replaces), then streams
+/admin/appointments/export and reports time to first byte, total time and
+peak Python memory (tracemalloc) while the body is consumed.
+
+    python -m benchmarks.pagination_benchmark [--appointments 1000000] [--repeat 20]
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import use_temp_database, login, percentile, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=1000000)
+    parser.add_argument('--doctors', type=int, default=2000)
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    use_temp_database('pagination.db')
+    import queries
+    from app import create_app, init_db
+    # Measure the render path, not the response cache
+    app = create_app({'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    from database import db, Appointment
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+
+    with app.app_context():
+        seed(doctors=args.doctors, patients=args.patients, appointments=args.appointments, days=365)
+        seed_accounts()
+        depth = int(args.appointments * 0.9)
+        deep = Appointment.query.order_by(Appointment.date_time.desc(), Appointment.id.desc()).offset(depth).first()
+        deep_cursor = queries.encode_cursor(deep.date_time, deep.id)
+
+        def offset_page():
+            queries._appointment_rows().order_by(Appointment.date_time.desc(), Appointment.id.desc()) \
+                .offset(depth).limit(queries.PAGE_SIZE).all()
+            db.session.expunge_all()
+
+        samples = time_calls(offset_page, args.repeat)
+    print(f"Seeded {args.appointments} appointments")
+    print(f"{'page':<28} {'p50 ms':>9} {'p95 ms':>9}")
+    print(f"{'OFFSET ' + str(depth) + ' (old)':<28} {percentile(samples, 50):>9.2f} {percentile(samples, 95):>9.2f}")
+
+    client = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    for label, url in [('first page', '/admin/appointments'),
+                       (f'cursor at row {depth}', f'/admin/appointments?cursor={deep_cursor}'),
+                       ('json, cursor', f'/admin/api/appointments?cursor={deep_cursor}')]:
+        samples = time_calls(lambda: client.get(url), args.repeat)
+        print(f"{label:<28} {percentile(samples, 50):>9.2f} {percentile(samples, 95):>9.2f}")
+
+    def stream_export():
+        start = time.perf_counter()
+        response = client.get('/admin/appointments/export')
+        body = iter(response.response)
+        size = len(next(body))
+        ttfb = (time.perf_counter() - start) * 1000
+        for chunk in body:
+            size += len(chunk)
+        response.close()
+        return ttfb, time.perf_counter() - start, size
+
+    ttfb, total, size = stream_export()
+    # Second pass under tracemalloc (which slows Python down, so not timed)
+    tracemalloc.start()
+    stream_export()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"export: ttfb {ttfb:.1f} ms, total {total:.1f} s, "
+          f"{size / 1e6:.1f} MB streamed, peak memory {peak / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
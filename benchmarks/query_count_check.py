@@ -0,0 +1,105 @@
+"""Check: per-route SQL statement ceilings.
+
+Renders each list page through the Flask test client on a seeded database
+(5k appointments by default) and counts the SQL statements it issues. A route
+that goes over its ceiling - typically because a template started walking a
+lazy relationship per row again - is reported and the script exits non-zero.
+Warm requests must also issue no identity lookups (user by primary key): the
+login loader and admin session check are served from identity.py's cache.
+Finally a profile edit must show up on the next page, i.e. invalidate it.
+
+    python -m benchmarks.query_count_check [--appointments 5000]
+"""
+import argparse
+import re
+import sys
+
+from benchmarks.common import use_temp_database, count_queries, login
+
+# Maximum statements per warm request, independent of table size. The user
+# loader and admin session lookups are cached, so they add nothing.
+CEILINGS = {
+    'index': 2,
+    'list_doctors': 1,
+    'list_hospitals': 2,
+    'dashboard_patient': 2,
+    'dashboard_doctor': 3,
+    'dashboard_patient_history': 3,
+    'dashboard_doctor_history': 4,
+    'admin_dashboard': 3,
+    'admin_appointments': 2,
+    'admin_doctors': 2,
+    'admin_hospitals': 2,
+}
+
+# SELECT ... FROM user WHERE user.id = ? (load_user / get_current_admin)
+IDENTITY_QUERY = re.compile(r'FROM user\s+WHERE user\.id = \?')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=5000)
+    parser.add_argument('--doctors', type=int, default=200)
+    args = parser.parse_args()
+
+    use_temp_database('counts.db')
+    from app import create_app, init_db
+    # Measure the render path, not the response cache
+    app = create_app({'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    from database import db
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, DOCTOR_EMAIL, LOGIN_PASSWORD
+
+    with app.app_context():
+        seed(doctors=args.doctors, appointments=args.appointments)
+        patient_email = seed_accounts()
+        engine = db.engine
+
+    # Requests run outside the seeding context so each gets its own app
+    # context, session and flask_login user cache, as in production
+    anonymous = app.test_client()
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    patient = login(app.test_client(), '/login', patient_email, LOGIN_PASSWORD)
+    doctor = login(app.test_client(), '/login', DOCTOR_EMAIL, LOGIN_PASSWORD)
+
+    routes = [
+        ('index', anonymous, '/'),
+        ('list_doctors', anonymous, '/doctors'),
+        ('list_hospitals', anonymous, '/hospitals'),
+        ('dashboard_patient', patient, '/dashboard'),
+        ('dashboard_doctor', doctor, '/dashboard'),
+        ('dashboard_patient_history', patient, '/dashboard?history=all'),
+        ('dashboard_doctor_history', doctor, '/dashboard?history=all'),
+        ('admin_dashboard', admin, '/admin'),
+        ('admin_appointments', admin, '/admin/appointments'),
+        ('admin_doctors', admin, '/admin/doctors'),
+        ('admin_hospitals', admin, '/admin/hospitals'),
+    ]
+
+    failures = 0
+    print(f"{'route':<26} {'statements':>10} {'ceiling':>8} {'identity':>9}")
+    for name, client, url in routes:
+        # Warm-up request: ceilings are for steady state, after caches fill
+        client.get(url)
+        with count_queries(engine) as counter:
+            response = client.get(url)
+        ceiling = CEILINGS[name]
+        identity_queries = sum(bool(IDENTITY_QUERY.search(statement)) for statement in counter.statements)
+        failed = response.status_code != 200 or counter.count > ceiling or identity_queries
+        failures += failed
+        flag = '  FAIL' if failed else ''
+        print(f"{name:<26} {counter.count:>10} {ceiling:>8} {identity_queries:>9}{flag}")
+
+    # The cached user must not outlive a profile edit
+    patient.post('/profile', data={'name': 'Renamed Patient', 'phone': '', 'email': patient_email})
+    if b'Renamed Patient' not in patient.get('/dashboard').data:
+        failures += 1
+        print("profile edit not visible on the next request  FAIL")
+
+    if failures:
+        print(f"{failures} check(s) failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Check: hot routes must not fall back to full table scans.
+
+Drives each route through the Flask test client on a small seeded database,
+and runs the background jobs that query by time (appointment reminders),
+captures the SQL they issue and runs EXPLAIN QUERY PLAN on every statement.
+A filtered statement whose plan contains a bare ``SCAN <table>`` (no index),
+or any statement that sorts table rows through a temp B-tree, is reported and
+the script exits non-zero. Sorting the output of a GROUP BY (e.g. the
+dashboard's top-doctors list) and scanning a subquery's result are expected.
+
+    python -m benchmarks.query_plan_check
+"""
+import re
+import sys
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, count_queries, login
+
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+GROUP_BY = re.compile(r'\bGROUP BY\b', re.IGNORECASE)
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def explain(connection, statement, parameters):
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def problems_in(statement, plan):
+    problems = []
+    filtered = WHERE.search(statement) is not None
+    grouped = GROUP_BY.search(statement) is not None
+    for step in plan:
+        scan = FULL_SCAN.match(step)
+        # anon_N is a subquery's result, not a table
+        if filtered and scan and not scan.group(1).startswith('anon_'):
+            problems.append(step)
+        if step.startswith(TEMP_SORT) and not grouped:
+            problems.append(step)
+    return problems
+
+
+def main():
+    use_temp_database('plan.db')
+    from app import create_app, init_db
+    # Measure the render path, not the response cache. Reminders are only
+    # claimed with SMTP credentials; no worker sends the queued jobs.
+    app = create_app({'RESPONSE_CACHE_BACKEND': None, 'EMAIL_WORKER_THREAD': False,
+                      'REMINDER_SCHEDULER_THREAD': False,
+                      'MAIL_USERNAME': 'check@medibook.test', 'MAIL_PASSWORD': 'check'})
+    init_db(app)
+    import archive
+    import queries
+    import reminders
+    from database import db, Doctor, Appointment
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, DOCTOR_EMAIL, LOGIN_PASSWORD
+
+    with app.app_context():
+        # A year of appointments, the older ones archived (see archive.py)
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        seed(doctors=200, patients=500, hospitals=20, appointments=20000, start=today - timedelta(days=270), days=365)
+        archive.run()
+        start = today + timedelta(days=1)
+        db.session.execute(db.text('ANALYZE'))
+        patient_email = seed_accounts()
+        doctor = Doctor.query.first()
+        day = start.strftime('%Y-%m-%d')
+        engine = db.engine
+        # Cursors into the middle of each listing, to check the keyset seek
+        middle = Appointment.query.order_by(Appointment.date_time.desc(), Appointment.id.desc()).offset(10000).first()
+        appointment_cursor = queries.encode_cursor(middle.date_time, middle.id)
+        doctor_cursor = queries.encode_cursor(100)
+
+    # Requests run outside the seeding context so each gets its own session
+    anonymous = app.test_client()
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    patient = login(app.test_client(), '/login', patient_email, LOGIN_PASSWORD)
+    doctor_client = login(app.test_client(), '/login', DOCTOR_EMAIL, LOGIN_PASSWORD)
+
+    routes = [
+        (anonymous, '/'),
+        (anonymous, f'/api/slots/{doctor.id}?date={day}'),
+        (anonymous, f'/api/slots/{doctor.id}?from={day}&to={day}'),
+        (anonymous, f'/api/next-available?specialty={doctor.specialization}&city={doctor.city}'),
+        (anonymous, f'/doctors?specialty={doctor.specialization}'),
+        (anonymous, f'/doctors?city={doctor.city}&country={doctor.country}'),
+        (anonymous, f'/hospitals?city={doctor.city}'),
+        (patient, '/dashboard'),
+        (doctor_client, '/dashboard'),
+        (patient, '/dashboard?history=all'),
+        (doctor_client, '/dashboard?history=all'),
+        (admin, '/admin'),
+        (admin, '/admin/api/stats'),
+        (admin, '/admin/appointments'),
+        (admin, f'/admin/appointments?cursor={appointment_cursor}'),
+        (admin, f'/admin/api/appointments?cursor={appointment_cursor}'),
+        (admin, '/admin/appointments/export'),
+        (anonymous, f'/doctors?cursor={doctor_cursor}'),
+        (anonymous, f'/api/doctors?specialty={doctor.specialization}&cursor={doctor_cursor}'),
+        (anonymous, f'/api/hospitals?cursor={queries.encode_cursor(10)}'),
+    ]
+
+    def report(name, counter):
+        route_problems = []
+        with engine.connect() as connection:
+            for statement, parameters in zip(counter.statements, counter.parameters):
+                for step in problems_in(statement, explain(connection, statement, parameters)):
+                    route_problems.append((step, statement))
+        status = 'FAIL' if route_problems else 'ok'
+        print(f"{status:>4} {name} ({counter.count} statements)")
+        for step, statement in route_problems:
+            print(f"       {step}: {' '.join(statement.split())[:160]}")
+        return bool(route_problems)
+
+    failures = 0
+    for client, url in routes:
+        with count_queries(engine) as counter:
+            # buffered: consume streamed bodies inside the counter
+            response = client.get(url, buffered=True)
+        if response.status_code != 200:
+            print(f"FAIL {url}: HTTP {response.status_code}")
+            failures += 1
+            continue
+        failures += report(url, counter)
+
+    with app.app_context():
+        with count_queries(engine) as counter:
+            reminders.queue_due(today)
+        if counter.count:
+            failures += report('reminders.queue_due', counter)
+        else:
+            print("FAIL reminders.queue_due issued no statements to check")
+            failures += 1
+
+    if failures:
+        print(f"{failures} route(s) or job(s) fall back to full scans")
+        sys.exit(1)
+    print("All routes use indexes")
+
+
+if __name__ == '__main__':
+    main()
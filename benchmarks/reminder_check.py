@@ -0,0 +1,178 @@
+"""Check: appointment reminders at 100k appointments a day, on a fake clock.
+
+Seeds --per-day confirmed appointments a day (every hour, around the clock)
+for a past day and the next three, plus cancelled ones, and sends mail to
+the local SMTP stand-in (benchmarks/smtp_sink.py). Then:
+
+  race     two schedulers queue the reminders due at the start at once,
+           then a restarted one runs again; nothing is queued twice
+  cancel   appointments cancelled after their reminder was queued are
+           skipped, not sent
+  day      the clock steps through one day in REMINDER_POLL_SECONDS ticks;
+           every tick queues the due reminders (reminders.queue_due) and the
+           outbox sends them. Appointments booked for a few hours later
+           during the day are reminded on the next tick.
+
+Reports the time of the first (catch-up) tick and of the steady ones, and
+the send rate. Exits non-zero unless every confirmed appointment starting
+within the lead time of a tick got exactly one email and nothing else did.
+
+    python -m benchmarks.reminder_check [--per-day 100000]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, percentile
+from benchmarks.smtp_sink import SMTPSink
+
+START = datetime(2030, 1, 7)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-day', type=int, default=100000)
+    parser.add_argument('--cancel', type=int, default=100, help='cancelled after their reminder was queued')
+    parser.add_argument('--late', type=int, default=50, help='bookings made during the day')
+    args = parser.parse_args()
+
+    sink = SMTPSink(keep_bodies=False).start()
+    os.environ.update({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(sink.port), 'MAIL_USE_TLS': 'false',
+                       'MAIL_USERNAME': 'bench@medibook.test', 'MAIL_PASSWORD': 'bench'})
+    use_temp_database('reminders.db')
+    from app import create_app, init_db, build_appointment_reminder_email
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'REMINDER_SCHEDULER_THREAD': False,
+                      'METRICS_ENABLED': False, 'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    from sqlalchemy import func, insert, select, update
+    from database import db, Appointment, EmailJob
+    from benchmarks.seed import seed
+    import outbox
+    import reminders
+
+    config = app.config
+    lead = timedelta(hours=config['REMINDER_LEAD_HOURS'])
+    poll = timedelta(seconds=config['REMINDER_POLL_SECONDS'])
+    doctors = -(-args.per_day // 24)
+    print(f"seeding {args.per_day} confirmed appointments a day over 4 days ({doctors} doctors)...")
+    with app.app_context():
+        seed(doctors=doctors, patients=20000, hospitals=50, appointments=0)
+        rows = []
+        for day in range(-1, 3):
+            for i in range(args.per_day):
+                when = START + timedelta(days=day, hours=i // doctors)
+                for status in ('confirmed', 'cancelled') if i % 4 == 0 else ('confirmed',):
+                    rows.append({'patient_id': doctors + 1 + i % 20000, 'doctor_id': i % doctors + 1,
+                                 'date_time': when, 'status': status, 'type': 'online',
+                                 'meeting_link': f'https://meet.jit.si/consultation-{i}', 'created_at': START})
+        for i in range(0, len(rows), 10000):
+            db.session.execute(insert(Appointment), rows[i:i + 10000])
+        db.session.commit()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    def drain():
+        sent = 0
+        while True:
+            claimed = outbox.process_batch()
+            if not claimed:
+                return sent
+            sent += claimed
+
+    # Two schedulers at the same moment, then a restart
+    claimed = []
+
+    def scheduler():
+        with app.app_context():
+            claimed.append(reminders.queue_due(START))
+            db.session.remove()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=scheduler) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    first_tick = (time.perf_counter() - started) * 1000
+    with app.app_context():
+        restarted = reminders.queue_due(START)
+        due = db.session.execute(select(func.count()).where(
+            Appointment.status == 'confirmed', Appointment.date_time >= START,
+            Appointment.date_time < START + lead)).scalar()
+    check(sum(claimed) == due and restarted == 0,
+          f'two schedulers queued {claimed} of {due} due reminders, a restart queued {restarted}')
+
+    # Cancelled between queueing and sending
+    with app.app_context():
+        cancelled = db.session.execute(select(Appointment.id).where(
+            Appointment.status == 'confirmed', Appointment.reminder_sent_at.is_not(None)).limit(args.cancel)).scalars().all()
+        db.session.execute(update(Appointment).where(Appointment.id.in_(cancelled)).values(status='cancelled'))
+        db.session.commit()
+        job = EmailJob.query.filter(EmailJob.appointment_id.not_in(cancelled)).first()
+        outbox._mail()  # set up by the worker before it renders
+        html = build_appointment_reminder_email(job).html
+        check('join the video call a few minutes early' in html and job.appointment.meeting_link in html,
+              'the reminder has the meeting link and asks to join early')
+
+        started = time.perf_counter()
+        sent = drain()
+        elapsed = time.perf_counter() - started
+    print(f"catch-up tick: {first_tick:.0f} ms to queue {due} reminders; "
+          f"sent in {elapsed:.1f} s ({len(sink.messages) / elapsed:.0f} emails/s, "
+          f"{sink.connections} SMTP connections)")
+    with app.app_context():
+        skipped = EmailJob.query.filter_by(status='skipped').count()
+    check(skipped == len(cancelled), f'{skipped} reminders of appointments cancelled meanwhile were skipped')
+
+    # One day on the fake clock
+    print(f"simulating a day in {poll.total_seconds():.0f} s ticks...")
+    late = []
+    queue_ms, drain_ms = [], []
+    now = START + poll
+    with app.app_context():
+        while now < START + timedelta(days=1):
+            if len(late) < args.late and now.minute % 20 == 10:
+                # Booked and confirmed for a few hours later
+                appointment = Appointment(patient_id=doctors + 1, doctor_id=len(late) % doctors + 1,
+                                          date_time=now + timedelta(hours=3), status='confirmed')
+                db.session.add(appointment)
+                db.session.commit()
+                late.append(appointment.id)
+            started = time.perf_counter()
+            reminders.queue_due(now)
+            queue_ms.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            drain()
+            drain_ms.append((time.perf_counter() - started) * 1000)
+            now += poll
+        end = now - poll
+
+        print(f"{len(queue_ms)} ticks: queue p50 {percentile(queue_ms, 50):.1f} ms, "
+              f"p95 {percentile(queue_ms, 95):.1f} ms, max {max(queue_ms):.1f} ms; "
+              f"send p50 {percentile(drain_ms, 50):.1f} ms, p95 {percentile(drain_ms, 95):.1f} ms")
+
+        expected = set(db.session.execute(select(Appointment.id).where(
+            Appointment.date_time >= START, Appointment.date_time < end + lead,
+            (Appointment.status == 'confirmed') | Appointment.id.in_(cancelled))).scalars())
+        jobs = db.session.execute(select(EmailJob.appointment_id, EmailJob.status)).all()
+        reminded = [appointment_id for appointment_id, _ in jobs]
+        sent = sum(1 for _, status in jobs if status == 'sent')
+        check(len(reminded) == len(set(reminded)) and set(reminded) == expected,
+              f'{len(expected)} appointments due within a day got exactly one reminder each')
+        check(set(late) <= set(reminded), f'{len(late)} appointments booked during the day were reminded')
+        check(sent == len(sink.messages) == len(expected) - len(cancelled), f'{sent} emails delivered')
+
+    sink.stop()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
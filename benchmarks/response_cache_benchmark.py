@@ -0,0 +1,117 @@
+"""Benchmark: public pages with and without the response cache.
+
+Replays a mix of anonymous GETs (home page, doctor and hospital lists, the
+JSON APIs, slot lookups) against each backend - none, in-process LRU and
+filesystem - and reports hit rate and latency. Then checks the contract:
+If-None-Match answers 304, logged-in users bypass the cache, and a booking,
+a slot hold, an admin edit and a bulk confirm each invalidate the pages that
+show them. Exits non-zero if any check fails.
+
+    python -m benchmarks.response_cache_benchmark [--requests 2000]
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, login, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--doctors', type=int, default=500)
+    args = parser.parse_args()
+
+    use_temp_database('response_cache.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    from database import Appointment
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+    import response_cache
+
+    with app.app_context():
+        seed(doctors=args.doctors, patients=2000, appointments=20000)
+        patient_email = seed_accounts()
+
+    day = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
+    urls = ['/', '/doctors', '/hospitals', '/api/doctors', '/api/hospitals']
+    urls += [f'/doctors?page={page}' for page in range(2, 6)]
+    urls += [f'/api/slots/{doctor}?date={day}' for doctor in range(1, 51)]
+    rng = random.Random(42)
+    # Skewed towards the first pages, as real traffic is
+    workload = [urls[min(int(rng.expovariate(1 / 8)), len(urls) - 1)] for _ in range(args.requests)]
+
+    print(f"{'backend':<12} {'hit rate':>8} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8}")
+    for backend in (None, 'memory', 'filesystem'):
+        app.config['RESPONSE_CACHE_BACKEND'] = backend
+        app.config['RESPONSE_CACHE_DIR'] = tempfile.mkdtemp(prefix='medibook-response-cache-')
+        response_cache.reset()
+        client = app.test_client()
+        samples, hits = [], 0
+        started = time.perf_counter()
+        for url in workload:
+            start = time.perf_counter()
+            response = client.get(url)
+            samples.append((time.perf_counter() - start) * 1000)
+            hits += response.headers.get('X-Cache') == 'HIT'
+        elapsed = time.perf_counter() - started
+        print(f"{backend or 'off':<12} {hits / len(workload):>8.1%} {percentile(samples, 50):>8.2f} "
+              f"{percentile(samples, 95):>8.2f} {len(workload) / elapsed:>8.0f}")
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    def is_fresh(client, url):
+        """Warm the entry, then report whether the next read re-rendered it"""
+        return client.get(url).headers.get('X-Cache') == 'MISS'
+
+    app.config['RESPONSE_CACHE_BACKEND'] = 'memory'
+    response_cache.reset()
+    anonymous = app.test_client()
+    patient = login(app.test_client(), '/login', patient_email, LOGIN_PASSWORD)
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    print()
+
+    first = anonymous.get('/doctors')
+    check(anonymous.get('/doctors').headers.get('X-Cache') == 'HIT', 'second anonymous GET is a hit')
+    revalidated = anonymous.get('/doctors', headers={'If-None-Match': first.headers['ETag']})
+    check(revalidated.status_code == 304 and not revalidated.data, 'If-None-Match answers 304 with no body')
+    check('X-Cache' not in patient.get('/doctors').headers, 'logged-in users bypass the cache')
+
+    # Pick a free, on-grid slot a week out for the write checks
+    slots_url = f'/api/slots/1?date={day}'
+    free = [slot['time'] for slot in anonymous.get(slots_url).get_json() if slot['available']]
+    anonymous.get(slots_url)
+    patient.post('/api/slots/1/hold', json={'date': day, 'time': free[0]})
+    check(is_fresh(anonymous, slots_url), 'a slot hold invalidates the slot list')
+
+    anonymous.get(slots_url)
+    patient.post('/book/1', data={'date': day, 'time': free[1], 'reason': 'Check-up'})
+    taken = {slot['time'] for slot in anonymous.get(slots_url).get_json() if not slot['available']}
+    check(free[1] in taken, 'a booking shows up in the slot list')
+
+    anonymous.get('/hospitals')
+    admin.post('/admin/hospitals', data={'name': 'Benchmark General', 'city': 'Oslo',
+                                         'country': 'Norway', 'specialties': 'Cardiology'})
+    check(b'Benchmark General' in anonymous.get('/hospitals').data, 'an admin edit shows up in the hospital list')
+
+    with app.app_context():
+        pending = [a.id for a in Appointment.query.filter_by(doctor_id=1, status='pending').limit(5)]
+    anonymous.get(slots_url)
+    admin.post('/admin/appointments/bulk', json={'ids': pending, 'action': 'confirm'})
+    check(is_fresh(anonymous, slots_url), 'a bulk confirm invalidates the slot list')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
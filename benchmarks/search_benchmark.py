@@ -0,0 +1,63 @@
+"""Benchmark: FTS5 directory search vs. the ilike('%term%') path.
+
+For 10k and 100k doctors, times a free-text lookup done the old way (ilike
+with leading wildcards over name, specialization, city, country and hospital
+name) against search.search() on the FTS5 index. For very common words the
+unranked ilike query can stop after its first LIMIT rows, while FTS ranks
+every match; rare words and misses are where the full scan hurts.
+
+    python -m benchmarks.search_benchmark [--sizes 10000 100000] [--repeat 30]
+"""
+import argparse
+
+from benchmarks.common import use_temp_database, percentile, time_calls
+
+TERMS = ['card', 'neuro munich', 'doctor 4242', 'hospital 77', 'nomatch']
+
+
+def ilike_search(db, User, Doctor, Hospital, term, limit=10):
+    """Every word must appear somewhere, as the old filters would have it."""
+    from sqlalchemy import or_
+    query = Doctor.query.join(User, Doctor.user_id == User.id).outerjoin(Hospital)
+    for word in term.split():
+        pattern = f'%{word}%'
+        query = query.filter(or_(User.name.ilike(pattern), Doctor.specialization.ilike(pattern),
+                                 Doctor.city.ilike(pattern), Doctor.country.ilike(pattern),
+                                 Hospital.name.ilike(pattern)))
+    return query.limit(limit).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    use_temp_database('search.db')
+    import search
+    from app import create_app, init_db
+    # Measure the render path, not the response cache
+    app = create_app({'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    from database import db, User, Doctor, Hospital
+    from benchmarks.seed import seed
+
+    with app.app_context():
+        print(f"{'doctors':>8} {'term':<14} {'ilike p50':>10} {'ilike p95':>10} {'fts p50':>9} {'fts p95':>9}")
+        for size in args.sizes:
+            db.drop_all()
+            db.create_all()
+            seed(doctors=size, patients=100, hospitals=500, appointments=0)
+            with db.engine.begin() as connection:
+                search.rebuild_index(connection)
+
+            for term in TERMS:
+                old = time_calls(lambda: ilike_search(db, User, Doctor, Hospital, term), args.repeat)
+                new = time_calls(lambda: search.search(term), args.repeat)
+                db.session.expunge_all()
+                print(f"{size:>8} {term:<14} {percentile(old, 50):>10.2f} {percentile(old, 95):>10.2f} "
+                      f"{percentile(new, 50):>9.2f} {percentile(new, 95):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Synthetic data generator used by the benchmarks.
+
+Also a command that seeds a database file once, so that large runs of
+``benchmarks.suite`` do not pay for seeding every time::
+
+    python -m benchmarks.seed /tmp/medibook-full.db [--scale full] [--appointments N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from database import db, User, Doctor, Hospital, Appointment, ACTIVE_STATUSES
+import availability
+import stats
+
+SPECIALTIES = ['Cardiology', 'Neurology', 'Dermatology', 'Pediatrics', 'Oncology',
+               'Radiology', 'Orthopedics', 'Psychiatry', 'General', 'Diagnostics']
+CITIES = [('New York', 'USA'), ('Cleveland', 'USA'), ('Rochester', 'USA'), ('Berlin', 'Germany'),
+          ('Munich', 'Germany'), ('Kolkata', 'India'), ('Mumbai', 'India'), ('London', 'UK'),
+          ('Paris', 'France'), ('Toronto', 'Canada')]
+STATUSES = ['pending', 'confirmed', 'confirmed', 'completed', 'cancelled']
+
+# Not a real hash: seeded accounts are never logged into by the benchmarks
+PLACEHOLDER_PASSWORD = 'pbkdf2:sha256:benchmark'
+
+BATCH_SIZE = 10000
+
+# Named volumes for the seed command and the benchmark suite. Appointments
+# cover HISTORY_DAYS before today and the rest of SCALE_DAYS after it.
+SCALES = {
+    'small': {'doctors': 500, 'hospitals': 20, 'patients': 2000, 'appointments': 20000},
+    'full': {'doctors': 10000, 'hospitals': 500, 'patients': 50000, 'appointments': 1000000},
+}
+SCALE_DAYS = 365
+HISTORY_DAYS = 180
+
+# Accounts with a real password hash, for benchmarks that log in
+ADMIN_EMAIL = 'admin@bench.test'
+DOCTOR_EMAIL = 'doctor1@bench.test'
+LOGIN_PASSWORD = 'benchmark'
+
+
+def _bulk_insert(model, rows):
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[i:i + BATCH_SIZE])
+
+
+def seed(doctors=200, patients=1000, hospitals=20, appointments=100000,
+         start=None, days=90, rng=None):
+    """Fill an empty schema with synthetic rows using bulk inserts.
+
+    Appointments are spread over ``days`` days starting at ``start`` on the
+    9:00-17:00 hourly grid. Returns the seeding start datetime.
+    """
+    rng = rng or random.Random(42)
+    start = (start or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    _bulk_insert(Hospital, [
+        {'id': i, 'name': f'Hospital {i}', 'city': city, 'country': country,
+         'specialties': ', '.join(rng.sample(SPECIALTIES, 3))}
+        for i in range(1, hospitals + 1)
+        for city, country in [rng.choice(CITIES)]
+    ])
+
+    users = []
+    for i in range(1, doctors + patients + 1):
+        role = 'doctor' if i <= doctors else 'patient'
+        users.append({'id': i, 'name': f'{role.title()} {i}', 'email': f'{role}{i}@bench.test',
+                      'password': PLACEHOLDER_PASSWORD, 'role': role})
+    _bulk_insert(User, users)
+
+    _bulk_insert(Doctor, [
+        {'id': i, 'user_id': i, 'specialization': rng.choice(SPECIALTIES),
+         'city': city, 'country': country, 'consultation_fee': float(rng.randint(50, 500)),
+         'experience_years': rng.randint(1, 40),
+         'hospital_id': rng.randint(1, hospitals) if hospitals else None}
+        for i in range(1, doctors + 1)
+        for city, country in [rng.choice(CITIES)]
+    ])
+
+    # Inserted batch by batch: a million row dicts would not fit comfortably in memory
+    rows = []
+    active_slots = set()
+    for i in range(1, appointments + 1):
+        when = start + timedelta(days=rng.randrange(days), hours=rng.randrange(9, 17))
+        doctor_id = rng.randint(1, doctors)
+        status = rng.choice(STATUSES)
+        if status in ACTIVE_STATUSES:
+            # Respect the one-active-appointment-per-slot unique index
+            if (doctor_id, when) in active_slots:
+                status = 'cancelled'
+            active_slots.add((doctor_id, when))
+        rows.append({'id': i, 'patient_id': rng.randint(doctors + 1, doctors + patients),
+                     'doctor_id': doctor_id, 'date_time': when,
+                     'status': status, 'type': 'online',
+                     'created_at': when - timedelta(days=rng.randint(1, 30))})
+        if len(rows) == BATCH_SIZE:
+            _bulk_insert(Appointment, rows)
+            rows = []
+    _bulk_insert(Appointment, rows)
+
+    # Bulk inserts skip the ORM hooks that maintain the dashboard counters
+    # and the free-slot bitmaps
+    stats.rebuild_counters(db.session.connection())
+    availability.rebuild(db.session.connection())
+    db.session.commit()
+    return start
+
+
+def seed_accounts():
+    """Add an admin and give one seeded patient and doctor a usable password.
+
+    Call after ``seed``. Returns the email of the patient account (the first
+    seeded patient); the doctor account is ``DOCTOR_EMAIL``.
+    """
+    from werkzeug.security import generate_password_hash
+    hashed = generate_password_hash(LOGIN_PASSWORD, method='pbkdf2:sha256')
+    db.session.add(User(name='Admin', email=ADMIN_EMAIL, password=hashed, role='admin'))
+    first_patient = User.query.filter_by(role='patient').order_by(User.id).first()
+    emails = [first_patient.email, DOCTOR_EMAIL]
+    User.query.filter(User.email.in_(emails)).update({'password': hashed})
+    db.session.commit()
+    return emails[0]
+
+
+def seed_scale(volumes):
+    """Seed an empty schema at the given volumes (see SCALES), with login
+    accounts and the search index. Returns a description for reports."""
+    import search
+    start = datetime.now() - timedelta(days=HISTORY_DAYS)
+    seed(**volumes, start=start, days=SCALE_DAYS)
+    seed_accounts()
+    with db.engine.begin() as connection:
+        search.rebuild_index(connection)
+    return dict(volumes, start=start.strftime('%Y-%m-%d'), days=SCALE_DAYS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a new SQLite database with synthetic data.')
+    parser.add_argument('path', help='database file to create')
+    parser.add_argument('--scale', choices=SCALES, default='full')
+    for name in SCALES['full']:
+        parser.add_argument(f'--{name}', type=int, help='override the scale\'s volume')
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.path)
+    if os.path.exists(path):
+        sys.exit(f'{path} already exists; seeding needs an empty database')
+    volumes = {name: getattr(args, name) or count for name, count in SCALES[args.scale].items()}
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from app import create_app, init_db
+    # Bulk inserts are slow on purpose; keep them out of the slow-query log
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'METRICS_ENABLED': False})
+    init_db(app)
+    with app.app_context():
+        started = time.perf_counter()
+        seed_scale(volumes)
+        elapsed = time.perf_counter() - started
+    rows = sum(volumes.values())
+    print(f"Seeded {path}: {', '.join(f'{count} {name}' for name, count in volumes.items())} "
+          f"in {elapsed:.0f} s ({rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
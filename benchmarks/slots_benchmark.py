@@ -0,0 +1,66 @@
+"""Benchmark: slot availability for 1, 7 and 30 days.
+
+Compares the old per-hour lookup (8 queries per day) with the range engine in
+slots.py (1 query per request) on a database seeded with 100k appointments.
+
+    python -m benchmarks.slots_benchmark [--appointments 100000] [--repeat 50]
+"""
+import argparse
+from datetime import timedelta
+
+from benchmarks.common import use_temp_database, count_queries, percentile, time_calls
+
+
+def legacy_slots(Appointment, doctor_id, day):
+    """The original get_slots loop: one query per hourly slot."""
+    slots = []
+    for hour in range(9, 17):
+        dt = day.replace(hour=hour)
+        booking = Appointment.query.filter_by(doctor_id=doctor_id, date_time=dt).filter(Appointment.status == 'confirmed').first()
+        slots.append({'time': f"{hour:02d}:00", 'available': booking is None})
+    return slots
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=100000)
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    use_temp_database()
+    from app import create_app, init_db
+    # Measure the render path, not the response cache
+    app = create_app({'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    from database import db, Appointment
+    from slots import get_slots_for_range
+    from benchmarks.seed import seed
+
+    with app.app_context():
+        start = seed(doctors=args.doctors, appointments=args.appointments)
+        print(f"Seeded {args.appointments} appointments across {args.doctors} doctors")
+        doctor_id = 1
+        first_day = start + timedelta(days=1)
+
+        print(f"{'days':>5} {'mode':>8} {'queries':>8} {'p50 ms':>9} {'p95 ms':>9}")
+        for days in (1, 7, 30):
+            last_day = first_day + timedelta(days=days - 1)
+
+            def legacy():
+                for offset in range(days):
+                    legacy_slots(Appointment, doctor_id, first_day + timedelta(days=offset))
+
+            def ranged():
+                get_slots_for_range(doctor_id, first_day, last_day)
+
+            for mode, fn in (('legacy', legacy), ('range', ranged)):
+                with count_queries(db.engine) as counter:
+                    fn()
+                samples = time_calls(fn, args.repeat)
+                print(f"{days:>5} {mode:>8} {counter.count:>8} "
+                      f"{percentile(samples, 50):>9.2f} {percentile(samples, 95):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Local SMTP stand-in for email benchmarks and checks.
+
+A small threaded SMTP server that accepts AUTH and stores messages in
+memory instead of delivering them. It counts connections, can answer the
+first ``fail_first`` messages with a temporary 451 error to exercise
+retries, and can add a per-message delay to mimic a slow mail server.
+With ``keep_bodies=False`` only the recipients of each message are kept,
+for runs that send more mail than fits in memory.
+"""
+import socketserver
+import threading
+import time
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, fail_first=0, delay=0.0, keep_bodies=True):
+        super().__init__((host, port), _SMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.fail_first = fail_first
+        self.delay = delay
+        self.keep_bodies = keep_bodies
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 sink ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-sink')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif verb == 'HELO':
+                self.reply('250 sink')
+            elif verb == 'AUTH':
+                self.reply('235 2.7.0 Authentication successful')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip(' <>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(chunk)
+                if server.delay:
+                    time.sleep(server.delay)
+                with server.lock:
+                    if server.fail_first > 0:
+                        server.fail_first -= 1
+                        failed = True
+                    else:
+                        failed = False
+                        server.messages.append((recipients, b''.join(data) if server.keep_bodies else None))
+                self.reply('451 4.3.0 Try again later' if failed else '250 OK queued')
+            elif verb == 'RSET':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
@@ -0,0 +1,267 @@
+"""Benchmark: worker cold start - import, create_app and time to first response.
+
+Seeds a database at --scale, then starts --workers fresh interpreters one
+after another the way a gunicorn worker starts (import the app, build it,
+answer a request) under `python -X importtime`, and reports per worker the
+time to import app.py, run create_app and answer the first GET --path, the
+wall time from exec to that response, and what `flask init-db` (init_db)
+costs on the same database - the schema check every worker used to run.
+Then lists the slowest imports of app.py (median cumulative time).
+
+Last, starts gunicorn (gunicorn.conf.py) with --gunicorn-workers workers
+--rounds times, requesting --path until every worker has answered, and
+reports the time from each worker's fork to its first response: with the
+app preloaded in the master, and with GUNICORN_PRELOAD=0, where every
+worker imports and builds it itself.
+
+Checks: every first response is a 200 (also from gunicorn), building the
+app does not open the database (a missing file stays missing), and
+flask_mail, the CLI and worker modules (importer, archive, reminders,
+membership) and the profiler modules are not loaded by then.
+Exits non-zero if a check fails.
+
+    python -m benchmarks.startup_benchmark [--workers 5] [--path /doctors]
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import use_temp_database, percentile
+from benchmarks.http_load_test import ROOT, free_port, wait_for_server
+
+# Modules loaded only when first used
+LAZY_MODULES = ('flask_mail', 'importer', 'archive', 'reminders', 'membership', 'cProfile', 'pstats')
+
+WORKER = """
+import json, sys, time
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+app = module.create_app()
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+answered = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first_response': answered - created, 'status': response.status_code,
+                  'loaded': sorted(set(sys.argv[2:]) & set(sys.modules))}), flush=True)
+module.init_db(app)
+print(json.dumps({'init_db': time.perf_counter() - answered}), flush=True)
+"""
+
+# gunicorn.conf.py plus hooks recording when each worker was forked, had
+# loaded the app, and answered its first request
+GUNICORN_HOOKS = """
+import json, os, time
+exec(open(os.path.join(ROOT, 'gunicorn.conf.py')).read())
+
+def _record(*event):
+    with open(LOG, 'a') as f:
+        f.write(json.dumps(event) + '\\n')
+
+def post_fork(server, worker):
+    _record('fork', worker.pid, time.time())
+
+def post_worker_init(worker):
+    _record('ready', worker.pid, time.time())
+
+def post_request(worker, req, environ, resp):
+    if not getattr(worker, 'answered', False):
+        worker.answered = True
+        _record('answer', worker.pid, time.time(), resp.status_code)
+"""
+
+BUILD_ONLY = """
+import app as module
+module.create_app()
+"""
+
+
+def app_imports(stderr):
+    """{module: cumulative ms} of the modules app.py imports directly, from -X importtime output"""
+    children, found = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) + 1) // 2
+        if depth == 2:
+            children[name.strip()] = int(cumulative) / 1000
+        elif depth == 1:
+            if name.strip() == 'app':
+                found = dict(children, app=int(cumulative) / 1000)
+            children = {}
+    return found
+
+
+def start_worker(path, env):
+    """One cold worker; returns (timings, wall ms to the first response, app imports)"""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', WORKER, path, *LAZY_MODULES],
+                               cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    result, wall = {}, None
+    for line in process.stdout:
+        if line.startswith('{'):
+            result.update(json.loads(line))
+            if wall is None:
+                wall = (time.perf_counter() - started) * 1000
+    stderr = process.stderr.read()
+    process.wait()
+    if process.returncode:
+        sys.exit(stderr[-2000:])
+    return result, wall, app_imports(stderr)
+
+
+def gunicorn_start(env, path, workers, preload, log):
+    """Start gunicorn and request path until every worker answered.
+
+    Returns ({pid: (ms from fork to ready, to its first response)}, {statuses},
+    ms from launch until the last worker answered).
+    """
+    directory = os.path.dirname(log)
+    config = os.path.join(directory, 'gunicorn_hooks.py')
+    with open(config, 'w') as f:
+        f.write(GUNICORN_HOOKS.replace('ROOT', repr(ROOT)).replace('LOG', repr(log)))
+    port = free_port()
+    env = dict(env, BIND=f'127.0.0.1:{port}', GUNICORN_ACCESS_LOG='/dev/null', GUNICORN_PRELOAD=preload,
+               WEB_CONCURRENCY=str(workers))
+    launched = time.time()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', config, 'wsgi:app'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    done = threading.Event()
+
+    def client():
+        while not done.is_set():
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            try:
+                connection.request('GET', path, headers={'Connection': 'close'})
+                connection.getresponse().read()
+            except OSError:
+                time.sleep(0.01)
+            finally:
+                connection.close()
+
+    clients = [threading.Thread(target=client) for _ in range(workers)]
+    try:
+        wait_for_server(port)
+        for thread in clients:
+            thread.start()
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            events = read_events(log)
+            if sum(1 for event in events if event[0] == 'answer') >= workers:
+                break
+            time.sleep(0.05)
+    finally:
+        done.set()
+        for thread in clients:
+            if thread.is_alive():
+                thread.join()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    forks = {pid: at for kind, pid, at, *_ in events if kind == 'fork'}
+    inits = {pid: at for kind, pid, at, *_ in events if kind == 'ready'}
+    answers = {pid: (at, status) for kind, pid, at, status in (e for e in events if e[0] == 'answer')}
+    ready = {pid: ((inits[pid] - forks[pid]) * 1000, (at - forks[pid]) * 1000)
+             for pid, (at, _) in answers.items() if pid in forks and pid in inits}
+    last = (max(at for at, _ in answers.values()) - launched) * 1000 if answers else float('nan')
+    return ready, {status for _, status in answers.values()}, last
+
+
+def read_events(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.endswith('\n')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--path', default='/doctors', help='first request of every worker')
+    parser.add_argument('--scale', choices=('small', 'full'), default='small')
+    parser.add_argument('--top', type=int, default=12, help='slowest imports to list')
+    parser.add_argument('--gunicorn-workers', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=3, help='gunicorn starts per setting')
+    args = parser.parse_args()
+
+    db_path = use_temp_database('startup.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'METRICS_ENABLED': False})
+    init_db(app)
+    from database import db
+    from benchmarks.seed import seed_scale, SCALES
+    print(f"seeding the {args.scale} scale...")
+    with app.app_context():
+        seed_scale(SCALES[args.scale])
+        db.engine.dispose()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    env = dict(os.environ, PYTHONPATH=ROOT, METRICS_ENABLED='0',
+               METRICS_DIR=os.path.join(os.path.dirname(db_path), 'metrics'))
+    print(f"\n{'worker':<8} {'import':>8} {'create_app':>11} {'1st resp':>9} {'wall':>8} {'init_db':>8}   (ms)")
+    results, imports = [], []
+    for number in range(1, args.workers + 1):
+        result, wall, modules = start_worker(args.path, env)
+        results.append(dict(result, wall=wall))
+        imports.append(modules)
+        print(f"{number:<8} {result['import'] * 1000:>8.0f} {result['create_app'] * 1000:>11.0f} "
+              f"{result['first_response'] * 1000:>9.0f} {wall:>8.0f} {result['init_db'] * 1000:>8.0f}")
+    median = {key: statistics.median(r[key] for r in results) for key in ('import', 'create_app', 'first_response', 'init_db')}
+    print(f"{'median':<8} {median['import'] * 1000:>8.0f} {median['create_app'] * 1000:>11.0f} "
+          f"{median['first_response'] * 1000:>9.0f} {statistics.median(r['wall'] for r in results):>8.0f} "
+          f"{median['init_db'] * 1000:>8.0f}")
+
+    print(f"\nslowest imports of app.py (median cumulative ms, -X importtime):")
+    names = set().union(*imports)
+    slowest = sorted(((statistics.median(m.get(name, 0) for m in imports), name) for name in names), reverse=True)
+    for ms, name in slowest[:args.top + 1]:
+        print(f"  {name:<24} {ms:>7.1f}")
+
+    print(f"\ngunicorn, {args.gunicorn_workers} workers starting at once (ms from fork, p50 / max):")
+    print(f"  {'':<22} {'app loaded':>14} {'1st response':>14} {'all serving':>12}")
+    statuses, started = set(), []
+    for preload, name in (('1', 'preloaded app (fork)'), ('0', 'GUNICORN_PRELOAD=0')):
+        per_worker, last = [], []
+        for number in range(args.rounds):
+            log = os.path.join(os.path.dirname(db_path), f'gunicorn-{preload}-{number}.log')
+            ready, seen, all_ready = gunicorn_start(env, args.path, args.gunicorn_workers, preload, log)
+            per_worker += ready.values()
+            last.append(all_ready)
+            statuses |= seen
+        started.append(len(per_worker))
+        loaded, answered = [ms for ms, _ in per_worker], [ms for _, ms in per_worker]
+        print(f"  {name:<22} {percentile(loaded, 50):>6.0f} / {max(loaded):>5.0f} "
+              f"{percentile(answered, 50):>6.0f} / {max(answered):>5.0f} {statistics.median(last):>9.0f} *")
+    print("  * ms from launching gunicorn until the last worker answered (median)")
+
+    print()
+    check(all(r['status'] == 200 for r in results) and statuses == {200}
+          and started == [args.gunicorn_workers * args.rounds] * 2,
+          f"every worker's first GET {args.path} is a 200")
+    loaded = sorted(set().union(*(r['loaded'] for r in results)))
+    check(not loaded, f"{', '.join(LAZY_MODULES)} are not loaded before they are used"
+                      + (f" (loaded: {', '.join(loaded)})" if loaded else ''))
+    missing = os.path.join(os.path.dirname(db_path), 'missing.db')
+    subprocess.run([sys.executable, '-c', BUILD_ONLY], cwd=ROOT, check=True, capture_output=True,
+                   env=dict(env, DATABASE_URL='sqlite:///' + missing))
+    check(not os.path.exists(missing), 'importing and building the app does not open the database')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
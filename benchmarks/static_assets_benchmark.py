@@ -0,0 +1,142 @@
+"""Benchmark: landing-page static assets, default handler vs. fingerprinted build.
+
+Runs `flask build-assets`, then compares, for the CSS, JS and hero video the
+home page links:
+
+  bytes     first visit, default /static handler vs. the best precompressed
+            variant a browser accepting br/gzip gets
+  requests  repeat visit: the default handler's no-cache answers force one
+            revalidation per asset, immutable hashed URLs need none
+  range     video seeking over real HTTP (gunicorn): random 1 MB byte ranges
+            from the default handler vs. send_asset() (sendfile), with the
+            CPU time the workers spent per request
+
+Exits non-zero if a check fails (hashed URLs in the page, immutable caching,
+precompressed variants, correct range bytes).
+
+    python -m benchmarks.static_assets_benchmark [--ranges 300]
+"""
+import argparse
+import http.client
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.common import use_temp_database, percentile
+from benchmarks.http_load_test import ROOT, free_port, wait_for_server
+
+RANGE_SIZE = 1024 * 1024
+
+
+def server_cpu_seconds(master_pid):
+    """User + system CPU of gunicorn's workers (Linux /proc; None elsewhere)"""
+    total = 0
+    try:
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == master_pid:
+                total += int(fields[11]) + int(fields[12])
+    except OSError:
+        return None
+    return total / os.sysconf('SC_CLK_TCK')
+
+
+def fetch_ranges(port, url, ranges, expected):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    samples, ok = [], True
+    started = time.perf_counter()
+    for start in ranges:
+        begin = time.perf_counter()
+        connection.request('GET', url, headers={'Range': f'bytes={start}-{start + RANGE_SIZE - 1}'})
+        response = connection.getresponse()
+        body = response.read()
+        samples.append((time.perf_counter() - begin) * 1000)
+        ok &= response.status == 206 and body == expected[start:start + RANGE_SIZE]
+    elapsed = time.perf_counter() - started
+    connection.close()
+    return samples, len(ranges) * RANGE_SIZE / elapsed / 1e6, ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ranges', type=int, default=300)
+    args = parser.parse_args()
+
+    db_path = use_temp_database('static.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    result = app.test_cli_runner().invoke(args=['build-assets'])
+    print(result.output.strip())
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    client = app.test_client()
+    html = client.get('/').get_data(as_text=True)
+    sources = ['css/style.css', 'js/interactions.js', 'assets/bg.mp4']
+    hashed = {source: app.extensions['assets'][source] for source in sources}
+    check(all(f'/static/build/{h}' in html for h in hashed.values()), 'home page links the fingerprinted files')
+    check('style_backup' not in ' '.join(app.extensions['assets']), 'style_backup.css is left out of the build')
+
+    print(f"\n{'asset':<22} {'default bytes':>14} {'built bytes':>12} {'encoding':>9} {'revalidations':>14}")
+    totals = [0, 0]
+    for source in sources:
+        before = client.get(f'/static/{source}', headers={'Accept-Encoding': 'br, gzip'})
+        after = client.get(f'/static/build/{hashed[source]}', headers={'Accept-Encoding': 'br, gzip'})
+        immutable = after.cache_control.immutable and after.cache_control.max_age >= 365 * 24 * 3600
+        check(immutable, f'{source} is served immutable for a year')
+        totals[0] += len(before.data)
+        totals[1] += len(after.data)
+        revalidate = 'no-cache' in before.headers.get('Cache-Control', '')
+        print(f"{source:<22} {len(before.data):>14} {len(after.data):>12} "
+              f"{after.content_encoding or 'identity':>9} {'1 -> 0' if revalidate else '0 -> 0':>14}")
+        if source.endswith(('.css', '.js')):
+            check(after.content_encoding in ('br', 'gzip'), f'{source} is served precompressed')
+    print(f"{'total':<22} {totals[0]:>14} {totals[1]:>12}")
+
+    # Range requests over HTTP, where the server can use sendfile()
+    with open(os.path.join(app.static_folder, 'assets/bg.mp4'), 'rb') as f:
+        video = f.read()
+    rng = random.Random(7)
+    ranges = [rng.randrange(0, len(video) - RANGE_SIZE) for _ in range(args.ranges)]
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, PYTHONPATH=ROOT, BIND=f'127.0.0.1:{port}',
+               WEB_CONCURRENCY='2', GUNICORN_ACCESS_LOG='/dev/null')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port)
+        print(f"\n{'video ranges (1 MB)':<28} {'p50 ms':>8} {'p95 ms':>8} {'MB/s':>8} {'server CPU ms/req':>18}")
+        for label, url in (('default /static handler', '/static/assets/bg.mp4'),
+                           ('send_asset (sendfile)', f'/static/build/{hashed["assets/bg.mp4"]}')):
+            fetch_ranges(port, url, ranges[:10], video)
+            cpu_before = server_cpu_seconds(server.pid)
+            samples, throughput, ok = fetch_ranges(port, url, ranges, video)
+            cpu_after = server_cpu_seconds(server.pid)
+            check(ok, f'{label} returns the requested bytes')
+            cpu = f'{(cpu_after - cpu_before) * 1000 / len(ranges):.2f}' if cpu_before is not None else 'n/a'
+            print(f"{label:<28} {percentile(samples, 50):>8.2f} {percentile(samples, 95):>8.2f} "
+                  f"{throughput:>8.0f} {cpu:>18}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
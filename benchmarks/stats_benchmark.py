@@ -0,0 +1,111 @@
+"""Benchmark: admin dashboard stats at 1M appointments.
+
+Times the original four COUNT queries against the grouped queries and the
+stat_counter table (stats.py), the /admin dashboard and /admin/api/stats
+routes, then makes a mix of writes - ORM inserts and updates, bulk confirm
+and cancel, a new doctor and a new registration - and checks that the counters still match a fresh
+GROUP BY. Exits non-zero if they drift.
+
+    python -m benchmarks.stats_benchmark [--appointments 1000000]
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, count_queries, login, percentile
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=1000000)
+    parser.add_argument('--doctors', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    use_temp_database('stats.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False})
+    init_db(app)
+    from database import db, User, Doctor, Appointment
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+    import stats
+
+    print(f"seeding {args.appointments} appointments...")
+    with app.app_context():
+        seed(doctors=args.doctors, patients=20000, appointments=args.appointments, days=365)
+        seed_accounts()
+        db.session.execute(db.text('ANALYZE'))
+        engine = db.engine
+
+        def legacy():
+            User.query.count()
+            Doctor.query.count()
+            Appointment.query.count()
+            Appointment.query.filter_by(status='pending').count()
+
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=30)
+        end = start + timedelta(days=61)
+
+        def window_cold():
+            stats._window_cache.clear()
+            stats.appointment_window(start, end)
+
+        print(f"{'source':<28} {'statements':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, fn in (('legacy COUNT(*) x4', legacy),
+                         ('grouped_counts', stats.grouped_counts),
+                         ('read_counters', stats.read_counters),
+                         ('61-day window (uncached)', window_cold),
+                         ('61-day window (cached)', lambda: stats.appointment_window(start, end))):
+            with count_queries(engine) as counter:
+                fn()
+            samples = timed(fn, args.repeat)
+            print(f"{name:<28} {counter.count:>10} {percentile(samples, 50):>8.1f} {percentile(samples, 95):>8.1f}")
+
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    print(f"\n{'route':<36} {'statements':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for use_counters in (False, True):
+        app.config['STATS_USE_COUNTERS'] = use_counters
+        for url in ('/admin', '/admin/api/stats'):
+            admin.get(url)
+            with count_queries(engine) as counter:
+                admin.get(url)
+            samples = timed(lambda: admin.get(url), args.repeat)
+            label = f"{url} ({'counters' if use_counters else 'grouped'})"
+            print(f"{label:<36} {counter.count:>10} {percentile(samples, 50):>8.1f} {percentile(samples, 95):>8.1f}")
+
+    # Writes through every maintained path, then compare with a live recount
+    with app.app_context():
+        pending = [a.id for a in Appointment.query.filter_by(status='pending').limit(200)]
+        cancelled = Appointment.query.filter_by(status='cancelled').limit(20).all()
+        for appointment in cancelled:
+            appointment.status = 'completed'
+        db.session.add(Appointment(patient_id=args.doctors + 1, doctor_id=1, status='completed',
+                                   date_time=datetime(2000, 1, 1, 9)))
+        db.session.commit()
+    admin.post('/admin/appointments/bulk', json={'ids': pending[:100], 'action': 'confirm'})
+    admin.post('/admin/appointments/bulk', json={'ids': pending[100:], 'action': 'cancel'})
+    admin.post('/admin/doctors', data={'name': 'New Doctor', 'email': 'newdoc@bench.test',
+                                       'specialization': 'Neurology', 'city': 'Berlin', 'country': 'Germany'})
+    app.test_client().post('/register', data={'name': 'New Patient', 'email': 'new@bench.test',
+                                              'password': 'x', 'role': 'patient'})
+    with app.app_context():
+        counters, grouped = stats.read_counters(), stats.grouped_counts()
+    if counters != grouped:
+        print(f"FAIL counters drifted:\n  counters {counters}\n  grouped  {grouped}")
+        sys.exit(1)
+    print(f"\ncounters match a live GROUP BY after writes: "
+          f"{counters['appointment']['total']} appointments, {counters['user']['total']} users")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""Benchmark suite: user-facing scenarios at a realistic volume, with JSON reports.
+
+  run      drives the Flask test client through each scenario (directory
+           pages with and without filters, slot lookups, booking, the
+           patient and doctor dashboards and the admin views) and reports
+           throughput, p50/p95/p99 latency and SQL statements per request,
+           on screen and to --out as JSON
+  compare  reads two reports and flags regressions: p95 latency or
+           throughput worse by more than --threshold, more SQL statements
+           per request, or new errors. Exits non-zero if it finds any.
+
+The data is either seeded into a temporary database at --scale, or copied
+from a database made by ``python -m benchmarks.seed`` (seeding the full
+scale takes a minute or two, so seed once and pass --database). The copy is
+what gets booked into; the seeded file is never modified. The response
+cache is off, so every request measures the application itself.
+
+    python -m benchmarks.seed /tmp/medibook-full.db
+    python -m benchmarks.suite run --database /tmp/medibook-full.db --out before.json
+    python -m benchmarks.suite run --database /tmp/medibook-full.db --out after.json
+    python -m benchmarks.suite compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from benchmarks.common import use_temp_database, login, count_queries, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def scenarios(context):
+    """(name, client, method, request(i) -> (url, form data)) in run order"""
+    specialties, cities, doctors = context['specialties'], context['cities'], context['doctors']
+    first_day = context['today'] - timedelta(days=7)
+
+    def day(i, offset=0):
+        return (first_day + timedelta(days=i % 30 + offset)).strftime('%Y-%m-%d')
+
+    def booking(i):
+        # One new slot per request, past the seeded appointments
+        slot = context['book_from'] + timedelta(days=i // 8, hours=9 + i % 8)
+        return (f'/book/{1 + (i * 7919) % doctors}',
+                {'date': slot.strftime('%Y-%m-%d'), 'time': slot.strftime('%H:%M'), 'type': 'online'})
+
+    return [
+        ('home', 'anonymous', 'GET', lambda i: ('/', None)),
+        ('doctors', 'anonymous', 'GET', lambda i: ('/doctors', None)),
+        ('doctors_by_specialty', 'anonymous', 'GET',
+         lambda i: (f'/doctors?specialty={specialties[i % len(specialties)]}', None)),
+        ('doctors_by_specialty_city', 'anonymous', 'GET',
+         lambda i: (f'/doctors?specialty={specialties[i % len(specialties)]}'
+                    f'&city={cities[i % len(cities)][0]}&country={cities[i % len(cities)][1]}', None)),
+        ('hospitals', 'anonymous', 'GET', lambda i: ('/hospitals', None)),
+        ('api_slots_day', 'anonymous', 'GET',
+         lambda i: (f'/api/slots/{1 + (i * 7919) % doctors}?date={day(i)}', None)),
+        ('api_slots_week', 'anonymous', 'GET',
+         lambda i: (f'/api/slots/{1 + (i * 7919) % doctors}?from={day(i)}&to={day(i, 6)}', None)),
+        ('book_form', 'patient', 'GET', lambda i: (f'/book/{1 + (i * 7919) % doctors}', None)),
+        ('book', 'patient', 'POST', booking),
+        ('dashboard_patient', 'patient', 'GET', lambda i: ('/dashboard', None)),
+        ('dashboard_doctor', 'doctor', 'GET', lambda i: ('/dashboard', None)),
+        ('admin_dashboard', 'admin', 'GET', lambda i: ('/admin', None)),
+        ('admin_stats', 'admin', 'GET', lambda i: ('/admin/api/stats', None)),
+        ('admin_appointments', 'admin', 'GET', lambda i: ('/admin/appointments', None)),
+        ('admin_doctors', 'admin', 'GET', lambda i: ('/admin/doctors', None)),
+        ('admin_hospitals', 'admin', 'GET', lambda i: ('/admin/hospitals', None)),
+    ]
+
+
+def run_scenario(client, method, make_request, engine, requests, max_seconds, warmup=3):
+    """Time up to `requests` requests (or `max_seconds`); returns the report row"""
+    for i in range(warmup):
+        url, data = make_request(i)
+        client.open(url, method=method, data=data)
+    latencies, statuses = [], Counter()
+    deadline = time.perf_counter() + max_seconds
+    with count_queries(engine) as counter:
+        started = time.perf_counter()
+        for i in range(warmup, warmup + requests):
+            url, data = make_request(i)
+            begin = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            latencies.append((time.perf_counter() - begin) * 1000)
+            statuses[response.status_code] += 1
+            if begin > deadline:
+                break
+        elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items() if status >= 400),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'sql_per_request': round(counter.count / len(latencies), 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    from benchmarks.seed import SCALES, SCALE_DAYS, HISTORY_DAYS, ADMIN_EMAIL, DOCTOR_EMAIL, LOGIN_PASSWORD, seed_scale
+    if args.database:
+        path = use_temp_database('suite.db')
+        shutil.copy(args.database, path)
+    else:
+        use_temp_database('suite.db')
+    from app import create_app, init_db
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None, 'METRICS_ENABLED': False})
+    init_db(app)
+    from sqlalchemy import func
+    from database import db, User, Doctor, Hospital, Appointment
+
+    with app.app_context():
+        if not args.database:
+            print(f'Seeding the {args.scale} scale...')
+            seed_scale(SCALES[args.scale])
+        dataset = {
+            'doctors': Doctor.query.count(),
+            'hospitals': Hospital.query.count(),
+            'patients': User.query.filter_by(role='patient').count(),
+            'appointments': db.session.query(func.count(Appointment.id)).scalar(),
+        }
+        patient_email = User.query.filter_by(role='patient').order_by(User.id).first().email
+        context = {
+            'doctors': dataset['doctors'],
+            'specialties': [s for s, in db.session.query(Doctor.specialization).distinct().order_by(Doctor.specialization)],
+            'cities': db.session.query(Doctor.city, Doctor.country).distinct().order_by(Doctor.city).all(),
+            'today': datetime.now().replace(hour=0, minute=0, second=0, microsecond=0),
+        }
+        context['book_from'] = context['today'] + timedelta(days=SCALE_DAYS - HISTORY_DAYS + 2)
+        engine = db.engine
+
+    clients = {
+        'anonymous': app.test_client(),
+        'patient': login(app.test_client(), '/login', patient_email, LOGIN_PASSWORD),
+        'doctor': login(app.test_client(), '/login', DOCTOR_EMAIL, LOGIN_PASSWORD),
+        'admin': login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD),
+    }
+    print(f"Dataset: {', '.join(f'{count} {name}' for name, count in dataset.items())}")
+    print(f"{'scenario':<28} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'sql/req':>8} {'errors':>7}")
+    results = {}
+    for name, who, method, make_request in scenarios(context):
+        if args.only and name not in args.only:
+            continue
+        row = run_scenario(clients[who], method, make_request, engine, args.requests, args.max_seconds)
+        results[name] = row
+        print(f"{name:<28} {row['requests']:>8} {row['throughput_rps']:>8.1f} {row['p50_ms']:>8.2f} "
+              f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['sql_per_request']:>8.2f} {row['errors']:>7}")
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'dataset': dataset,
+            'requests': args.requests,
+        },
+        'scenarios': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report written to {args.out}')
+    failed = [name for name, row in results.items() if row['errors']]
+    if failed:
+        print(f"Requests failed in: {', '.join(failed)}")
+        sys.exit(1)
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if base['meta']['dataset'] != new['meta']['dataset']:
+        print(f"warning: datasets differ ({base['meta']['dataset']} vs {new['meta']['dataset']})")
+
+    def change(old, now):
+        return (now - old) / old if old else 0.0
+
+    print(f"{base['meta'].get('git') or args.base} -> {new['meta'].get('git') or args.new}, "
+          f"threshold {args.threshold:.0%}")
+    print(f"{'scenario':<28} {'p95 ms':>19} {'':>7} {'req/s':>17} {'':>7} {'sql/req':>13}  verdict")
+    regressions = []
+    for name in sorted(set(base['scenarios']) | set(new['scenarios'])):
+        old, now = base['scenarios'].get(name), new['scenarios'].get(name)
+        if not old or not now:
+            print(f"{name:<28} only in {'the new' if now else 'the base'} report")
+            continue
+        problems = []
+        p95 = change(old['p95_ms'], now['p95_ms'])
+        rate = change(old['throughput_rps'], now['throughput_rps'])
+        # Sub-millisecond jitter is not a regression however large in percent
+        if p95 > args.threshold and now['p95_ms'] - old['p95_ms'] >= args.min_ms:
+            problems.append('p95')
+        if rate < -args.threshold:
+            problems.append('throughput')
+        if now['sql_per_request'] > old['sql_per_request'] + 0.05:
+            problems.append('sql')
+        if now['errors'] and not old['errors']:
+            problems.append('errors')
+        if problems:
+            regressions.append(name)
+        print(f"{name:<28} {old['p95_ms']:>8.2f} -> {now['p95_ms']:>7.2f} {p95:>+7.0%} "
+              f"{old['throughput_rps']:>7.1f} -> {now['throughput_rps']:>6.1f} {rate:>+7.0%} "
+              f"{old['sql_per_request']:>5.1f} -> {now['sql_per_request']:>4.1f}  "
+              f"{'REGRESSION: ' + ', '.join(problems) if problems else 'ok'}")
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print('No regressions.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the scenarios and write a JSON report')
+    run_parser.add_argument('--database', help='seeded database to copy (python -m benchmarks.seed)')
+    run_parser.add_argument('--scale', choices=('small', 'full'), default='small',
+                            help='volumes to seed when no --database is given')
+    run_parser.add_argument('--requests', type=int, default=100, help='timed requests per scenario')
+    run_parser.add_argument('--max-seconds', type=float, default=30, help='time limit per scenario')
+    run_parser.add_argument('--only', nargs='+', metavar='SCENARIO')
+    run_parser.add_argument('--out', help='JSON report path')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions between two reports')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.15,
+                                help='relative p95/throughput change that counts (default 0.15)')
+    compare_parser.add_argument('--min-ms', type=float, default=1.0,
+                                help='smallest p95 increase in ms that counts (default 1)')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark: template compilation, fragment caching and the render profile.
+
+  startup    loading every template in a fresh environment (a new worker):
+             compiling from source vs. reading the on-disk bytecode cache
+  render     the card-heavy pages with the fragment cache off vs. on; the
+             HTML must be byte-identical
+  profile    /admin/api/render-profile after the run: per route, how the
+             time splits between SQL, Jinja and Python (incl. ORM loading)
+
+Also checks that an edited doctor shows up on the next render. Exits
+non-zero if a check fails.
+
+    python -m benchmarks.template_benchmark [--repeat 30]
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from benchmarks.common import use_temp_database, login, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--doctors', type=int, default=2000)
+    args = parser.parse_args()
+
+    use_temp_database('templates.db')
+    from app import create_app, init_db
+    # The response cache would hide rendering altogether
+    app = create_app({'EMAIL_WORKER_THREAD': False, 'RESPONSE_CACHE_BACKEND': None})
+    init_db(app)
+    from jinja2 import Environment, FileSystemBytecodeCache
+    from database import db, Doctor
+    from benchmarks.seed import seed, seed_accounts, ADMIN_EMAIL, LOGIN_PASSWORD
+    import templating
+
+    with app.app_context():
+        seed(doctors=args.doctors, patients=500, appointments=5000)
+        seed_accounts()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+    # A fresh Environment per sample stands in for a newly started worker
+    cache_dir = tempfile.mkdtemp(prefix='medibook-jinja-bench-')
+
+    def load_all(bytecode_cache):
+        env = Environment(loader=app.jinja_loader, bytecode_cache=bytecode_cache)
+        env.globals.update(app.jinja_env.globals)
+        start = time.perf_counter()
+        names = templating.precompile(env)
+        return (time.perf_counter() - start) * 1000, len(names)
+
+    load_all(FileSystemBytecodeCache(cache_dir))  # fill the cache
+    cold = [load_all(None)[0] for _ in range(5)]
+    warm = [load_all(FileSystemBytecodeCache(cache_dir))[0] for _ in range(5)]
+    count = load_all(None)[1]
+    print(f"{'startup (' + str(count) + ' templates)':<28} {'p50 ms':>8}")
+    print(f"{'compile from source':<28} {percentile(cold, 50):>8.1f}")
+    print(f"{'bytecode cache':<28} {percentile(warm, 50):>8.1f}")
+
+    client = app.test_client()
+    print(f"\n{'page':<12} {'fragments':>10} {'p50 ms':>8} {'p95 ms':>8} {'render ms':>10}")
+    for url in ('/', '/doctors', '/hospitals'):
+        pages = {}
+        for size in (0, 5000):
+            app.config['FRAGMENT_CACHE_SIZE'] = size
+            templating.clear_fragments()
+            pages[size] = client.get(url).data
+            samples, render = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(url)
+                samples.append((time.perf_counter() - start) * 1000)
+                render.append(float(response.headers['Server-Timing'].split('render;dur=')[1].split(',')[0]))
+            print(f"{url:<12} {'on' if size else 'off':>10} {percentile(samples, 50):>8.2f} "
+                  f"{percentile(samples, 95):>8.2f} {percentile(render, 50):>10.2f}")
+        check(pages[0] == pages[5000], f'{url} is identical with cached fragments')
+
+    # An edit must produce a new fragment
+    with app.app_context():
+        doctor = Doctor.query.order_by(Doctor.id).first()
+        doctor.specialization = 'Benchmarkology'
+        db.session.commit()
+    check(b'Benchmarkology' in client.get('/doctors').data, 'an edited doctor card is re-rendered')
+
+    admin = login(app.test_client(), '/admin/login', ADMIN_EMAIL, LOGIN_PASSWORD)
+    profile = admin.get('/admin/api/render-profile').get_json()
+    print(f"\n{'route':<20} {'requests':>8} {'avg ms':>8} {'sql':>7} {'render':>7} {'python':>7} {'rows':>6}  dominant")
+    for route in profile['routes']:
+        if route['name'] in ('index', 'list_doctors', 'list_hospitals'):
+            print(f"{route['name']:<20} {route['count']:>8} {route['avg_ms']:>8.2f} {route['avg_sql_ms']:>7.2f} "
+                  f"{route['avg_render_ms']:>7.2f} {route['avg_python_ms']:>7.2f} {route['avg_rows_loaded']:>6.0f}"
+                  f"  {route['dominant']}")
+    print(f"\n{'block':<32} {'renders':>8} {'avg ms':>8}")
+    for block in profile['blocks'][:5]:
+        print(f"{block['name']:<32} {block['count']:>8} {block['avg_ms']:>8.2f}")
+    print(f"\nfragments: {profile['fragments']}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
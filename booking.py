@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from database import db, Appointment, SlotHold, ACTIVE_STATUSES
+from slots import is_bookable_time
+import availability
+import response_cache
+
+# Atomic slot reservation.
+#
+# The database is the source of truth: a partial unique index allows one
+# pending/confirmed appointment per (doctor, time), so of any number of
+# concurrent bookings for a slot exactly one INSERT succeeds. Holds are a
+# short-lived courtesy on top: picking a time in the booking form reserves it
+# for SLOT_HOLD_SECONDS so other patients see it as taken while the form is
+# filled in. A hold is claimed with a single upsert, so it is atomic too.
+
+class SlotUnavailable(Exception):
+    """The slot is booked, held by another patient, or not on the slot grid"""
+
+def _check_time(doctor_id, when):
+    if not is_bookable_time(when) or not availability.works_at(doctor_id, when):
+        raise SlotUnavailable('Please pick one of the available time slots.')
+    if when <= datetime.now():
+        raise SlotUnavailable('That time has already passed.')
+
+def _is_booked(doctor_id, when):
+    return db.session.execute(
+        select(Appointment.id).where(
+            Appointment.doctor_id == doctor_id,
+            Appointment.date_time == when,
+            Appointment.status.in_(ACTIVE_STATUSES)
+        ).limit(1)
+    ).first() is not None
+
+def hold_slot(doctor_id, when, patient_id, now=None):
+    """Reserve a slot for patient_id and return the hold's expiry time.
+
+    Refreshes the patient's own hold, takes over an expired one and releases
+    any other slot the patient was holding. Raises SlotUnavailable if the
+    slot is booked or another patient holds it.
+    """
+    _check_time(doctor_id, when)
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(seconds=current_app.config['SLOT_HOLD_SECONDS'])
+    if _is_booked(doctor_id, when):
+        raise SlotUnavailable('This slot has just been booked. Please pick another time.')
+
+    stmt = insert(SlotHold).values(doctor_id=doctor_id, date_time=when,
+                                   patient_id=patient_id, expires_at=expires_at)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SlotHold.doctor_id, SlotHold.date_time],
+        set_={'patient_id': stmt.excluded.patient_id, 'expires_at': stmt.excluded.expires_at},
+        # Only our own hold or an expired one may be overwritten
+        where=(SlotHold.patient_id == patient_id) | (SlotHold.expires_at <= now)
+    ).returning(SlotHold.id)
+    if db.session.execute(stmt).first() is None:
+        # Keep the hold the patient already has on another slot
+        db.session.rollback()
+        raise SlotUnavailable('Another patient is booking this slot. Please pick another time.')
+
+    # One hold per patient: drop their other holds, plus any expired ones.
+    # Two statements so each uses its index (an OR would scan the table)
+    db.session.execute(delete(SlotHold).where(
+        SlotHold.patient_id == patient_id,
+        (SlotHold.doctor_id != doctor_id) | (SlotHold.date_time != when)
+    ))
+    db.session.execute(delete(SlotHold).where(SlotHold.expires_at <= now))
+    # Other visitors now see the slot as taken
+    response_cache.bump(['appointment'])
+    db.session.commit()
+    return expires_at
+
+def book_slot(doctor_id, when, patient_id, **fields):
+    """Create a pending appointment for the slot, atomically.
+
+    Raises SlotUnavailable if another patient holds the slot or an active
+    appointment already exists for it (including one committed concurrently).
+    Releases the patient's hold on success.
+    """
+    _check_time(doctor_id, when)
+    now = datetime.utcnow()
+    held_by_other = db.session.execute(
+        select(SlotHold.id).where(
+            SlotHold.doctor_id == doctor_id,
+            SlotHold.date_time == when,
+            SlotHold.patient_id != patient_id,
+            SlotHold.expires_at > now
+        )
+    ).first()
+    if held_by_other:
+        raise SlotUnavailable('Another patient is booking this slot. Please pick another time.')
+
+    appointment = Appointment(patient_id=patient_id, doctor_id=doctor_id, date_time=when,
+                              status='pending', **fields)
+    db.session.add(appointment)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        raise SlotUnavailable('This slot has just been booked. Please pick another time.')
+    db.session.execute(delete(SlotHold).where(
+        SlotHold.doctor_id == doctor_id, SlotHold.date_time == when
+    ))
+    db.session.commit()
+    return appointment
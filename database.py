@@ -1,9 +1,26 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 from datetime import datetime
 
 db = SQLAlchemy()
 
+def configure_sqlite(engine, pragmas):
+    """Run `PRAGMA name = value` for each item on every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+# Appointment statuses that occupy a doctor's slot; at most one per (doctor, time)
+ACTIVE_STATUSES = ('pending', 'confirmed')
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -14,6 +31,9 @@ class User(UserMixin, db.Model):
     # New Profile Fields
     phone_number = db.Column(db.String(20), nullable=True)
     membership_id = db.Column(db.String(20), unique=True, nullable=True)
+
+    # Incremented on every ORM update; template fragments are cached per (id, row_version)
+    row_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     # Relationships
     appointments_as_patient = db.relationship('Appointment', backref='patient', foreign_keys='Appointment.patient_id', lazy=True)
@@ -26,6 +46,13 @@ class Hospital(db.Model):
     image_url = db.Column(db.String(255), nullable=True)
     description = db.Column(db.Text, nullable=True)
     specialties = db.Column(db.String(200), nullable=True) # Comma separated list for simple filtering
+    row_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # Directory filters (/hospitals)
+    __table_args__ = (
+        db.Index('ix_hospital_city', 'city'),
+        db.Index('ix_hospital_country', 'country'),
+    )
 
 class Doctor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -45,11 +72,22 @@ class Doctor(db.Model):
     
     # Link to hospital (Optional)
     hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=True)
+
+    row_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     user = db.relationship('User', backref=db.backref('doctor_profile', uselist=False))
     hospital = db.relationship('Hospital', backref=db.backref('doctors', lazy=True))
     appointments = db.relationship('Appointment', backref='doctor', foreign_keys='Appointment.doctor_id', lazy=True)
 
+    # Directory filters (/doctors) and relationship lookups
+    __table_args__ = (
+        db.Index('ix_doctor_user_id', 'user_id'),
+        db.Index('ix_doctor_hospital_id', 'hospital_id'),
+        db.Index('ix_doctor_specialization', 'specialization'),
+        db.Index('ix_doctor_city', 'city'),
+        db.Index('ix_doctor_country', 'country'),
+    )
+
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -61,3 +99,158 @@ class Appointment(db.Model):
     notes = db.Column(db.Text, nullable=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set when the reminder email is queued (see reminders.py)
+    reminder_sent_at = db.Column(db.DateTime, nullable=True)
+
+    # Hot lookups: slots (doctor + status + time range), dashboards (patient/doctor),
+    # admin pending count and the created_at / date_time orderings in the admin views
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_status_date', 'doctor_id', 'status', 'date_time'),
+        db.Index('ix_appointment_patient_date', 'patient_id', 'date_time'),
+        db.Index('ix_appointment_status_date', 'status', 'date_time'),
+        db.Index('ix_appointment_date_time', 'date_time'),
+        db.Index('ix_appointment_created_at', 'created_at'),
+        # Double-booking guard: one active appointment per doctor and time
+        db.Index('ux_appointment_active_slot', 'doctor_id', 'date_time', unique=True,
+                 sqlite_where=db.text("status IN ('pending', 'confirmed')")),
+        # Reminder scheduler: only upcoming confirmed appointments not reminded yet
+        db.Index('ix_appointment_reminder_due', 'status', 'reminder_sent_at', 'date_time',
+                 sqlite_where=db.text("status = 'confirmed' AND reminder_sent_at IS NULL")),
+    )
+
+class AppointmentArchive(db.Model):
+    # Past appointments moved out of `appointment` by archive.py: same columns
+    # and ids, read only by the history views
+    __tablename__ = 'appointment_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    date_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20))
+    type = db.Column(db.String(20))
+    meeting_link = db.Column(db.String(200), nullable=True)
+    notes = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    patient = db.relationship('User')
+    doctor = db.relationship('Doctor')
+
+    __table_args__ = (
+        db.Index('ix_appointment_archive_patient_date', 'patient_id', 'date_time'),
+        db.Index('ix_appointment_archive_doctor_date', 'doctor_id', 'date_time'),
+        db.Index('ix_appointment_archive_date_time', 'date_time'),
+    )
+
+class SlotHold(db.Model):
+    # Short-lived reservation of a slot while a patient fills in the booking form (see booking.py)
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    date_time = db.Column(db.DateTime, nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ux_slot_hold_slot', 'doctor_id', 'date_time', unique=True),
+        db.Index('ix_slot_hold_patient', 'patient_id'),
+        db.Index('ix_slot_hold_expires', 'expires_at'),
+    )
+
+class WorkingHours(db.Model):
+    # Weekly schedule: appointments from start_hour to end_hour on weekday
+    # (0 = Monday); several rows per day for split shifts. Doctors without
+    # rows keep the default 9:00-17:00 every day (see availability.py)
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)
+    start_hour = db.Column(db.Integer, nullable=False)
+    end_hour = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_working_hours_doctor', 'doctor_id'),
+    )
+
+class ScheduleException(db.Model):
+    # A dated change to the weekly schedule: 'off' closes the hours (all day
+    # when they are empty), 'extra' opens hours outside the usual schedule
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    kind = db.Column(db.String(10), nullable=False, default='off')  # 'off', 'extra'
+    start_hour = db.Column(db.Integer, nullable=True)
+    end_hour = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_schedule_exception_doctor_date', 'doctor_id', 'date'),
+    )
+
+class DoctorAvailability(db.Model):
+    # Free slots of a doctor from start_date on, one bit per hourly slot
+    # (24 bits per day, little-endian); kept current by availability.py
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), primary_key=True)
+    start_date = db.Column(db.Date, nullable=False)
+    free = db.Column(db.LargeBinary, nullable=False)
+
+class EmailJob(db.Model):
+    # Outbox for emails sent by the background worker (see outbox.py)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # e.g. 'appointment_confirmation'
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'sending', 'sent', 'skipped', 'dead'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    appointment = db.relationship('Appointment')
+
+    # Worker claims due jobs by (status, next_attempt_at)
+    __table_args__ = (
+        db.Index('ix_email_job_status_next', 'status', 'next_attempt_at'),
+    )
+
+class StatCounter(db.Model):
+    # Row counts per column value, kept current on every write (see stats.py)
+    name = db.Column(db.String(200), primary_key=True)  # e.g. 'appointment.status:pending'
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class IdSequence(db.Model):
+    # Counters handed out in blocks, e.g. 'membership:2025' (see membership.py)
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False, default=0)
+
+class DataVersion(db.Model):
+    # Bumped by every write to a data scope; part of the response cache key (see response_cache.py)
+    scope = db.Column(db.String(50), primary_key=True)  # 'doctor', 'hospital', 'appointment'
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def _bump_row_version(mapper, connection, target):
+    # Also called for rows whose only change is a collection; those keep their version
+    if not object_session(target).is_modified(target, include_collections=False):
+        return
+    # Computed in the UPDATE itself, so concurrent writers never reuse a version
+    target.row_version = mapper.class_.row_version + 1
+
+ROW_VERSIONED = (User, Hospital, Doctor)
+
+def ensure_row_versions(connection):
+    """Add row_version to tables created before it existed (migrate_db.py does the same)"""
+    for model in ROW_VERSIONED:
+        table = model.__tablename__
+        columns = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table}")')}
+        if 'row_version' not in columns:
+            connection.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1')
+
+def ensure_reminder_marker(connection):
+    """Add appointment.reminder_sent_at and its index to databases created before them (as migrate_db.py)"""
+    columns = {row[1] for row in connection.exec_driver_sql('PRAGMA table_info("appointment")')}
+    if 'reminder_sent_at' not in columns:
+        connection.exec_driver_sql('ALTER TABLE "appointment" ADD COLUMN reminder_sent_at DATETIME')
+        next(index for index in Appointment.__table__.indexes
+             if index.name == 'ix_appointment_reminder_due').create(connection)
+
+for _model in ROW_VERSIONED:
+    event.listen(_model, 'before_update', _bump_row_version)
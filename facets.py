@@ -0,0 +1,57 @@
+import threading
+import time
+from sqlalchemy import func
+from database import db, Doctor, Hospital
+
+# Filter dropdown values for the directories, with per-value row counts.
+# Built with one GROUP BY per column (served from the column indexes) and
+# kept in memory until a write path calls invalidate(). The TTL bounds how
+# long other worker processes can serve facets from before a write.
+
+FACET_TTL_SECONDS = 300
+
+FACET_COLUMNS = {
+    'doctor': {
+        'specialties': Doctor.specialization,
+        'cities': Doctor.city,
+        'countries': Doctor.country,
+    },
+    'hospital': {
+        'cities': Hospital.city,
+        'countries': Hospital.country,
+    },
+}
+
+_cache = {}  # table -> (built_at, {facet: [(value, count), ...]})
+_lock = threading.Lock()
+
+def _count_values(column):
+    """[(value, count), ...] sorted by value, skipping empty values"""
+    rows = db.session.query(column, func.count()) \
+        .filter(column != None, column != '') \
+        .group_by(column) \
+        .order_by(column)
+    return [(value, count) for value, count in rows]
+
+def get_facets(table):
+    """Return {facet: [(value, count), ...]} for 'doctor' or 'hospital'"""
+    entry = _cache.get(table)
+    if entry and time.monotonic() - entry[0] < FACET_TTL_SECONDS:
+        return entry[1]
+
+    with _lock:
+        # Another thread may have rebuilt it while we waited
+        entry = _cache.get(table)
+        if entry and time.monotonic() - entry[0] < FACET_TTL_SECONDS:
+            return entry[1]
+        facets = {name: _count_values(column) for name, column in FACET_COLUMNS[table].items()}
+        _cache[table] = (time.monotonic(), facets)
+        return facets
+
+def invalidate(table=None):
+    """Drop cached facets for one table (or all) after a write"""
+    with _lock:
+        if table is None:
+            _cache.clear()
+        else:
+            _cache.pop(table, None)
@@ -0,0 +1,42 @@
+# Gunicorn settings for production: gunicorn -c gunicorn.conf.py wsgi:app
+# Every value can be overridden from the environment.
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Processes x threads. SQLite allows one writer at a time, but with WAL
+# (see SQLITE_PRAGMAS in app.py) readers run in parallel with it.
+workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 60)
+keepalive = 5
+
+# Recycle workers now and then to cap memory growth
+max_requests = 1000
+max_requests_jitter = 100
+
+# Import and build the app once in the master and fork the workers from it,
+# so a new or recycled worker answers right away. Safe because building the
+# app opens no database connection (see create_app): each worker opens its
+# own after the fork. New code then needs a restart, not a HUP.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# Workers share their request metrics through files in this directory
+# (see metrics.py); a new server run starts from zero
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'medibook-metrics'))
+
+def on_starting(server):
+    import metrics
+    metrics.reset_directory(os.environ['METRICS_DIR'])
+
+def worker_exit(server, worker):
+    # Keep the last second of an exiting (e.g. recycled) worker's numbers
+    import metrics
+    metrics.flush()
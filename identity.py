@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_app_context
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from database import db, User
+
+# User records for the login loader and the admin session check.
+#
+# Each request resolves a user id at most once (memo on flask.g). Across
+# requests, column values are kept in a small process-wide LRU with a TTL
+# and re-attached to the request's session without a SELECT, so an
+# authenticated page costs no identity queries. Write paths call
+# invalidate(user_id); the TTL bounds how long other worker processes can
+# serve a stale name or role.
+
+IDENTITY_TTL_SECONDS = 60
+IDENTITY_CACHE_SIZE = 2048
+
+_COLUMNS = [attr.key for attr in inspect(User).column_attrs]
+
+_cache = OrderedDict()  # user_id -> (cached_at, {column: value})
+_lock = threading.Lock()
+
+def _cached_values(user_id):
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= IDENTITY_TTL_SECONDS:
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+        return entry[1]
+
+def _store(user):
+    values = {key: getattr(user, key) for key in _COLUMNS}
+    with _lock:
+        _cache[user.id] = (time.monotonic(), values)
+        _cache.move_to_end(user.id)
+        while len(_cache) > IDENTITY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def _attach(values):
+    """Turn cached column values into a User in the current session, without a query"""
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def get_user(user_id):
+    """Return the User with this id (or None), memoised per request and cached per process"""
+    memo = g.setdefault('_identity_users', {})
+    if user_id in memo:
+        return memo[user_id]
+
+    values = _cached_values(user_id)
+    if values is not None:
+        user = _attach(values)
+    else:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            _store(user)
+    memo[user_id] = user
+    return user
+
+def invalidate(user_id=None):
+    """Forget a user (or everyone) after a write to the user table"""
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+    if has_app_context() and '_identity_users' in g:
+        if user_id is None:
+            g._identity_users.clear()
+        else:
+            g._identity_users.pop(user_id, None)
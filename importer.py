@@ -0,0 +1,348 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+import passwords
+from database import db, User, Doctor, Hospital
+import availability
+import facets
+import response_cache
+import search
+import stats
+
+# Bulk import of doctors and hospitals from CSV or JSON Lines files.
+#
+# Rows are read as a stream and handled IMPORT_CHUNK_SIZE at a time: checked
+# field by field, checked against existing accounts with one
+# `email IN (...)` query, then written with bulk INSERTs in one transaction
+# per chunk. Memory stays bounded by the chunk size, and a bad row or a
+# failed chunk does not undo the chunks before it.
+#
+# Bulk INSERTs skip the ORM hooks, so each chunk also updates the search
+# index, the dashboard counters, the free-slot bitmaps and the response
+# cache versions itself.
+#
+# Passwords given in the file are hashed with PASSWORD_HASH_METHOD in a
+# process pool of IMPORT_HASH_WORKERS processes (default one per CPU), or
+# with IMPORT_HASH_WORKERS = 0 in the app's bounded password pool
+# (passwords.py), POOL_HASH_BATCH at a time so logins get a place in
+# between. Uploads in the admin panel use the latter: a web request must
+# not start processes of its own or take every core from the pages. They
+# also stop hashing after IMPORT_MAX_PASSWORDS rows and report the rest.
+# Rows without a password get IMPORT_DEFAULT_PASSWORD, hashed once per
+# import. It is the same known value for every such row, so a hash per row
+# would cost a hash run per doctor and protect nothing.
+#
+# Columns (CSV header or JSON keys); `type` defaults to doctor:
+#   hospital  name, city, country, specialties, description, image_url
+#   doctor    name, email, specialization, password, fee, experience_years,
+#             city, country, education, bio, hospital (an existing or
+#             earlier imported hospital's name, or its id)
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'json'}
+HOSPITAL_IMAGE = "https://via.placeholder.com/400"  # as for hospitals added in the admin panel
+MAX_REPORTED_ERRORS = 1000
+POOL_HASH_BATCH = 4  # hashes per place taken in the app's password pool
+
+class ImportFileError(ValueError):
+    """The file as a whole cannot be imported (unknown format, bad header)"""
+
+class ImportReport:
+    """Running totals of an import, plus the first MAX_REPORTED_ERRORS row errors"""
+
+    def __init__(self):
+        self.rows = 0
+        self.doctors = 0
+        self.hospitals = 0
+        self.failed = 0
+        self.errors = []  # (line, message)
+        self.started = time.perf_counter()
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        return (f"{self.rows} rows: {self.doctors} doctors and {self.hospitals} hospitals imported, "
+                f"{self.failed} failed ({self.rows / max(self.seconds, 1e-9):,.0f} rows/s)")
+
+    def as_dict(self):
+        return {'rows': self.rows, 'doctors': self.doctors, 'hospitals': self.hospitals,
+                'failed': self.failed, 'seconds': round(self.seconds, 2),
+                'errors': [{'line': line, 'message': message} for line, message in self.errors]}
+
+# --- Reading ---
+
+def format_for(filename):
+    fmt = FORMATS.get(os.path.splitext(filename or '')[1].lower())
+    if not fmt:
+        raise ImportFileError(f"Unsupported file type; expected one of {', '.join(sorted(FORMATS))}.")
+    return fmt
+
+def read_rows(stream, fmt):
+    """Yield (line number, {column: value}) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if not reader.fieldnames:
+            raise ImportFileError('The CSV file has no header row.')
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+    else:
+        # A JSON array cannot be streamed with the standard library; prefer .jsonl for big files
+        try:
+            rows = json.load(stream)
+        except ValueError as e:
+            raise ImportFileError(f'Invalid JSON: {e}')
+        if not isinstance(rows, list):
+            raise ImportFileError('Expected a JSON array of objects.')
+        for number, row in enumerate(rows, 1):
+            yield number, row
+
+# --- Checking ---
+
+def _text(row, key, limit=None, required=False):
+    value = row.get(key)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{key} is required')
+    if limit and len(value) > limit:
+        raise ValueError(f'{key} is longer than {limit} characters')
+    return value or None
+
+def _number(row, key, kind, default=None):
+    value = row.get(key)
+    if value is None or str(value).strip() == '':
+        return default
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} must be a number')
+    if number < 0:
+        raise ValueError(f'{key} cannot be negative')
+    return number
+
+def check_row(row):
+    """('doctor' | 'hospital', column values) for a row, or ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError('not an object')
+    kind = (_text(row, 'type') or 'doctor').lower()
+    if kind == 'hospital':
+        return kind, {
+            'name': _text(row, 'name', 150, required=True),
+            'city': _text(row, 'city', 100, required=True),
+            'country': _text(row, 'country', 100, required=True),
+            'specialties': _text(row, 'specialties', 200),
+            'description': _text(row, 'description'),
+            'image_url': _text(row, 'image_url', 255) or HOSPITAL_IMAGE,
+        }
+    if kind != 'doctor':
+        raise ValueError(f"type must be 'doctor' or 'hospital', not {kind!r}")
+    email = _text(row, 'email', 120, required=True)
+    if '@' not in email:
+        raise ValueError('email is not an email address')
+    return kind, {
+        'name': _text(row, 'name', 100, required=True),
+        'email': email,
+        'password': _text(row, 'password'),
+        'specialization': _text(row, 'specialization', 100, required=True),
+        'consultation_fee': _number(row, 'fee', float, 50.0),
+        'experience_years': _number(row, 'experience_years', int),
+        'city': _text(row, 'city', 100),
+        'country': _text(row, 'country', 100),
+        'education': _text(row, 'education'),
+        'bio': _text(row, 'bio'),
+        'hospital': _text(row, 'hospital'),
+    }
+
+# --- Writing ---
+
+class _Importer:
+    def __init__(self, config, report):
+        self.report = report
+        self.chunk_size = config['IMPORT_CHUNK_SIZE']
+        self.workers = config.get('IMPORT_HASH_WORKERS')
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        self.method = passwords.full_method(config['PASSWORD_HASH_METHOD'])
+        self.pool = None
+        self.default_hash = self.hash_passwords([config['IMPORT_DEFAULT_PASSWORD']])[0]
+        self.max_passwords = config.get('IMPORT_MAX_PASSWORDS')
+        self.passwords_hashed = 0
+        # Hospital references resolve by name or id; one entry per hospital, so
+        # this stays small next to the doctor rows
+        self.hospitals = {}
+        for hospital_id, name, city in db.session.execute(select(Hospital.id, Hospital.name, Hospital.city)):
+            self.hospitals.setdefault(name.lower(), hospital_id)
+            self.hospitals[str(hospital_id)] = hospital_id
+            self.hospitals[(name.lower(), city.lower())] = hospital_id
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+
+    def hash_passwords(self, plaintexts):
+        if not self.workers:
+            return [hashed for i in range(0, len(plaintexts), POOL_HASH_BATCH)
+                    for hashed in passwords.hash_many(plaintexts[i:i + POOL_HASH_BATCH])]
+        if self.workers == 1:
+            return [generate_password_hash(p, method=self.method) for p in plaintexts]
+        if self.pool is None:
+            # spawn, not fork: the caller may be a threaded server process
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        chunksize = max(1, len(plaintexts) // (self.workers * 4))
+        return list(self.pool.map(generate_password_hash, plaintexts,
+                                  [self.method] * len(plaintexts), chunksize=chunksize))
+
+    def run(self, rows, progress=None):
+        chunk = []
+        for line, row in rows:
+            self.report.rows += 1
+            chunk.append((line, row))
+            if len(chunk) >= self.chunk_size:
+                self.write_chunk(chunk)
+                chunk = []
+                if progress:
+                    progress(self.report)
+        if chunk:
+            self.write_chunk(chunk)
+            if progress:
+                progress(self.report)
+
+    def write_chunk(self, chunk):
+        checked = []
+        for line, row in chunk:
+            try:
+                kind, values = check_row(row)
+                if kind == 'doctor' and values['password']:
+                    if self.max_passwords is not None and self.passwords_hashed >= self.max_passwords:
+                        raise ValueError(f'more than {self.max_passwords} rows with a password: '
+                                         f'import this file with `flask import-directory`')
+                    self.passwords_hashed += 1
+                checked.append((line, kind, values))
+            except ValueError as e:
+                self.report.error(line, str(e))
+
+        hashes = self.hash_passwords([values['password'] for _, kind, values in checked
+                                      if kind == 'doctor' and values['password']])
+        try:
+            added = self._insert(checked, iter(hashes))
+        except IntegrityError:
+            # An account with one of these emails was created concurrently
+            # (e.g. by /register) after the email check: check again
+            db.session.rollback()
+            try:
+                added = self._insert(checked, iter(hashes))
+            except IntegrityError as e:
+                db.session.rollback()
+                for line, _, _ in checked:
+                    self.report.error(line, f'not saved with the rest of its chunk: {e.orig}')
+                return
+        self.hospitals.update(added)
+
+    def _insert(self, checked, hashes):
+        """Write one chunk in one transaction; returns the new hospital lookup entries"""
+        report_errors = []
+        connection = db.session.connection()
+
+        hospitals, new_keys = [], {}
+        for line, kind, values in checked:
+            if kind != 'hospital':
+                continue
+            key = (values['name'].lower(), values['city'].lower())
+            if key in self.hospitals or key in new_keys:
+                report_errors.append((line, f"hospital {values['name']} in {values['city']} already exists"))
+                continue
+            new_keys[key] = None
+            hospitals.append(values)
+        added = {}
+        if hospitals:
+            ids = db.session.execute(insert(Hospital).returning(Hospital.id, sort_by_parameter_order=True),
+                                     hospitals).scalars().all()
+            for hospital_id, values in zip(ids, hospitals):
+                added.setdefault(values['name'].lower(), hospital_id)
+                added[(values['name'].lower(), values['city'].lower())] = hospital_id
+                added[str(hospital_id)] = hospital_id
+
+        doctors = [(line, values) for line, kind, values in checked if kind == 'doctor']
+        taken = set(db.session.execute(
+            select(User.email).where(User.email.in_([values['email'] for _, values in doctors]))
+        ).scalars()) if doctors else set()
+        users, profiles, seen = [], [], set()
+        for line, values in doctors:
+            password = next(hashes) if values['password'] else self.default_hash
+            if values['email'] in taken or values['email'] in seen:
+                report_errors.append((line, f"email {values['email']} is already registered"))
+                continue
+            hospital_id = None
+            if values['hospital']:
+                reference = values['hospital'].lower()
+                hospital_id = added.get(reference) or self.hospitals.get(reference)
+                if hospital_id is None:
+                    report_errors.append((line, f"unknown hospital {values['hospital']}"))
+                    continue
+            seen.add(values['email'])
+            users.append({'name': values['name'], 'email': values['email'], 'password': password, 'role': 'doctor'})
+            profiles.append({'specialization': values['specialization'], 'consultation_fee': values['consultation_fee'],
+                             'experience_years': values['experience_years'], 'city': values['city'],
+                             'country': values['country'], 'education': values['education'], 'bio': values['bio'],
+                             'hospital_id': hospital_id})
+
+        doctor_ids = []
+        if users:
+            user_ids = db.session.execute(insert(User).returning(User.id, sort_by_parameter_order=True),
+                                          users).scalars().all()
+            for user_id, profile in zip(user_ids, profiles):
+                profile['user_id'] = user_id
+            doctor_ids = db.session.execute(insert(Doctor).returning(Doctor.id, sort_by_parameter_order=True),
+                                            profiles).scalars().all()
+
+        if users or hospitals:
+            deltas = Counter({stats.counter_name(User, 'doctor'): len(users)})
+            deltas.update(stats.counter_name(Doctor, profile['specialization']) for profile in profiles)
+            stats.adjust(connection, deltas)
+            search.reindex(connection, doctor_ids, list(set(added.values())))
+            availability.rebuild(connection, doctor_ids)
+            response_cache.bump({'doctor', 'hospital'})
+        db.session.commit()
+
+        for line, message in report_errors:
+            self.report.error(line, message)
+        self.report.doctors += len(users)
+        self.report.hospitals += len(hospitals)
+        if users or hospitals:
+            facets.invalidate('doctor')
+            facets.invalidate('hospital')
+        return added
+
+def import_file(stream, fmt, config, progress=None):
+    """Import a text stream of rows; returns an ImportReport.
+
+    `config` is the app config (IMPORT_* settings). `progress(report)` is
+    called after every chunk. Raises ImportFileError if the file as a whole is
+    unreadable.
+    """
+    report = ImportReport()
+    importer = _Importer(config, report)
+    try:
+        importer.run(read_rows(stream, fmt), progress)
+    finally:
+        importer.close()
+    return report
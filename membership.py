@@ -0,0 +1,138 @@
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam, func, select, text, update
+from sqlalchemy.dialects.sqlite import insert
+from database import db, User, IdSequence
+
+# Membership IDs: MB-YYYY-XXXXXX, six characters of 0-9A-Z.
+#
+# Each year has a counter in id_sequence. A process reserves
+# MEMBERSHIP_BLOCK_SIZE numbers at a time with one atomic upsert and hands
+# them out from memory, so gunicorn workers never issue the same number and
+# most registrations cost no extra query. Numbers go through a bijection
+# modulo 36**6 before they are encoded, so members who sign up one after the
+# other don't get neighbouring IDs. That hides the order; it is not a
+# secret.
+#
+# IDs from the old random generator can be anywhere in that space, so a
+# reserved block first drops the numbers whose IDs are already taken, with
+# one IN (...) query. The unique index on user.membership_id is the final
+# guard. backfill() gives IDs to existing users in batched UPDATEs and
+# creates that index on databases migrated without it.
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+SUFFIX_LENGTH = 6
+SPACE = len(ALPHABET) ** SUFFIX_LENGTH  # 2,176,782,336 IDs per year
+MULTIPLIER = 1_000_000_007  # a prime other than 2 and 3, so invertible modulo 36**6
+OFFSET = 387_420_489
+UNIQUE_INDEX = 'ux_user_membership_id'
+BACKFILL_BATCH = 20000
+LOOKUP_BATCH = 10000  # IDs per IN (...) list
+
+# Every 3-character string, by value: two lookups encode a number
+_TRIPLES = [a + b + c for a in ALPHABET for b in ALPHABET for c in ALPHABET]
+_HALF = len(_TRIPLES)
+
+_blocks = {}  # year -> deque of numbers left in this process's block
+_blocks_pid = None
+_lock = threading.Lock()
+
+def encode(year, number):
+    """The membership ID for the number-th member of a year"""
+    if not 0 <= number < SPACE:
+        raise ValueError(f'Membership IDs for {year} are used up')
+    value = (number * MULTIPLIER + OFFSET) % SPACE
+    return f'MB-{year}-{_TRIPLES[value // _HALF]}{_TRIPLES[value % _HALF]}'
+
+def reserve(connection, year, size):
+    """Claim `size` numbers of the year's counter in the caller's transaction: (start, end)"""
+    stmt = insert(IdSequence).values(name=f'membership:{year}', next_value=size)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdSequence.name],
+        set_={'next_value': IdSequence.next_value + size}
+    ).returning(IdSequence.next_value)
+    end = connection.execute(stmt).scalar_one()
+    return end - size, end
+
+def _untaken(connection, year, numbers):
+    """The numbers whose IDs nobody has yet, in order"""
+    candidates = {encode(year, number): number for number in numbers}
+    ids = list(candidates)
+    taken = set()
+    for i in range(0, len(ids), LOOKUP_BATCH):
+        taken.update(connection.execute(
+            select(User.membership_id).where(User.membership_id.in_(ids[i:i + LOOKUP_BATCH]))).scalars())
+    return [number for membership_id, number in candidates.items() if membership_id not in taken]
+
+def allocate(year=None):
+    """A membership ID nobody has.
+
+    Reserving a new block commits its own short transaction, so call this
+    before writing in the session.
+    """
+    global _blocks_pid
+    year = year or datetime.now().year
+    with _lock:
+        # A forked worker must not reuse its parent's block
+        if _blocks_pid != os.getpid():
+            _blocks.clear()
+            _blocks_pid = os.getpid()
+        numbers = _blocks.get(year)
+        while not numbers:
+            with db.engine.begin() as connection:
+                start, end = reserve(connection, year, current_app.config['MEMBERSHIP_BLOCK_SIZE'])
+                numbers = _blocks[year] = deque(_untaken(connection, year, range(start, min(end, SPACE))))
+            if not numbers and end >= SPACE:
+                raise ValueError(f'Membership IDs for {year} are used up')
+        return encode(year, numbers.popleft())
+
+def has_unique_index(connection):
+    """True if some unique index covers exactly user.membership_id"""
+    for index in connection.execute(text("PRAGMA index_list(user)")).mappings():
+        if index['unique']:
+            columns = [row['name'] for row in connection.execute(text(f"PRAGMA index_info('{index['name']}')")).mappings()]
+            if columns == ['membership_id']:
+                return True
+    return False
+
+def backfill(connection, year=None, batch_size=BACKFILL_BATCH):
+    """Give every user without a membership ID one, then enforce uniqueness.
+
+    Runs in the caller's transaction. Where several users share an ID (older
+    databases), the oldest account keeps it and the others get new ones.
+    Returns {'duplicates': n, 'assigned': n}.
+    """
+    year = year or datetime.now().year
+    duplicates = connection.execute(text(
+        "UPDATE user SET membership_id = NULL WHERE membership_id IS NOT NULL AND id NOT IN ("
+        "SELECT MIN(id) FROM user WHERE membership_id IS NOT NULL GROUP BY membership_id)"
+    )).rowcount
+    missing = connection.execute(select(func.count()).where(User.membership_id.is_(None))).scalar()
+
+    # Numbers for the whole run in one reservation, topped up if old IDs were in the way
+    pool = deque()
+    stmt = update(User).where(User.id == bindparam('user_id')).values(membership_id=bindparam('new_id'))
+    last_id, assigned = 0, 0
+    while True:
+        user_ids = connection.execute(
+            select(User.id).where(User.membership_id.is_(None), User.id > last_id)
+            .order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        while len(pool) < len(user_ids):
+            start, end = reserve(connection, year, max(missing - assigned - len(pool), len(user_ids)))
+            pool.extend(_untaken(connection, year, range(start, min(end, SPACE))))
+            if end >= SPACE and len(pool) < len(user_ids):
+                raise ValueError(f'Membership IDs for {year} are used up')
+        connection.execute(stmt, [{'user_id': user_id, 'new_id': encode(year, pool.popleft())}
+                                  for user_id in user_ids])
+        last_id = user_ids[-1]
+        assigned += len(user_ids)
+
+    if not has_unique_index(connection):
+        connection.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX} ON user (membership_id)"))
+    return {'duplicates': duplicates, 'assigned': assigned}
@@ -0,0 +1,405 @@
+import bisect
+import hmac
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Request metrics in Prometheus text format.
+#
+# Every request records, per endpoint: a latency histogram, a response size
+# histogram, the number and total time of its SQL statements, its template
+# render time (measured by templating.py) and the ORM rows it loaded.
+# Statements slower than SLOW_QUERY_MS are printed with the endpoint that
+# issued them.
+#
+# All series are plain sums (counters and histogram buckets), so the workers
+# of a gunicorn server can share them: with METRICS_DIR set, a thread in
+# each process writes its series to METRICS_DIR/<pid>.json once a second
+# (when they changed) and /admin/metrics adds up every file. Without it, each process reports only
+# its own requests.
+#
+# ProfilerMiddleware profiles single requests on demand: send
+# `X-Profile: <PROFILE_TOKEN>` (plus `X-Profile-Mode: cprofile` for a
+# deterministic profile) and the response body is the profile instead of
+# the page.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+FLUSH_SECONDS = 1.0
+
+HELP = {
+    'medibook_http_requests_total': ('counter', 'Requests by endpoint, method and status'),
+    'medibook_http_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'medibook_http_response_size_bytes': ('histogram', 'Response body size by endpoint (streamed bodies excluded)'),
+    'medibook_sql_statements_total': ('counter', 'SQL statements executed by endpoint'),
+    'medibook_sql_duration_seconds_total': ('counter', 'Time spent executing SQL statements by endpoint'),
+    'medibook_sql_slow_statements_total': ('counter', 'Statements slower than SLOW_QUERY_MS by endpoint'),
+    'medibook_template_render_seconds_total': ('counter', 'Template render time by endpoint'),
+    'medibook_orm_rows_loaded_total': ('counter', 'ORM objects loaded by endpoint'),
+}
+
+# Histograms are stored per bucket (one increment per observation) and made
+# cumulative when rendered
+BUCKETS = {
+    'medibook_http_request_duration_seconds': LATENCY_BUCKETS,
+    'medibook_http_response_size_bytes': SIZE_BUCKETS,
+}
+
+_series = Counter()  # (name, ((label, value), ...)) -> value
+_lock = threading.Lock()
+_config = {'slow_query_ms': None, 'directory': None}
+_flusher = {'pid': None, 'dirty': False}
+
+def init_app(app, model_base):
+    _config['slow_query_ms'] = app.config.get('SLOW_QUERY_MS')
+    _config['directory'] = app.config.get('METRICS_DIR')
+    if _config['directory']:
+        os.makedirs(_config['directory'], exist_ok=True)
+
+    if app.config.get('METRICS_ENABLED'):
+        event.listen(Engine, 'before_cursor_execute', _statement_started)
+        event.listen(Engine, 'after_cursor_execute', _statement_finished)
+        event.listen(model_base, 'load', _row_loaded, propagate=True)
+        app.before_request(_request_started)
+        app.after_request(_response_ready)
+        app.teardown_request(_request_finished)
+
+    if app.config.get('PROFILE_TOKEN'):
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app.config['PROFILE_TOKEN'])
+
+def _endpoint():
+    return (request.endpoint or 'unmatched') if has_request_context() else 'background'
+
+def _add(name, labels, value=1):
+    _series[(name, tuple(sorted(labels.items())))] += value
+
+def _le(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+def _observe(name, labels, value):
+    """Count `value` in the first bucket that holds it; `labels` is a sorted tuple"""
+    buckets = BUCKETS[name]
+    index = bisect.bisect_left(buckets, value)
+    le = _le(buckets[index]) if index < len(buckets) else '+Inf'
+    _series[(f'{name}_bucket', tuple(sorted(labels + (('le', le),))))] += 1
+    _series[(f'{name}_sum', labels)] += value
+    _series[(f'{name}_count', labels)] += 1
+
+# --- Collection ---
+
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info['_metrics_started'] = time.perf_counter()
+
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('_metrics_started', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    if has_request_context():
+        g._sql_count = g.get('_sql_count', 0) + 1
+        g._sql_seconds = g.get('_sql_seconds', 0.0) + seconds
+    else:
+        with _lock:
+            _add('medibook_sql_statements_total', {'endpoint': 'background'})
+            _add('medibook_sql_duration_seconds_total', {'endpoint': 'background'}, seconds)
+
+    threshold = _config['slow_query_ms']
+    if threshold is not None and seconds * 1000 >= threshold:
+        endpoint = _endpoint()
+        with _lock:
+            _add('medibook_sql_slow_statements_total', {'endpoint': endpoint})
+        print(f"🐢 Slow query ({seconds * 1000:.0f} ms) from {endpoint}: {' '.join(statement.split())[:500]}")
+
+def _row_loaded(target, context):
+    if has_request_context():
+        g._rows_loaded = g.get('_rows_loaded', 0) + 1
+
+def _request_started():
+    g._metrics_started = time.perf_counter()
+
+def _response_ready(response):
+    g._status = response.status_code
+    g._size = None if response.is_streamed else response.calculate_content_length()
+    sql_ms = g.get('_sql_seconds', 0.0) * 1000
+    render_ms = g.get('_render_ms', 0.0)
+    total_ms = (time.perf_counter() - g._metrics_started) * 1000
+    response.headers['Server-Timing'] = (f'sql;dur={sql_ms:.1f}, render;dur={render_ms:.1f}, '
+                                         f'total;dur={total_ms:.1f}')
+    return response
+
+def _request_finished(exc):
+    started = g.pop('_metrics_started', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    endpoint = _endpoint()
+    labels = (('endpoint', endpoint),)
+    status = 500 if exc is not None else g.get('_status', 500)
+    size = g.get('_size')
+    with _lock:
+        _series[('medibook_http_requests_total',
+                 (('endpoint', endpoint), ('method', request.method), ('status', str(status))))] += 1
+        _observe('medibook_http_request_duration_seconds', labels, seconds)
+        if size is not None:
+            _observe('medibook_http_response_size_bytes', labels, size)
+        _series[('medibook_sql_statements_total', labels)] += g.get('_sql_count', 0)
+        _series[('medibook_sql_duration_seconds_total', labels)] += g.get('_sql_seconds', 0.0)
+        _series[('medibook_template_render_seconds_total', labels)] += g.get('_render_ms', 0.0) / 1000
+        _series[('medibook_orm_rows_loaded_total', labels)] += g.get('_rows_loaded', 0)
+        _flusher['dirty'] = True
+    if _config['directory'] and _flusher['pid'] != os.getpid():
+        _start_flusher()
+
+# --- Sharing between worker processes ---
+
+def _start_flusher():
+    # Started from the first request rather than init_app, so that it runs
+    # in the worker process, not in a master that forks afterwards
+    with _lock:
+        if _flusher['pid'] == os.getpid():
+            return
+        _flusher['pid'] = os.getpid()
+
+    def run():
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            if _flusher['dirty']:
+                flush()
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+def flush():
+    """Write this process's series to METRICS_DIR/<pid>.json"""
+    directory = _config['directory']
+    if not directory:
+        return
+    with _lock:
+        _flusher['dirty'] = False
+        rows = [[name, list(labels), value] for (name, labels), value in _series.items()]
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(rows, f)
+    os.replace(path + '.tmp', path)
+
+def collect():
+    """All series: this process's live values plus every other process's last flush"""
+    with _lock:
+        total = Counter(_series)
+    directory = _config['directory']
+    if directory:
+        own = f'{os.getpid()}.json'
+        for name in os.listdir(directory):
+            if not name.endswith('.json') or name == own:
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    rows = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, value in rows:
+                total[(metric, tuple(tuple(pair) for pair in labels))] += value
+    return total
+
+def reset_directory(directory):
+    """Drop the files of a previous server run (gunicorn calls this on start)"""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, name))
+
+# --- Output ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _family(name):
+    return re.sub(r'_(bucket|sum|count)$', '', name) if name not in HELP else name
+
+def _cumulative(series):
+    """Per-bucket counts -> cumulative `le` buckets, every bound present"""
+    result, bucketed = Counter(), {}
+    for (name, labels), value in series.items():
+        family = name[:-len('_bucket')]
+        if name.endswith('_bucket') and family in BUCKETS:
+            rest = tuple(pair for pair in labels if pair[0] != 'le')
+            bucketed.setdefault((family, rest), Counter())[dict(labels)['le']] += value
+        else:
+            result[(name, labels)] += value
+    for (family, rest), counts in bucketed.items():
+        running = 0
+        for bound in BUCKETS[family] + (float('inf'),):
+            running += counts[_le(bound)]
+            result[(f'{family}_bucket', tuple(sorted(rest + (('le', _le(bound)),))))] = running
+    return result
+
+def render_prometheus():
+    """Prometheus text exposition format (version 0.0.4)"""
+    series = _cumulative(collect())
+    families = {}
+    for (name, labels), value in series.items():
+        families.setdefault(_family(name), []).append((name, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        kind, help_text = HELP.get(family, ('untyped', ''))
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+
+        def order(row):
+            name, labels, _ = row
+            le = dict(labels).get('le')
+            return (tuple(pair for pair in labels if pair[0] != 'le'), name,
+                    float('inf') if le == '+Inf' else float(le or 0))
+        for name, labels, value in sorted(families[family], key=order):
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+            lines.append(f'{name}{{{label_text}}} {value:g}' if label_text else f'{name} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+def route_summary():
+    """Per endpoint averages in ms: total, sql, render, python (the rest), plus rows loaded"""
+    series = collect()
+    routes = {}
+    for (name, labels), value in series.items():
+        endpoint = dict(labels).get('endpoint')
+        if endpoint is None or 'le' in dict(labels):
+            continue
+        routes.setdefault(endpoint, Counter())[name] += value
+    summary = []
+    for endpoint, sums in routes.items():
+        count = sums['medibook_http_request_duration_seconds_count']
+        if not count:
+            continue
+        row = {
+            'name': endpoint,
+            'count': int(count),
+            'avg_ms': sums['medibook_http_request_duration_seconds_sum'] * 1000 / count,
+            'avg_sql_statements': sums['medibook_sql_statements_total'] / count,
+            'avg_sql_ms': sums['medibook_sql_duration_seconds_total'] * 1000 / count,
+            'avg_render_ms': sums['medibook_template_render_seconds_total'] * 1000 / count,
+            'avg_rows_loaded': sums['medibook_orm_rows_loaded_total'] / count,
+        }
+        # Neither statement execution nor Jinja: ORM loading, view code, hashing
+        row['avg_python_ms'] = max(row['avg_ms'] - row['avg_sql_ms'] - row['avg_render_ms'], 0)
+        row['dominant'] = max(('sql', 'render', 'python'), key=lambda part: row[f'avg_{part}_ms'])
+        summary.append({key: round(value, 3) if isinstance(value, float) else value for key, value in row.items()})
+    return sorted(summary, key=lambda row: row['avg_ms'] * row['count'], reverse=True)
+
+def token_matches(request, token):
+    """Bearer token check for scrapers that cannot log in"""
+    header = request.headers.get('Authorization', '')
+    return bool(token) and header.startswith('Bearer ') and hmac.compare_digest(header[7:], token)
+
+# --- On-demand profiling ---
+
+class Sampler:
+    """Samples one thread's Python stack every `interval` seconds from a helper thread"""
+
+    def __init__(self, thread_id, interval=0.001, root=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root  # code object of the outermost frame to keep
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def __enter__(self):
+        # The sampler needs the GIL to look; ask the interpreter to switch threads more often
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 2))
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+        return False
+
+    def report(self, top=30):
+        total = sum(self.stacks.values()) or 1
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                inclusive[name] += count
+        lines = [f'# {total} samples, one per {self.interval * 1000:g} ms', '',
+                 f"{'total %':>8} {'self %':>8}  function"]
+        for name, count in inclusive.most_common(top):
+            lines.append(f'{count * 100 / total:>8.1f} {own[name] * 100 / total:>8.1f}  {name}')
+        lines += ['', '# collapsed stacks (flamegraph.pl, speedscope)']
+        lines += [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+        return '\n'.join(lines) + '\n'
+
+class ProfilerMiddleware:
+    """WSGI middleware: profile a request when it carries `X-Profile: <token>`"""
+
+    def __init__(self, wsgi_app, token):
+        self.wsgi_app = wsgi_app
+        self.token = token
+
+    def __call__(self, environ, start_response):
+        supplied = environ.get('HTTP_X_PROFILE', '')
+        if not supplied or not hmac.compare_digest(supplied, self.token):
+            return self.wsgi_app(environ, start_response)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            return lambda data: None
+
+        mode = environ.get('HTTP_X_PROFILE_MODE', 'sample')
+        start = time.perf_counter()
+        if mode == 'cprofile':
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            profiler.enable()
+            size = self._drain(environ, capture)
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+            report = out.getvalue()
+        else:
+            with Sampler(threading.get_ident(), root=self._drain.__code__) as sampler:
+                size = self._drain(environ, capture)
+            report = sampler.report()
+        elapsed = (time.perf_counter() - start) * 1000
+
+        header = (f"# {environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')} -> {captured.get('status')}, "
+                  f"{size} bytes in {elapsed:.1f} ms ({mode})\n")
+        body = (header + report).encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; charset=utf-8'),
+                                  ('Content-Length', str(len(body))),
+                                  ('X-Profiled-Status', captured.get('status', ''))])
+        return [body]
+
+    def _drain(self, environ, capture):
+        """Run the app to completion (including streamed bodies) and return the body size"""
+        result = self.wsgi_app(environ, capture)
+        size = 0
+        try:
+            for chunk in result:
+                size += len(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return size
@@ -3,6 +3,36 @@ import os
 
 db_path = 'doctor_platform.db'
 
+# Secondary indexes declared in database.py: (name, table, columns)
+INDEXES = [
+    ('ix_appointment_doctor_status_date', 'appointment', 'doctor_id, status, date_time'),
+    ('ix_appointment_patient_date', 'appointment', 'patient_id, date_time'),
+    ('ix_appointment_status_date', 'appointment', 'status, date_time'),
+    ('ix_appointment_date_time', 'appointment', 'date_time'),
+    ('ix_appointment_created_at', 'appointment', 'created_at'),
+    ('ix_doctor_user_id', 'doctor', 'user_id'),
+    ('ix_doctor_hospital_id', 'doctor', 'hospital_id'),
+    ('ix_doctor_specialization', 'doctor', 'specialization'),
+    ('ix_doctor_city', 'doctor', 'city'),
+    ('ix_doctor_country', 'doctor', 'country'),
+    ('ix_hospital_city', 'hospital', 'city'),
+    ('ix_hospital_country', 'hospital', 'country'),
+    ('ix_slot_hold_expires', 'slot_hold', 'expires_at'),
+]
+
+# Partial unique index: one pending/confirmed appointment per doctor and time
+ACTIVE_SLOT_INDEX = ('ux_appointment_active_slot',
+                     "CREATE UNIQUE INDEX IF NOT EXISTS ux_appointment_active_slot "
+                     "ON appointment (doctor_id, date_time) WHERE status IN ('pending', 'confirmed')")
+
+# Partial index of the appointments still waiting for a reminder (see reminders.py)
+REMINDER_DUE_INDEX = ('ix_appointment_reminder_due',
+                      "CREATE INDEX IF NOT EXISTS ix_appointment_reminder_due ON appointment (status, reminder_sent_at, date_time) "
+                      "WHERE status = 'confirmed' AND reminder_sent_at IS NULL")
+
+# Unique Membership IDs, for databases that got the column as plain TEXT
+MEMBERSHIP_INDEX = 'ux_user_membership_id'
+
 print(f"Checking database at {db_path}...")
 
 try:
@@ -37,6 +67,23 @@ try:
     else:
         print("education column already exists in doctor table.")
 
+    # Row versions for the template fragment cache (see templating.py)
+    for table in ('user', 'doctor', 'hospital'):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if 'row_version' not in [info[1] for info in cursor.fetchall()]:
+            print(f"Adding row_version column to {table} table...")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1")
+        else:
+            print(f"row_version column already exists in {table} table.")
+
+    # Reminder marker (see reminders.py)
+    cursor.execute("PRAGMA table_info(appointment)")
+    if 'reminder_sent_at' not in [info[1] for info in cursor.fetchall()]:
+        print("Adding reminder_sent_at column to appointment table...")
+        cursor.execute("ALTER TABLE appointment ADD COLUMN reminder_sent_at DATETIME")
+    else:
+        print("reminder_sent_at column already exists in appointment table.")
+
     # Update appointment status: change 'scheduled' to 'pending'
     cursor.execute("SELECT COUNT(*) FROM appointment WHERE status = 'scheduled'")
     scheduled_count = cursor.fetchone()[0]
@@ -46,8 +93,85 @@ try:
     else:
         print("No appointments with 'scheduled' status to update.")
 
+    # Create secondary indexes (IF NOT EXISTS keeps this safe to re-run)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing_indexes = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    existing_tables = {row[0] for row in cursor.fetchall()}
+    for name, table, columns in INDEXES:
+        if table not in existing_tables:
+            # Created later with its indexes by `flask init-db`
+            continue
+        if name not in existing_indexes:
+            print(f"Creating index {name} on {table}({columns})...")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        else:
+            print(f"Index {name} already exists.")
+
+    name, create_sql = ACTIVE_SLOT_INDEX
+    if name not in existing_indexes:
+        # Older data may hold double bookings. Keep one appointment per slot
+        # (a confirmed one if any, else the earliest request) and cancel the rest.
+        cursor.execute("""
+            UPDATE appointment SET status = 'cancelled'
+            WHERE status IN ('pending', 'confirmed') AND id NOT IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY doctor_id, date_time
+                        ORDER BY status = 'confirmed' DESC, id
+                    ) AS rank
+                    FROM appointment WHERE status IN ('pending', 'confirmed')
+                ) WHERE rank = 1
+            )
+        """)
+        if cursor.rowcount:
+            print(f"Cancelled {cursor.rowcount} double-booked appointment(s)...")
+        print(f"Creating unique index {name} on appointment(doctor_id, date_time)...")
+        cursor.execute(create_sql)
+    else:
+        print(f"Index {name} already exists.")
+
+    name, create_sql = REMINDER_DUE_INDEX
+    if name not in existing_indexes:
+        print(f"Creating index {name} on {create_sql.split(' ON ', 1)[1]}...")
+        cursor.execute(create_sql)
+    else:
+        print(f"Index {name} already exists.")
+
+    # Membership IDs were added as plain TEXT: make them unique. Older
+    # random IDs may repeat; the oldest account keeps its ID, the others
+    # lose it and get a new one from backfill_membership.py
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing_indexes = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT COUNT(*) FROM pragma_index_list('user') AS i JOIN pragma_index_info(i.name) AS c "
+                   "WHERE i.\"unique\" AND c.name = 'membership_id' "
+                   "AND (SELECT COUNT(*) FROM pragma_index_info(i.name)) = 1")
+    if MEMBERSHIP_INDEX not in existing_indexes and not cursor.fetchone()[0]:
+        cursor.execute("""
+            UPDATE user SET membership_id = NULL
+            WHERE membership_id IS NOT NULL AND id NOT IN (
+                SELECT MIN(id) FROM user WHERE membership_id IS NOT NULL GROUP BY membership_id
+            )
+        """)
+        if cursor.rowcount:
+            print(f"Cleared {cursor.rowcount} duplicate Membership ID(s); run `flask init-db`, then "
+                  f"backfill_membership.py to reassign them.")
+        print(f"Creating unique index {MEMBERSHIP_INDEX} on user(membership_id)...")
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {MEMBERSHIP_INDEX} ON user (membership_id)")
+    else:
+        print("membership_id is already unique.")
+
+    # Statuses may have changed above: empty the dashboard counters so that
+    # `flask init-db` (stats.ensure_counters) recounts them
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stat_counter'")
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM stat_counter")
+    cursor.execute("ANALYZE")
+
     conn.commit()
     conn.close()
     print("Migration complete.")
+    # The app no longer creates tables at startup
+    print("Next: run `flask init-db` to add the newer tables and recount the dashboard statistics.")
 except Exception as e:
     print(f"Error during migration: {e}")
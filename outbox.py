@@ -0,0 +1,192 @@
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from smtplib import SMTPServerDisconnected
+from flask import current_app
+from sqlalchemy import insert, or_, update
+from sqlalchemy.orm import joinedload
+from database import db, EmailJob, Appointment, Doctor
+
+# Durable outbound email queue.
+#
+# Request handlers only insert an EmailJob row (in the same transaction as the
+# change that triggers the email) and return. A worker - a background thread
+# started by each web process's first request (EMAIL_WORKER_THREAD), or
+# `flask email-worker` in its own process - claims due jobs in batches,
+# renders them and sends each batch over one SMTP connection. Failed sends
+# are retried with exponential backoff until EMAIL_MAX_ATTEMPTS, then parked
+# as 'dead' for inspection.
+
+# kind -> function(job) returning a flask_mail.Message, or None when there is
+# nothing to send any more (the job is marked 'skipped')
+_builders = {}
+
+# What app.py falls back to when MAIL_USERNAME / MAIL_PASSWORD are not set
+_PLACEHOLDERS = {'MAIL_USERNAME': 'your-email@gmail.com', 'MAIL_PASSWORD': 'your-app-password'}
+
+_wake = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+# Errors that mean the SMTP connection itself is gone
+_CONNECTION_ERRORS = (SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+def register(kind, builder):
+    """Register the message builder for a job kind"""
+    _builders[kind] = builder
+
+def configured(config):
+    """True when SMTP credentials have been set, so queued jobs can be sent"""
+    return all(config.get(key) not in (None, '', placeholder) for key, placeholder in _PLACEHOLDERS.items())
+
+def enqueue(kind, appointment=None):
+    """Add a job to the current session; it is sent after the caller commits"""
+    job = EmailJob(kind=kind, appointment=appointment, next_attempt_at=datetime.utcnow())
+    db.session.add(job)
+    return job
+
+def enqueue_many(kind, appointment_ids):
+    """Add one job per appointment with a single bulk INSERT (sent after commit)"""
+    now = datetime.utcnow()
+    db.session.execute(insert(EmailJob), [
+        {'kind': kind, 'appointment_id': appointment_id, 'status': 'pending',
+         'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+        for appointment_id in appointment_ids
+    ])
+
+def notify(app=None):
+    """Wake the worker after committing new jobs, starting it if needed"""
+    app = app or current_app._get_current_object()
+    if app.config.get('EMAIL_WORKER_THREAD'):
+        ensure_worker(app)
+    _wake.set()
+
+def claim_jobs(now, limit):
+    """Atomically mark up to limit due jobs as 'sending' and return their ids.
+
+    A single UPDATE ... RETURNING, so concurrent workers (threads or
+    processes) never claim the same job. Jobs stuck in 'sending' longer than
+    the lease (a worker died mid-batch) are claimed again.
+    """
+    lease_cutoff = now - timedelta(seconds=current_app.config['EMAIL_LEASE_SECONDS'])
+    due = db.session.query(EmailJob.id).filter(or_(
+        (EmailJob.status == 'pending') & (EmailJob.next_attempt_at <= now),
+        (EmailJob.status == 'sending') & (EmailJob.claimed_at < lease_cutoff)
+    )).order_by(EmailJob.next_attempt_at).limit(limit)
+    ids = db.session.execute(
+        update(EmailJob)
+        .where(EmailJob.id.in_(due.scalar_subquery()))
+        .values(status='sending', claimed_at=now)
+        .returning(EmailJob.id)
+    ).scalars().all()
+    db.session.commit()
+    return ids
+
+def _mail():
+    """The app's Flask-Mail state, set up on the first send rather than at startup"""
+    app = current_app._get_current_object()
+    if 'mail' not in app.extensions:
+        from flask_mail import Mail
+        Mail(app)
+    return app.extensions['mail']
+
+def _record_failure(job, error):
+    config = current_app.config
+    job.attempts += 1
+    job.last_error = f"{type(error).__name__}: {error}"
+    if job.attempts >= config['EMAIL_MAX_ATTEMPTS']:
+        job.status = 'dead'
+        print(f"❌ Email job {job.id} moved to dead letters after {job.attempts} attempts: {job.last_error}")
+    else:
+        delay = config['EMAIL_RETRY_BASE_SECONDS'] * 2 ** (job.attempts - 1)
+        job.status = 'pending'
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+def process_batch(limit=None):
+    """Claim due jobs and send them over one SMTP connection.
+
+    Returns the number of jobs claimed (0 when the queue is idle).
+    """
+    limit = limit or current_app.config['EMAIL_BATCH_SIZE']
+    ids = claim_jobs(datetime.utcnow(), limit)
+    if not ids:
+        return 0
+    # The builders read the appointment, its patient and doctor: load them with the jobs
+    jobs = EmailJob.query.options(
+        joinedload(EmailJob.appointment).joinedload(Appointment.patient),
+        joinedload(EmailJob.appointment).joinedload(Appointment.doctor).joinedload(Doctor.user)
+    ).filter(EmailJob.id.in_(ids)).order_by(EmailJob.id).all()
+
+    # Render every message first: each commit below expires the loaded rows.
+    # flask_mail.Message reads the default sender from the extension, so set
+    # it up before the builders run
+    mail = _mail()
+    messages = []
+    for job in jobs:
+        try:
+            messages.append((job, _builders[job.kind](job)))
+        except Exception as e:
+            _record_failure(job, e)
+
+    try:
+        with mail.connect() as connection:
+            for job, message in messages:
+                try:
+                    if message is not None:
+                        connection.send(message)
+                except _CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    _record_failure(job, e)
+                else:
+                    job.status = 'sent' if message is not None else 'skipped'
+                    job.sent_at = datetime.utcnow()
+                    job.last_error = None
+                # Commit each result so a crash never resends delivered mail
+                db.session.commit()
+    except Exception as e:
+        # Could not connect, or the connection dropped: retry the rest later
+        for job, _ in messages:
+            if job.status == 'sending':
+                _record_failure(job, e)
+    db.session.commit()
+    return len(jobs)
+
+def run_worker(app, stop_event=None):
+    """Send jobs until stop_event is set, sleeping while the queue is idle"""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        processed = 0
+        with app.app_context():
+            try:
+                processed = process_batch()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                db.session.remove()
+        if not processed:
+            _wake.wait(app.config['EMAIL_POLL_SECONDS'])
+            _wake.clear()
+
+def ensure_worker(app):
+    """Start the in-process worker thread once per process"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_worker, args=(app,), name='email-outbox', daemon=True)
+            _worker.start()
+    return _worker
+
+def wait_until_idle(timeout=10.0):
+    """Block until no job is pending or sending (used by scripts and checks)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        busy = EmailJob.query.filter(EmailJob.status.in_(['pending', 'sending'])).count()
+        if not busy:
+            return True
+        db.session.rollback()
+        time.sleep(0.05)
+    return False
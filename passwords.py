@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy import update
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from database import db, User
+import identity
+
+# Password hashing, off the request threads.
+#
+# A password hash costs hundreds of milliseconds of CPU on purpose. Done on
+# request threads, a burst of logins takes every thread and every core, and
+# pages wait behind it. Here hashes run in a small process pool per app
+# process (PASSWORD_HASH_WORKERS, 0 = on the calling thread) whose processes
+# run at a lower CPU priority, so page requests win the CPU. At most
+# PASSWORD_HASH_QUEUE hashes per process are queued or running. Beyond that,
+# a caller waits up to PASSWORD_HASH_WAIT_SECONDS for a place and then gets
+# Overloaded, which the app answers with 503 and Retry-After. Threads stay
+# free for pages instead of piling up behind a backlog of logins.
+#
+# PASSWORD_HASH_METHOD sets the algorithm and cost of new hashes, in
+# werkzeug's notation: 'pbkdf2:sha256:600000', 'scrypt:32768:8:1', or just
+# 'scrypt' for werkzeug's defaults. When it changes, old hashes keep working.
+# verify() reports them as stale, and the login routes store a new hash of
+# the password they have just checked (upgrade()), so accounts migrate as
+# their users sign in.
+
+HASH_PRIORITY = 10  # os.nice() increment for the hashing processes
+
+_config = {'method': None, 'workers': 0, 'wait': 0.0}
+_slots = threading.BoundedSemaphore(1)
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+class Overloaded(Exception):
+    """Every hashing place is taken; answer 503 and let the client retry"""
+
+def init_app(app):
+    global _slots
+    _config['method'] = full_method(app.config['PASSWORD_HASH_METHOD'])
+    _config['workers'] = app.config['PASSWORD_HASH_WORKERS']
+    _config['wait'] = app.config['PASSWORD_HASH_WAIT_SECONDS']
+    _slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE'])
+
+def full_method(method):
+    """werkzeug's method string with its defaults filled in, as stored in hashes"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        return method if args else f'scrypt:{2 ** 15}:8:1'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f'Unsupported password hash method: {method}')
+
+def _executor():
+    global _pool, _pool_pid
+    with _pool_lock:
+        # A forked child (gunicorn with preload_app) needs its own pool
+        if _pool is None or _pool_pid != os.getpid():
+            nice = getattr(os, 'nice', None)
+            # spawn, not fork: the caller is a threaded server process
+            _pool = ProcessPoolExecutor(_config['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=nice, initargs=(HASH_PRIORITY,) if nice else ())
+            _pool_pid = os.getpid()
+        return _pool
+
+def _run(fn, *args):
+    global _pool
+    if not _slots.acquire(timeout=_config['wait']):
+        raise Overloaded()
+    try:
+        if not _config['workers']:
+            return fn(*args)
+        try:
+            return _executor().submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A hashing process died (OOM killer...): start a new pool next time
+            with _pool_lock:
+                _pool = None
+            raise Overloaded()
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    """Hash with the configured method; may raise Overloaded"""
+    return _run(generate_password_hash, password, _config['method'])
+
+def hash_many(plaintexts):
+    """Hash a batch (an import chunk) in one place of the queue; may raise Overloaded"""
+    return _run(_hash_all, list(plaintexts), _config['method'])
+
+def _hash_all(plaintexts, method):
+    return [generate_password_hash(password, method) for password in plaintexts]
+
+def needs_rehash(stored):
+    return stored.split('$', 1)[0] != _config['method']
+
+def verify(stored, password):
+    """(matches, needs_rehash) for a stored hash; may raise Overloaded"""
+    if not stored or not password:
+        return False, False
+    matches = _run(check_password_hash, stored, password)
+    return matches, matches and needs_rehash(stored)
+
+def upgrade(user, password):
+    """Replace a stale hash after a successful login, unless the pool is busy.
+
+    A plain UPDATE: the ORM hooks would bump the doctor pages' cache version
+    and row version for a column no page shows. It only applies if the hash
+    is still the one that was checked.
+    """
+    try:
+        new_hash = hash_password(password)
+    except Overloaded:
+        return  # next login
+    db.session.execute(update(User).where(User.id == user.id, User.password == user.password)
+                       .values(password=new_hash))
+    db.session.commit()
+    identity.invalidate(user.id)
@@ -0,0 +1,173 @@
+import base64
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import aliased, joinedload, selectinload
+from database import db, User, Doctor, Appointment, AppointmentArchive, Hospital
+
+# Page queries: each loads the object graph its template walks up front, so
+# rendering a list costs a fixed number of statements instead of one per row.
+# Many-to-one links are joined into the main SELECT; one-to-many collections
+# are loaded with a single extra IN query.
+
+def _doctor_cards():
+    """Doctors with the user (name) and hospital the cards display"""
+    return Doctor.query.options(joinedload(Doctor.user), joinedload(Doctor.hospital))
+
+def _appointment_rows():
+    """Appointments with patient and doctor -> user for the appointment tables"""
+    return Appointment.query.options(
+        joinedload(Appointment.patient),
+        joinedload(Appointment.doctor).joinedload(Doctor.user)
+    )
+
+def featured_doctors(limit=4):
+    """Doctors shown on the landing page"""
+    return _doctor_cards().limit(limit)
+
+def directory_doctors(specialty=None, city=None, country=None):
+    """Doctors for /doctors, filtered by the exact dropdown values"""
+    query = _doctor_cards()
+    if specialty:
+        query = query.filter(Doctor.specialization == specialty)
+    if city:
+        query = query.filter(Doctor.city == city)
+    if country:
+        query = query.filter(Doctor.country == country)
+    return query
+
+def directory_hospitals(city=None, country=None):
+    """Hospitals for /hospitals with their doctors (and the doctors' names)"""
+    query = Hospital.query.options(selectinload(Hospital.doctors).joinedload(Doctor.user))
+    if city:
+        query = query.filter(Hospital.city == city)
+    if country:
+        query = query.filter(Hospital.country == country)
+    return query
+
+def doctor_detail(doctor_id):
+    """One doctor with what /api/doctors/<id> returns"""
+    return _doctor_cards().filter(Doctor.id == doctor_id)
+
+def hospital_detail(hospital_id):
+    """One hospital with its doctors for /api/hospitals/<id>"""
+    return directory_hospitals().filter(Hospital.id == hospital_id)
+
+def admin_doctor_list():
+    """Doctors for the admin doctor table"""
+    return Doctor.query.options(joinedload(Doctor.user))
+
+def recent_appointments(limit=5):
+    """Most recently requested appointments for the admin dashboard"""
+    return _appointment_rows().order_by(Appointment.created_at.desc()).limit(limit)
+
+def patient_appointments(patient_id):
+    """A patient's own appointments for the patient dashboard"""
+    return _appointment_rows().filter(Appointment.patient_id == patient_id)
+
+def doctor_appointments(doctor_id):
+    """Appointments booked with a doctor for the doctor dashboard"""
+    return Appointment.query.options(joinedload(Appointment.patient)).filter(Appointment.doctor_id == doctor_id)
+
+# Archived appointments (see archive.py) have the same attributes, so the
+# dashboards render them alongside the current ones
+
+def patient_history(patient_id):
+    """A patient's appointments including the archived ones"""
+    archived = AppointmentArchive.query.options(
+        joinedload(AppointmentArchive.patient),
+        joinedload(AppointmentArchive.doctor).joinedload(Doctor.user)
+    ).filter(AppointmentArchive.patient_id == patient_id)
+    return patient_appointments(patient_id).all() + archived.all()
+
+def doctor_history(doctor_id):
+    """A doctor's appointments including the archived ones"""
+    archived = AppointmentArchive.query.options(joinedload(AppointmentArchive.patient)) \
+        .filter(AppointmentArchive.doctor_id == doctor_id)
+    return doctor_appointments(doctor_id).all() + archived.all()
+
+# --- Keyset pagination ---
+# Pages continue from the last row seen (WHERE key < last ORDER BY key) instead
+# of OFFSET, so page N costs the same index seek as page 1. Cursors are opaque
+# url-safe strings.
+
+PAGE_SIZE = 50
+EXPORT_BATCH_SIZE = 1000
+
+def encode_cursor(*values):
+    """Encode the sort key of the last row on a page"""
+    raw = '|'.join(v.isoformat() if isinstance(v, datetime) else str(v) for v in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode(cursor):
+    # binascii.Error and UnicodeDecodeError are both ValueErrors
+    return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+
+def decode_appointment_cursor(cursor):
+    """Decode a (date_time, id) cursor; raises ValueError if malformed"""
+    date_part, id_part = _decode(cursor).split('|')
+    return datetime.fromisoformat(date_part), int(id_part)
+
+def decode_id_cursor(cursor):
+    """Decode an id cursor; raises ValueError if malformed"""
+    return int(_decode(cursor))
+
+def _page(query, limit, key):
+    """Run a keyset query; returns (rows, cursor for the next page or None)"""
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+def appointments_page(cursor=None, limit=PAGE_SIZE):
+    """One page of /admin/appointments, newest slot first, keyed on (date_time, id)"""
+    query = _appointment_rows()
+    if cursor:
+        query = query.filter(tuple_(Appointment.date_time, Appointment.id) < decode_appointment_cursor(cursor))
+    query = query.order_by(Appointment.date_time.desc(), Appointment.id.desc())
+    return _page(query, limit, lambda a: (a.date_time, a.id))
+
+def doctors_page(specialty=None, city=None, country=None, cursor=None, limit=PAGE_SIZE):
+    """One page of the doctor directory, keyed on id"""
+    query = directory_doctors(specialty, city, country)
+    if cursor:
+        query = query.filter(Doctor.id > decode_id_cursor(cursor))
+    return _page(query.order_by(Doctor.id), limit, lambda d: (d.id,))
+
+def hospitals_page(city=None, country=None, cursor=None, limit=PAGE_SIZE):
+    """One page of the hospital directory, keyed on id"""
+    query = directory_hospitals(city, country)
+    if cursor:
+        query = query.filter(Hospital.id > decode_id_cursor(cursor))
+    return _page(query.order_by(Hospital.id), limit, lambda h: (h.id,))
+
+def iter_appointment_export(batch_size=EXPORT_BATCH_SIZE):
+    """Yield every appointment as a flat row for the streamed admin export,
+    the current ones first, then the archived ones.
+
+    Reads keyset batches of plain column tuples (no ORM objects, no identity
+    map), so memory stays constant however large the table is.
+    """
+    for model in (Appointment, AppointmentArchive):
+        yield from _export_rows(model, batch_size)
+
+def _export_rows(model, batch_size):
+    doctor_user = aliased(User)
+    stmt = (
+        select(model.id, model.date_time, model.type, model.status,
+               model.notes, User.name.label('patient_name'),
+               doctor_user.name.label('doctor_name'))
+        .join(User, model.patient_id == User.id)
+        .join(Doctor, model.doctor_id == Doctor.id)
+        .join(doctor_user, Doctor.user_id == doctor_user.id)
+        .order_by(model.date_time.desc(), model.id.desc())
+        .limit(batch_size)
+    )
+    last = None
+    while True:
+        batch_stmt = stmt if last is None else stmt.where(tuple_(model.date_time, model.id) < last)
+        rows = db.session.execute(batch_stmt).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last = (rows[-1].date_time, rows[-1].id)
@@ -0,0 +1,96 @@
+import threading
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update
+from database import db, Appointment
+import outbox
+
+# Appointment reminders.
+#
+# A scheduler (`flask reminder-scheduler`, or REMINDER_SCHEDULER_THREAD in
+# each web process) wakes every REMINDER_POLL_SECONDS and claims the
+# confirmed appointments starting within the next REMINDER_LEAD_HOURS that
+# have not been reminded yet: one UPDATE ... RETURNING over a range of
+# ix_appointment_reminder_due sets Appointment.reminder_sent_at, and the same
+# transaction queues an 'appointment_reminder' outbox job per appointment.
+# The outbox worker renders them and sends each batch over one SMTP
+# connection (outbox.py).
+#
+# That index holds only the confirmed appointments without a reminder, so a
+# wake-up reads the reminders due and not the ones already sent (past ones
+# leave it when archive.py closes them). reminder_sent_at is one of its
+# columns although it is always NULL there: that gives the query two
+# equality terms, so SQLite picks it over ix_appointment_status_date even
+# without ANALYZE statistics.
+#
+# The marker is set and the jobs are queued atomically, so a restart never
+# reminds twice and several schedulers can run at once: a row is claimed by
+# whichever UPDATE gets the write lock first. Appointments booked or
+# confirmed inside the lead time are reminded on the next wake-up.
+#
+# Without SMTP credentials nothing is claimed (as no confirmation is queued
+# then either), so the reminders still due go out once email is set up.
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def claim_due(now, limit):
+    """Mark up to limit due appointments as reminded, queue their reminders and return their ids"""
+    if not outbox.configured(current_app.config):
+        return []
+    due = db.session.query(Appointment.id).filter(
+        Appointment.status == 'confirmed',
+        Appointment.date_time >= now,
+        Appointment.date_time < now + timedelta(hours=current_app.config['REMINDER_LEAD_HOURS']),
+        Appointment.reminder_sent_at.is_(None)
+    ).order_by(Appointment.date_time).limit(limit)
+    ids = db.session.execute(
+        update(Appointment)
+        .where(Appointment.id.in_(due.scalar_subquery()))
+        .values(reminder_sent_at=now)
+        .returning(Appointment.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
+    if ids:
+        outbox.enqueue_many('appointment_reminder', ids)
+    db.session.commit()
+    return ids
+
+def queue_due(now=None, batch_size=None):
+    """Queue the reminders due at now (default: the current time); returns how many"""
+    now = now or datetime.now()
+    batch_size = batch_size or current_app.config['REMINDER_BATCH_SIZE']
+    queued = 0
+    while True:
+        ids = claim_due(now, batch_size)
+        queued += len(ids)
+        if len(ids) < batch_size:
+            break
+    if queued:
+        outbox.notify()
+    return queued
+
+def run_scheduler(app, stop_event=None, clock=datetime.now):
+    """Queue due reminders every REMINDER_POLL_SECONDS until stop_event is set"""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                queue_due(clock())
+            except Exception:
+                traceback.print_exc()
+            finally:
+                db.session.remove()
+        stop_event.wait(app.config['REMINDER_POLL_SECONDS'])
+
+def ensure_scheduler(app):
+    """Start the in-process scheduler thread once per process"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_scheduler, args=(app,), name='reminders', daemon=True)
+            _worker.start()
+    return _worker
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from database import db, User, Doctor, Hospital, Appointment, SlotHold, WorkingHours, ScheduleException, DataVersion
+
+# Response cache for public pages.
+#
+# Views decorated with @cached('doctor', ...) are stored per path, query
+# string and the current version of every data scope they read. Writes bump
+# the versions of the scopes they touch (automatically for ORM flushes, via
+# bump() for bulk Core statements) in the same transaction, so a new version
+# simply makes the old entries unreachable. Versions live in the database so
+# every worker process sees them, re-read at most every
+# RESPONSE_CACHE_VERSION_CHECK_SECONDS.
+#
+# Cached responses carry a strong ETag and answer If-None-Match with 304.
+# Logged-in users, admins and requests with pending flash messages always
+# get a fresh render.
+
+# Data scope each model belongs to
+SCOPES = {
+    Doctor: 'doctor',
+    Hospital: 'hospital',
+    Appointment: 'appointment',
+    SlotHold: 'appointment',
+    WorkingHours: 'appointment',  # schedules decide which slots are offered
+    ScheduleException: 'appointment',
+}
+
+# User columns the doctor pages render (the doctor's name)
+DOCTOR_USER_COLUMNS = ('name',)
+
+_versions = {}
+_versions_read_at = 0.0
+_versions_lock = threading.Lock()
+_backend = None
+_backend_lock = threading.Lock()
+
+class MemoryBackend:
+    """In-process LRU of entries"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class FileSystemBackend:
+    """One file per entry in a directory, shared by every worker process on the host"""
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.cache')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                stored_key, entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return entry if stored_key == key else None
+
+    def set(self, key, entry):
+        # Write to a temp file and rename, so readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, entry), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        """Drop the least recently written entries beyond max_entries"""
+        paths = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                path = os.path.join(self.directory, name)
+                try:
+                    paths.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        paths.sort()
+        for _, path in paths[:max(0, len(paths) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+def get_backend():
+    """The configured backend, or None when RESPONSE_CACHE_BACKEND is off"""
+    global _backend
+    config = current_app.config
+    kind = config.get('RESPONSE_CACHE_BACKEND')
+    if not kind:
+        return None
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if kind == 'filesystem':
+                    _backend = FileSystemBackend(config['RESPONSE_CACHE_DIR'], config['RESPONSE_CACHE_MAX_ENTRIES'])
+                else:
+                    _backend = MemoryBackend(config['RESPONSE_CACHE_MAX_ENTRIES'])
+    return _backend
+
+def reset():
+    """Forget the backend and versions (after changing the cache config)"""
+    global _backend, _versions_read_at
+    with _backend_lock:
+        _backend = None
+    _versions_read_at = 0.0
+
+def bump(scopes, session=None):
+    """Advance the version of each scope, in the session's current transaction"""
+    session = session or db.session
+    scopes = sorted(set(scopes))
+    if not scopes:
+        return
+    stmt = insert(DataVersion).values([{'scope': scope, 'version': 1} for scope in scopes])
+    session.connection().execute(stmt.on_conflict_do_update(
+        index_elements=[DataVersion.scope],
+        set_={'version': DataVersion.version + 1}
+    ))
+    session.info['response_cache_bumped'] = True
+
+def current_versions():
+    """{scope: version}, re-read from the database at most every few seconds"""
+    global _versions, _versions_read_at
+    max_age = current_app.config['RESPONSE_CACHE_VERSION_CHECK_SECONDS']
+    if time.monotonic() - _versions_read_at < max_age:
+        return _versions
+    with _versions_lock:
+        if time.monotonic() - _versions_read_at >= max_age:
+            read_at = time.monotonic()
+            _versions = dict(db.session.execute(select(DataVersion.scope, DataVersion.version)).all())
+            _versions_read_at = read_at
+    return _versions
+
+def _personalised():
+    return current_user.is_authenticated or session.get('admin_authenticated') or '_flashes' in session
+
+def _cache_key(scopes):
+    versions = current_versions()
+    query = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    stamp = ','.join(f'{scope}:{versions.get(scope, 0)}' for scope in scopes)
+    return f'{request.path}?{query}|{stamp}'
+
+def _finish(response, etag, state):
+    response.set_etag(etag)
+    # Browsers revalidate with If-None-Match; shared caches must not mix in logged-in pages
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    response.headers['X-Cache'] = state
+    return response.make_conditional(request)
+
+def cached(*scopes, ttl=None):
+    """Cache a public GET view under the versions of the data scopes it reads"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            backend = get_backend()
+            if backend is None or request.method != 'GET' or _personalised():
+                return view(*args, **kwargs)
+
+            key = _cache_key(scopes)
+            max_age = ttl or current_app.config['RESPONSE_CACHE_TTL_SECONDS']
+            entry = backend.get(key)
+            if entry is not None and time.time() - entry['stored_at'] < max_age:
+                response = current_app.response_class(entry['body'], status=entry['status'],
+                                                      mimetype=entry['mimetype'])
+                return _finish(response, entry['etag'], 'HIT')
+
+            response = make_response(view(*args, **kwargs))
+            # Only complete, successful, session-neutral responses are shared
+            if response.status_code != 200 or response.is_streamed or session.modified:
+                return response
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            backend.set(key, {'body': body, 'status': response.status_code, 'mimetype': response.mimetype,
+                              'etag': etag, 'stored_at': time.time()})
+            return _finish(response, etag, 'MISS')
+        return wrapper
+    return decorator
+
+@event.listens_for(Session, 'after_flush')
+def _bump_flushed_scopes(session, flush_context):
+    """Bump the scopes of every model written by this flush"""
+    scopes = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        scope = SCOPES.get(type(obj))
+        if scope and (obj not in session.dirty or session.is_modified(obj)):
+            scopes.add(scope)
+    # Patients and unrendered profile fields leave the doctor pages alone
+    for obj in session.dirty:
+        if isinstance(obj, User) and _doctor_name_changed(obj):
+            scopes.add('doctor')
+    if scopes:
+        bump(scopes, session)
+
+def _doctor_name_changed(user):
+    state = inspect(user)
+    changed = any(state.attrs[column].history.has_changes() for column in DOCTOR_USER_COLUMNS)
+    return changed and user.doctor_profile is not None
+
+@event.listens_for(Session, 'after_commit')
+def _reread_versions(session):
+    """Let this process see its own writes on the very next request"""
+    global _versions_read_at
+    if session.info.pop('response_cache_bumped', False):
+        _versions_read_at = 0.0
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_bump(session):
+    session.info.pop('response_cache_bumped', None)
@@ -0,0 +1,146 @@
+import re
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from database import db, User, Doctor, Hospital
+
+# Full-text directory search backed by an SQLite FTS5 table.
+#
+# One row per doctor and per hospital. The rowid encodes what the row is
+# (doctor id * 2, hospital id * 2 + 1), so a row can be replaced or deleted
+# by rowid without scanning the index. ORM writes keep it in sync through a
+# session after_flush hook; bulk loads that bypass the ORM must call
+# rebuild_index() (the `flask rebuild-search` command).
+
+SEARCH_TABLE = 'search_index'
+SEARCH_COLUMNS = ('name', 'specialization', 'education', 'bio', 'city', 'country', 'hospital', 'specialties')
+# bm25 weights, same order as SEARCH_COLUMNS: names and specialties rank first
+SEARCH_WEIGHTS = (10.0, 8.0, 2.0, 1.0, 4.0, 2.0, 4.0, 6.0)
+MAX_RESULTS = 50
+
+_DOCTOR_ROWS = f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)})
+    SELECT doctor.id * 2, user.name, doctor.specialization, doctor.education, doctor.bio,
+           doctor.city, doctor.country, hospital.name, NULL
+    FROM doctor
+    JOIN user ON user.id = doctor.user_id
+    LEFT JOIN hospital ON hospital.id = doctor.hospital_id
+"""
+_HOSPITAL_ROWS = f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)})
+    SELECT hospital.id * 2 + 1, hospital.name, NULL, NULL, hospital.description,
+           hospital.city, hospital.country, NULL, hospital.specialties
+    FROM hospital
+"""
+
+def create_index(connection):
+    """Create the FTS5 table if it does not exist yet"""
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        f"{', '.join(SEARCH_COLUMNS)}, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ))
+
+def rebuild_index(connection):
+    """Re-index every doctor and hospital from scratch"""
+    create_index(connection)
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    connection.execute(text(_DOCTOR_ROWS))
+    connection.execute(text(_HOSPITAL_ROWS))
+    connection.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+
+def ensure_index(connection):
+    """Create and fill the index on databases that don't have one yet"""
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': SEARCH_TABLE}).first()
+    if not exists:
+        rebuild_index(connection)
+
+def _id_list(ids):
+    # ids are ints taken from ORM instances, safe to inline
+    return ', '.join(str(int(i)) for i in ids)
+
+def reindex(connection, doctor_ids=(), hospital_ids=()):
+    """Replace the index rows of the given doctors and hospitals.
+
+    Ids that no longer exist are simply removed from the index.
+    """
+    if doctor_ids:
+        rowids = _id_list(i * 2 for i in doctor_ids)
+        connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({rowids})"))
+        connection.execute(text(f"{_DOCTOR_ROWS} WHERE doctor.id IN ({_id_list(doctor_ids)})"))
+    if hospital_ids:
+        rowids = _id_list(i * 2 + 1 for i in hospital_ids)
+        connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({rowids})"))
+        connection.execute(text(f"{_HOSPITAL_ROWS} WHERE hospital.id IN ({_id_list(hospital_ids)})"))
+
+def _renamed(obj):
+    return inspect(obj).attrs.name.history.has_changes()
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """Re-index doctors and hospitals touched by this flush"""
+    doctor_ids, hospital_ids = set(), set()
+    # A doctor's row also carries the user's name and the hospital's name
+    renamed_user_ids, renamed_hospital_ids = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Doctor):
+            doctor_ids.add(obj.id)
+        elif isinstance(obj, Hospital):
+            hospital_ids.add(obj.id)
+            if obj in session.dirty and _renamed(obj):
+                renamed_hospital_ids.add(obj.id)
+        elif isinstance(obj, User) and obj in session.dirty and _renamed(obj):
+            renamed_user_ids.add(obj.id)
+    if not (doctor_ids or hospital_ids or renamed_user_ids):
+        return
+
+    connection = session.connection()
+    if renamed_user_ids:
+        doctor_ids.update(connection.execute(text(
+            f"SELECT id FROM doctor WHERE user_id IN ({_id_list(renamed_user_ids)})")).scalars())
+    if renamed_hospital_ids:
+        doctor_ids.update(connection.execute(text(
+            f"SELECT id FROM doctor WHERE hospital_id IN ({_id_list(renamed_hospital_ids)})")).scalars())
+    reindex(connection, doctor_ids, hospital_ids)
+
+def build_match(query):
+    """Turn free text into an FTS5 prefix query: 'card ber' -> '"card"* "ber"*'
+
+    Returns None when the text has no searchable words.
+    """
+    words = re.findall(r'\w+', query or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+def search_query(query, limit=10):
+    """(statement, parameters) ranking the rows that match query, or None if it has no words"""
+    match = build_match(query)
+    if not match:
+        return None
+    weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+    return text(
+        f"SELECT rowid, name, specialization, city, country, hospital, specialties "
+        f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match "
+        f"ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT :limit"
+    ), {'match': match, 'limit': min(limit, MAX_RESULTS)}
+
+def search_results(rows):
+    """The JSON items for rows from search_query"""
+    results = []
+    for row in rows:
+        if row.rowid % 2 == 0:
+            results.append({'type': 'doctor', 'id': row.rowid // 2, 'name': row.name,
+                            'specialization': row.specialization, 'city': row.city,
+                            'country': row.country, 'hospital': row.hospital})
+        else:
+            results.append({'type': 'hospital', 'id': row.rowid // 2, 'name': row.name,
+                            'city': row.city, 'country': row.country, 'specialties': row.specialties})
+    return results
+
+def search(query, limit=10):
+    """Ranked doctors and hospitals matching every word of query as a prefix"""
+    statement = search_query(query, limit)
+    if statement is None:
+        return []
+    return search_results(db.session.execute(*statement))
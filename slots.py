@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, select, union_all
+from database import db, Appointment, SlotHold, ACTIVE_STATUSES
+from availability import SLOTS_PER_DAY, DEFAULT_MASK, load_schedules
+
+# Hourly slots; which hours a doctor offers on a day comes from their
+# schedule (working hours and exceptions, see availability.py)
+
+# Upper bound for a single range request (a little over two months)
+MAX_RANGE_DAYS = 62
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string into a datetime at midnight"""
+    return datetime.strptime(value, '%Y-%m-%d')
+
+# Built once and bound per call (see booked_times_query). A hold counts
+# unless it is the patient's own; with no patient, `IS NOT NULL` keeps them all.
+_BOOKED_QUERY = union_all(
+    select(Appointment.date_time).where(
+        Appointment.doctor_id == bindparam('doctor_id'),
+        Appointment.status.in_(ACTIVE_STATUSES),
+        Appointment.date_time >= bindparam('start'),
+        Appointment.date_time < bindparam('end')
+    ),
+    select(SlotHold.date_time).where(
+        SlotHold.doctor_id == bindparam('doctor_id'),
+        SlotHold.date_time >= bindparam('start'),
+        SlotHold.date_time < bindparam('end'),
+        SlotHold.expires_at > bindparam('now'),
+        SlotHold.patient_id.is_distinct_from(bindparam('patient_id'))
+    )
+)
+
+def booked_times_query(doctor_id, start, end, patient_id=None):
+    """(statement, parameters) behind get_booked_times, for callers with their own connection (see async_api.py)"""
+    return _BOOKED_QUERY, {'doctor_id': doctor_id, 'start': start, 'end': end, 'now': datetime.utcnow(),
+                           'patient_id': patient_id}
+
+def get_booked_times(doctor_id, start, end, patient_id=None):
+    """Return the set of taken datetimes for a doctor in [start, end).
+
+    A slot is taken by a pending or confirmed appointment, or by another
+    patient's unexpired hold (holds by patient_id don't count). Runs a single
+    range query instead of one lookup per slot.
+    """
+    return set(db.session.execute(*booked_times_query(doctor_id, start, end, patient_id)).scalars())
+
+def build_day_slots(day, booked, mask=DEFAULT_MASK):
+    """Build the slot list for one day from the day's schedule mask and an in-memory set of booked datetimes"""
+    slots = []
+    for hour in range(SLOTS_PER_DAY):
+        if not mask >> hour & 1:
+            continue
+        dt = day.replace(hour=hour, minute=0, second=0, microsecond=0)
+        slots.append({
+            'time': f"{hour:02d}:00",
+            'available': dt not in booked
+        })
+    return slots
+
+def get_slots_for_range(doctor_id, start_date, end_date, patient_id=None):
+    """Return {'YYYY-MM-DD': [slots]} for every day from start_date to end_date inclusive"""
+    end = end_date + timedelta(days=1)
+    booked = get_booked_times(doctor_id, start_date, end, patient_id)
+    schedule = load_schedules(db.session.connection(), [doctor_id], start_date.date(), end.date())[doctor_id]
+    return build_range_slots(start_date, end_date, booked, schedule)
+
+def build_range_slots(start_date, end_date, booked, schedule):
+    """{'YYYY-MM-DD': [slots]} from the booked datetimes and the doctor's Schedule"""
+    end = end_date + timedelta(days=1)
+    days = {}
+    day = start_date
+    while day < end:
+        days[day.strftime('%Y-%m-%d')] = build_day_slots(day, booked, schedule.mask(day.date()))
+        day += timedelta(days=1)
+    return days
+
+def get_slots_for_day(doctor_id, day, patient_id=None):
+    """Return the slot list for a single day"""
+    return get_slots_for_range(doctor_id, day, day, patient_id)[day.strftime('%Y-%m-%d')]
+
+def is_bookable_time(when):
+    """True if when falls on the slot grid (a whole hour); see availability.works_at for the doctor's hours"""
+    return when.minute == 0 and when.second == 0 and when.microsecond == 0
@@ -15,6 +15,20 @@ python3 -c "import flask_mail" 2>/dev/null || {
     pip3 install Flask-Mail
 }
 
-# Start Flask app
-python3 app.py
+# Development server: ./start_app.sh --dev
+if [ "$1" = "--dev" ]; then
+    python3 app.py
+    exit
+fi
+
+# Production server
+python3 -c "import gunicorn" 2>/dev/null || {
+    echo "❌ gunicorn not installed. Installing..."
+    pip3 install -r requirements.txt
+}
+# Create the database or add what an older one is missing; workers don't check
+flask --app "app:create_app()" init-db
+# Fingerprinted, precompressed static files (see assets.py)
+flask --app "app:create_app()" build-assets
+exec gunicorn -c gunicorn.conf.py wsgi:app
 
@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import Counter
+from sqlalchemy import event, func, inspect, select, text, union_all
+from sqlalchemy.dialects.sqlite import insert
+from database import db, User, Doctor, Appointment, AppointmentArchive, StatCounter
+
+# Admin dashboard statistics.
+#
+# Totals and histograms (users per role, doctors per specialization,
+# appointments per status) come from two sources with the same shape:
+#
+# - grouped_counts(): one GROUP BY per table, served from the column indexes
+# - read_counters(): one SELECT of the stat_counter table, which mapper hooks
+#   below keep current inside the same transaction as every ORM write
+#
+# Bulk Core writes bypass the hooks and must call adjust() themselves (see
+# appointment_status.py) or rebuild_counters() afterwards (the seeder,
+# `flask rebuild-stats`). Date-window breakdowns (per day, per doctor, per
+# specialization) are grouped queries over the date_time index, cached for
+# STATS_TTL_SECONDS so polling charts stay cheap.
+#
+# Archived appointments (see archive.py) still count: the totals include
+# them, and a date window that reaches back into the archive reads it too.
+
+STATS_TTL_SECONDS = 30
+
+# model -> (counter prefix, column); counter names look like 'appointment.status:pending'
+TRACKED = {
+    User: ('user', 'role'),
+    Doctor: ('doctor', 'specialization'),
+    Appointment: ('appointment', 'status'),
+}
+
+# model -> its archive table, counted with it
+ARCHIVES = {Appointment: AppointmentArchive}
+
+_window_cache = {}  # (start, end, top) -> (built_at, {...})
+_lock = threading.Lock()
+
+def counter_name(model, value):
+    prefix, column = TRACKED[model]
+    return f"{prefix}.{column}:{value or ''}"
+
+def adjust(connection, deltas):
+    """Add {counter name: delta} to the counters in the caller's transaction"""
+    rows = [{'name': name, 'value': delta} for name, delta in deltas.items() if delta]
+    if not rows:
+        return
+    stmt = insert(StatCounter).values(rows)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[StatCounter.name],
+        set_={'value': StatCounter.value + stmt.excluded.value}
+    ))
+
+def record_status_changes(connection, old_statuses, new_status):
+    """Counter update for a bulk UPDATE that moved rows from old_statuses to new_status"""
+    deltas = Counter()
+    for old in old_statuses:
+        deltas[counter_name(Appointment, old)] -= 1
+        deltas[counter_name(Appointment, new_status)] += 1
+    adjust(connection, deltas)
+
+def rebuild_counters(connection):
+    """Recount every tracked histogram from scratch"""
+    connection.execute(text("DELETE FROM stat_counter"))
+    for model, (prefix, column) in TRACKED.items():
+        source = model.__tablename__
+        if model in ARCHIVES:
+            source = f"(SELECT {column} FROM {source} UNION ALL SELECT {column} FROM {ARCHIVES[model].__tablename__})"
+        connection.execute(text(
+            f"INSERT INTO stat_counter (name, value) "
+            f"SELECT '{prefix}.{column}:' || COALESCE({column}, ''), COUNT(*) "
+            f"FROM {source} GROUP BY 1"
+        ))
+
+def ensure_counters(connection):
+    """Fill the counters on databases that don't have them yet"""
+    if connection.execute(text("SELECT 1 FROM stat_counter LIMIT 1")).first() is None:
+        rebuild_counters(connection)
+
+def _histograms(rows):
+    """{(prefix, value): count} -> {'appointment': {'total': n, 'by_status': {...}}, ...}"""
+    columns = dict(TRACKED.values())
+    result = {prefix: {'total': 0, f'by_{column}': {}} for prefix, column in columns.items()}
+    for (prefix, value), count in rows:
+        if not count:
+            continue
+        result[prefix]['total'] += count
+        histogram = result[prefix][f'by_{columns[prefix]}']
+        histogram[value] = histogram.get(value, 0) + count
+    return result
+
+def read_counters():
+    """Totals and histograms from the counters table (one query)"""
+    rows = []
+    for name, value in db.session.execute(select(StatCounter.name, StatCounter.value)):
+        key, _, column_value = name.partition(':')
+        rows.append(((key.split('.', 1)[0], column_value), value))
+    return _histograms(rows)
+
+def grouped_counts():
+    """Totals and histograms computed live (one GROUP BY per table)"""
+    rows = []
+    for model, (prefix, column) in TRACKED.items():
+        for table in (model, ARCHIVES.get(model)):
+            if table is None:
+                continue
+            column_attr = getattr(table, column)
+            for value, count in db.session.execute(select(column_attr, func.count()).group_by(column_attr)):
+                rows.append(((prefix, value or ''), count))
+    return _histograms(rows)
+
+def _window_rows(start, end):
+    """(doctor_id, date_time) of the appointments in [start, end), archived ones included if the window reaches them"""
+    def rows(model):
+        return select(model.doctor_id, model.date_time).where(model.date_time >= start, model.date_time < end)
+    archived_through = db.session.execute(select(func.max(AppointmentArchive.date_time))).scalar()
+    if archived_through is None or archived_through < start:
+        return rows(Appointment).subquery()
+    return union_all(rows(Appointment), rows(AppointmentArchive)).subquery()
+
+def _window(start, end, top):
+    appointments = _window_rows(start, end)
+    day = func.date(appointments.c.date_time).label('day')
+    per_day = db.session.execute(
+        select(day, func.count()).group_by(day).order_by(day)
+    )
+    count = func.count().label('appointments')
+    busiest = select(appointments.c.doctor_id, count) \
+        .group_by(appointments.c.doctor_id).order_by(count.desc()).limit(top).subquery()
+    per_doctor = db.session.execute(
+        select(busiest.c.doctor_id, User.name, busiest.c.appointments)
+        .join(Doctor, Doctor.id == busiest.c.doctor_id)
+        .join(User, User.id == Doctor.user_id)
+        .order_by(busiest.c.appointments.desc())
+    )
+    per_specialization = db.session.execute(
+        select(Doctor.specialization, func.count())
+        .select_from(appointments).join(Doctor, Doctor.id == appointments.c.doctor_id)
+        .group_by(Doctor.specialization).order_by(func.count().desc())
+    )
+    return {
+        'from': start.strftime('%Y-%m-%d'),
+        'to': end.strftime('%Y-%m-%d'),
+        'per_day': [{'date': d, 'appointments': n} for d, n in per_day],
+        'top_doctors': [{'doctor_id': i, 'name': name, 'appointments': n} for i, name, n in per_doctor],
+        'per_specialization': [{'specialization': s or '', 'appointments': n} for s, n in per_specialization],
+    }
+
+def appointment_window(start, end, top=10):
+    """Appointments in [start, end) per day, per top doctor and per specialization (cached)"""
+    key = (start, end, top)
+    entry = _window_cache.get(key)
+    if entry and time.monotonic() - entry[0] < STATS_TTL_SECONDS:
+        return entry[1]
+    with _lock:
+        entry = _window_cache.get(key)
+        if entry and time.monotonic() - entry[0] < STATS_TTL_SECONDS:
+            return entry[1]
+        if len(_window_cache) > 32:
+            _window_cache.clear()
+        window = _window(start, end, top)
+        _window_cache[key] = (time.monotonic(), window)
+        return window
+
+def _after_insert(mapper, connection, target):
+    adjust(connection, {counter_name(mapper.class_, getattr(target, TRACKED[mapper.class_][1])): 1})
+
+def _after_delete(mapper, connection, target):
+    adjust(connection, {counter_name(mapper.class_, getattr(target, TRACKED[mapper.class_][1])): -1})
+
+def _after_update(mapper, connection, target):
+    column = TRACKED[mapper.class_][1]
+    history = inspect(target).attrs[column].history
+    if not history.has_changes():
+        return
+    old = history.deleted[0] if history.deleted else None
+    new = getattr(target, column)
+    if (old or '') != (new or ''):
+        adjust(connection, {counter_name(mapper.class_, old): -1, counter_name(mapper.class_, new): 1})
+
+for _model in TRACKED:
+    event.listen(_model, 'after_insert', _after_insert)
+    event.listen(_model, 'after_update', _after_update)
+    event.listen(_model, 'after_delete', _after_delete)
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, has_request_context, before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+# Template rendering: compiled once, cached in fragments, and timed.
+#
+# - Compiled templates go to an on-disk bytecode cache (JINJA_BYTECODE_CACHE_DIR)
+#   and every template is loaded at startup, so gunicorn workers unmarshal
+#   code instead of each compiling the whole template tree on first use.
+# - {% call cache_fragment('doctor-card', doctor, doctor.user) %}...{% endcall %}
+#   renders the body once per key. Rows in the key contribute their
+#   (table, id, row_version), which every ORM update increments (database.py),
+#   so an edited doctor or hospital gets a new fragment and the old one ages
+#   out of the LRU.
+# - With RENDER_PROFILING on, render time is recorded per template and per
+#   block, and per request in g._render_ms for the request metrics
+#   (metrics.py), which set it against SQL time per route. Totals are served
+#   by /admin/api/render-profile.
+
+_fragments = OrderedDict()  # key -> Markup
+_fragment_stats = {'hits': 0, 'misses': 0}
+_lock = threading.Lock()
+
+# name -> [count, total ms, max ms]
+_templates = {}
+_blocks = {}
+
+def _record(table, key, ms):
+    with _lock:
+        entry = table.get(key)
+        if entry is None:
+            table[key] = [1, ms, ms]
+            return
+        entry[0] += 1
+        entry[1] += ms
+        entry[2] = max(entry[2], ms)
+
+def init_app(app):
+    env = app.jinja_env
+    directory = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        env.bytecode_cache = FileSystemBytecodeCache(directory)
+    env.globals['cache_fragment'] = cache_fragment
+
+    if app.config.get('RENDER_PROFILING'):
+        env.template_class = _profiled(env.template_class)
+        before_render_template.connect(_render_started, app)
+        template_rendered.connect(_render_finished, app)
+
+    if app.config.get('JINJA_PRECOMPILE'):
+        precompile(env)
+
+def precompile(env):
+    """Load every template (compiling it, or reading its bytecode) into the environment's cache"""
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    return names
+
+def _key_part(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_key_part(item) for item in value)
+    if hasattr(value, '__table__'):
+        return (value.__tablename__, value.id, value.row_version)
+    return value
+
+def cache_fragment(name, *depends_on, caller):
+    """Render the call block once per (name, rows and values it depends on)"""
+    size = current_app.config.get('FRAGMENT_CACHE_SIZE')
+    if not size:
+        return caller()
+    key = (name, _key_part(depends_on))
+    with _lock:
+        html = _fragments.get(key)
+        if html is not None:
+            _fragments.move_to_end(key)
+            _fragment_stats['hits'] += 1
+            return html
+        _fragment_stats['misses'] += 1
+    html = Markup(caller())
+    with _lock:
+        _fragments[key] = html
+        while len(_fragments) > size:
+            _fragments.popitem(last=False)
+    return html
+
+def clear_fragments():
+    with _lock:
+        _fragments.clear()
+
+# --- Profiling ---
+
+def _profiled(template_class):
+    class ProfiledTemplate(template_class):
+        """Template whose blocks record their render time"""
+
+        @classmethod
+        def _from_namespace(cls, environment, namespace, globals):
+            template = super()._from_namespace(environment, namespace, globals)
+            template.blocks = {name: _timed_block(template.name, name, render)
+                               for name, render in template.blocks.items()}
+            return template
+    return ProfiledTemplate
+
+def _timed_block(template_name, block_name, render):
+    key = f'{template_name}:{block_name}'
+
+    def timed(context):
+        start = time.perf_counter()
+        try:
+            yield from render(context)
+        finally:
+            # Includes nested blocks and any lazy loads the block triggers
+            _record(_blocks, key, (time.perf_counter() - start) * 1000)
+    return timed
+
+def _render_started(app, template, context, **extra):
+    if has_request_context():
+        g.setdefault('_render_starts', []).append(time.perf_counter())
+
+def _render_finished(app, template, context, **extra):
+    if has_request_context() and g.get('_render_starts'):
+        ms = (time.perf_counter() - g._render_starts.pop()) * 1000
+        _record(_templates, template.name, ms)
+        if not g._render_starts:  # nested renders are part of the outer one
+            g._render_ms = g.get('_render_ms', 0.0) + ms
+
+def _rows(table):
+    rows = [{'name': name, 'count': count, 'avg_ms': round(total / count, 3), 'max_ms': round(worst, 3)}
+            for name, (count, total, worst) in table.items()]
+    return sorted(rows, key=lambda row: row['avg_ms'] * row['count'], reverse=True)
+
+def profile_snapshot():
+    """Average render times per template and block, and fragment cache hits"""
+    with _lock:
+        return {
+            'templates': _rows(_templates),
+            'blocks': _rows(_blocks),
+            'fragments': dict(_fragment_stats, entries=len(_fragments)),
+        }
+
+def reset_profile():
+    with _lock:
+        _templates.clear()
+        _blocks.clear()
+        _fragment_stats.update(hits=0, misses=0)
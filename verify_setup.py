@@ -1,12 +1,14 @@
-from app import app, db
+from app import create_app, init_db, db
 from database import User, Doctor, Hospital
 
+app = create_app()
+
 def verify():
     print("Verifying setup...")
     with app.app_context():
         # Drop everything to handle schema changes cleanly for dev
         db.drop_all()
-        db.create_all()
+        init_db(app)
         print("Database tables created.")
 
         # Create Hospitals
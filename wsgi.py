@@ -0,0 +1,14 @@
+"""Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app     # Linux / macOS
+    python wsgi.py                            # waitress, any platform (incl. Windows)
+"""
+import os
+from app import create_app
+
+app = create_app()
+
+if __name__ == '__main__':
+    from waitress import serve
+    serve(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT') or 8000),
+          threads=int(os.environ.get('WAITRESS_THREADS') or 8))